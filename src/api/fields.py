@@ -0,0 +1,40 @@
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+
+
+class JSONField(models.TextField):
+    """Stores JSON serializable values
+
+    Uses a `jsonb` column on postgres and falls back to a text column holding
+    the serialized JSON on other databases (sqlite in development and tests).
+    Values are (de)serialized transparently in both cases.
+    """
+
+    description = "A JSON object"
+
+    def db_type(self, connection):
+        if connection.vendor == "postgresql":
+            return "jsonb"
+
+        return super().db_type(connection)
+
+    def from_db_value(self, value, expression, connection):
+        # psycopg2 already decodes jsonb columns
+        if value is None or connection.vendor == "postgresql":
+            return value
+
+        return json.loads(value)
+
+    def to_python(self, value):
+        return value
+
+    def get_prep_value(self, value):
+        if value is None:
+            return None
+
+        return json.dumps(value, cls=DjangoJSONEncoder)
+
+    def value_to_string(self, obj):
+        return self.get_prep_value(self.value_from_object(obj))
@@ -0,0 +1,219 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from api.models import KubeMetric, KubePod, MetricSeries, ModelRun
+
+BENCHMARK_NAME = "metric-query-benchmark"
+INSERT_BATCH_SIZE = 10000
+
+
+class Command(BaseCommand):
+    help = (
+        "Fills the metric table with synthetic data and times the queries "
+        "used by the metrics API and the pod monitor"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rows", type=int, default=10 ** 7, help="Number of metric rows"
+        )
+        parser.add_argument(
+            "--owners",
+            type=int,
+            default=100,
+            help="Number of runs and pods the rows are spread over",
+        )
+        parser.add_argument(
+            "--series", type=int, default=30, help="Metric names per owner"
+        )
+        parser.add_argument(
+            "--repeat", type=int, default=5, help="Repetitions per query"
+        )
+        parser.add_argument(
+            "--reuse",
+            action="store_true",
+            help="Reuse the data of a previous benchmark instead of generating it",
+        )
+        parser.add_argument(
+            "--cleanup", action="store_true", help="Delete the benchmark data"
+        )
+
+    def handle(self, *args, **options):
+        if options["cleanup"]:
+            self._cleanup()
+            return
+
+        if not options["reuse"]:
+            self._cleanup()
+            self._generate(options["rows"], options["owners"], options["series"])
+
+        run = ModelRun.objects.filter(name=BENCHMARK_NAME).first()
+        pod = KubePod.objects.filter(name=BENCHMARK_NAME).first()
+
+        if run is None or pod is None:
+            self.stderr.write("No benchmark data, run without --reuse first")
+            return
+
+        self.stdout.write(
+            "{} rows in api_kubemetric".format(KubeMetric.objects.count())
+        )
+
+        run_series = run.series.get(name="metric_0")
+        pod_series = pod.series.get(name="metric_0")
+        since = run_series.points.aggregate(Max("date"))["date__max"] - timedelta(
+            hours=1
+        )
+
+        queries = [
+            ("run series names", run.series.values("name"), list),
+            (
+                "full run series, ordered",
+                run_series.points.order_by("date").values("date", "value"),
+                list,
+            ),
+            (
+                "run series count",
+                run_series.points.all(),
+                lambda qs: qs.count(),
+            ),
+            (
+                "run series since, ordered",
+                run_series.points.filter(date__gte=since)
+                .order_by("date")
+                .values("date", "value"),
+                list,
+            ),
+            (
+                "latest pod metric date",
+                pod_series.points.all(),
+                lambda qs: qs.aggregate(Max("date")),
+            ),
+        ]
+
+        for label, qs, execute in queries:
+            timings = []
+
+            for _ in range(options["repeat"]):
+                start = time.perf_counter()
+                execute(qs.all())
+                timings.append(time.perf_counter() - start)
+
+            self.stdout.write(
+                "{:<30} median {:9.2f} ms  (min {:.2f} ms)".format(
+                    label, statistics.median(timings) * 1000, min(timings) * 1000
+                )
+            )
+            self.stdout.write("    plan: {}".format(self._plan(qs)))
+
+    @staticmethod
+    def _plan(qs):
+        sql, params = qs.query.sql_with_params()
+
+        if connection.vendor == "sqlite":
+            sql = "EXPLAIN QUERY PLAN " + sql
+        else:
+            sql = "EXPLAIN " + sql
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return " | ".join(str(row[-1]) for row in cursor.fetchall())
+
+    @staticmethod
+    def _cleanup():
+        # raw sql, deleting the runs through the ORM would try to stop their jobs
+        pattern = BENCHMARK_NAME + "%"
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "DELETE FROM api_kubemetric WHERE series_id IN "
+                "(SELECT s.id FROM api_metricseries s "
+                "LEFT JOIN api_modelrun r ON r.id = s.model_run_id "
+                "LEFT JOIN api_kubepod p ON p.id = s.pod_id "
+                "WHERE r.name LIKE %s OR p.name LIKE %s)",
+                [pattern, pattern],
+            )
+            cursor.execute(
+                "DELETE FROM api_metricseries WHERE model_run_id IN "
+                "(SELECT id FROM api_modelrun WHERE name LIKE %s) OR pod_id IN "
+                "(SELECT id FROM api_kubepod WHERE name LIKE %s)",
+                [pattern, pattern],
+            )
+            cursor.execute("DELETE FROM api_modelrun WHERE name LIKE %s", [pattern])
+            cursor.execute("DELETE FROM api_kubepod WHERE name LIKE %s", [pattern])
+
+    def _generate(self, rows, owners, series):
+        """Interleaves the points of all series the way the append-only
+        production table receives them"""
+        runs = [
+            ModelRun.objects.create(
+                name=BENCHMARK_NAME if i == 0 else "{}-{}".format(BENCHMARK_NAME, i)
+            ).id
+            for i in range(owners // 2)
+        ]
+        pods = [
+            KubePod.objects.create(
+                name=BENCHMARK_NAME if i == 0 else "{}-{}".format(BENCHMARK_NAME, i)
+            ).id
+            for i in range(owners - owners // 2)
+        ]
+        owner_columns = [(r, None) for r in runs] + [(None, p) for p in pods]
+
+        names = ["metric_{}".format(i) for i in range(series)]
+        MetricSeries.objects.bulk_create(
+            MetricSeries(model_run_id=run_id, pod_id=pod_id, name=name)
+            for run_id, pod_id in owner_columns
+            for name in names
+        )
+        series_ids = {
+            (s.model_run_id, s.pod_id, s.name): s.id
+            for s in MetricSeries.objects.filter(
+                Q(model_run_id__in=runs) | Q(pod_id__in=pods)
+            )
+        }
+
+        start = timezone.now() - timedelta(seconds=rows)
+        adapt_date = connection.ops.adapt_datetimefield_value
+
+        sql = (
+            "INSERT INTO api_kubemetric "
+            "(name, date, value, text_value, metadata, cumulative, model_run_id, pod_id,"
+            " series_id) VALUES (%s, %s, %s, '', NULL, %s, %s, %s, %s)"
+        )
+
+        def generate():
+            for i in range(rows):
+                run_id, pod_id = owner_columns[i % len(owner_columns)]
+                name = names[(i // len(owner_columns)) % series]
+                yield (
+                    name,
+                    adapt_date(start + timedelta(seconds=i)),
+                    random.random(),
+                    False,
+                    run_id,
+                    pod_id,
+                    series_ids[(run_id, pod_id, name)],
+                )
+
+        values = generate()
+        inserted = 0
+
+        while inserted < rows:
+            batch = [v for _, v in zip(range(INSERT_BATCH_SIZE), values)]
+
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.executemany(sql, batch)
+
+            inserted += len(batch)
+            if inserted % (INSERT_BATCH_SIZE * 100) == 0:
+                self.stdout.write("Inserted {} rows".format(inserted))
+
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE api_kubemetric")
@@ -0,0 +1,212 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from api.models import KubeMetric, MetricChunk, MetricSeries, ModelRun
+from api.utils import gorilla
+from api.utils.metric_chunks import EPOCH, read_chunks
+from api.utils.utils import matches_lookups
+
+BENCHMARK_NAME = "metric-storage-benchmark"
+INSERT_BATCH_SIZE = 10000
+
+# Seconds between two points, as recorded by the pod monitor
+INTERVAL = 5
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the size and read times of synthetic metrics stored as a row "
+        "per point and in Gorilla encoded chunks"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--points", type=int, default=10 ** 5, help="Number of points per series"
+        )
+        parser.add_argument(
+            "--jitter",
+            type=int,
+            default=0,
+            help="Maximum jitter of the dates of the points, in microseconds",
+        )
+        parser.add_argument(
+            "--repeat", type=int, default=5, help="Repetitions per read"
+        )
+        parser.add_argument(
+            "--cleanup", action="store_true", help="Delete the benchmark data"
+        )
+
+    def handle(self, *args, **options):
+        self._cleanup()
+
+        if options["cleanup"]:
+            return
+
+        series = self._series(options["points"], options["jitter"])
+
+        for layout, store, table in (
+            ("rows", self._store_rows, KubeMetric._meta.db_table),
+            ("chunks", self._store_chunks, MetricChunk._meta.db_table),
+        ):
+            run = ModelRun.objects.create(name="{}-{}".format(BENCHMARK_NAME, layout))
+            size = self._size(table)
+            start = time.perf_counter()
+
+            for name, points in series.items():
+                store(MetricSeries.objects.create(model_run=run, name=name), points)
+
+            self.stdout.write(
+                "{:<7} insert {:9.2f} s   {:9.1f} bytes per point".format(
+                    layout,
+                    time.perf_counter() - start,
+                    (self._size(table) - size) / (len(series) * options["points"]),
+                )
+            )
+
+            cpu = run.series.get(name="cpu")
+            since = max(series["cpu"])[0] - timedelta(hours=1)
+            reads = [
+                ("full series", {}),
+                ("last hour", {"date__gte": since}),
+            ]
+
+            for label, lookups in reads:
+                if layout == "rows":
+
+                    def read():
+                        return list(
+                            cpu.points.filter(**lookups)
+                            .order_by("date")
+                            .values("date", "value")
+                        )
+
+                else:
+
+                    def read():
+                        return [
+                            p
+                            for p in read_chunks(cpu, lookups)
+                            if matches_lookups(p, lookups)
+                        ]
+
+                timings = []
+
+                for _ in range(options["repeat"]):
+                    start = time.perf_counter()
+                    read()
+                    timings.append(time.perf_counter() - start)
+
+                self.stdout.write(
+                    "    {:<12} median {:9.2f} ms  (min {:.2f} ms)".format(
+                        label, statistics.median(timings) * 1000, min(timings) * 1000
+                    )
+                )
+
+    @staticmethod
+    def _series(points, jitter):
+        """A cpu (cores) and a memory (MiB) series, changing the way the pod
+        monitor sees them"""
+        start = timezone.now() - timedelta(seconds=points * INTERVAL)
+        dates = [
+            start
+            + timedelta(seconds=i * INTERVAL, microseconds=random.randint(0, jitter))
+            for i in range(points)
+        ]
+        cpu, memory = 0.5, 1024.0
+        series = {"cpu": [], "memory": []}
+
+        for date in dates:
+            cpu = round(min(max(cpu + random.gauss(0, 0.05), 0), 4), 3)
+            memory = max(memory + random.choice([0, 0, 0, 4, -4]), 64)
+            series["cpu"].append((date, cpu))
+            series["memory"].append((date, memory))
+
+        return series
+
+    @staticmethod
+    def _store_rows(series, points):
+        adapt_date = connection.ops.adapt_datetimefield_value
+        sql = (
+            "INSERT INTO api_kubemetric "
+            "(name, date, value, text_value, metadata, cumulative, model_run_id,"
+            " series_id) VALUES (%s, %s, %s, '', NULL, %s, %s, %s)"
+        )
+
+        for i in range(0, len(points), INSERT_BATCH_SIZE):
+            batch = [
+                (
+                    series.name,
+                    adapt_date(date),
+                    value,
+                    False,
+                    series.model_run_id,
+                    series.id,
+                )
+                for date, value in points[i : i + INSERT_BATCH_SIZE]
+            ]
+
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.executemany(sql, batch)
+
+    @staticmethod
+    def _store_chunks(series, points):
+        chunks = []
+
+        for i in range(0, len(points), MetricChunk.SIZE):
+            chunk = points[i : i + MetricChunk.SIZE]
+            chunks.append(
+                MetricChunk(
+                    series=series,
+                    start=chunk[0][0],
+                    end=chunk[-1][0],
+                    count=len(chunk),
+                    data=gorilla.encode(
+                        [(d - EPOCH) // timedelta(microseconds=1) for d, _ in chunk],
+                        [v for _, v in chunk],
+                    ),
+                )
+            )
+
+        MetricChunk.objects.bulk_create(chunks)
+
+    @staticmethod
+    def _size(table):
+        """Size of a table and its indexes, in bytes"""
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                cursor.execute("SELECT pg_total_relation_size(%s)", [table])
+            else:
+                cursor.execute(
+                    "SELECT SUM(pgsize) FROM dbstat WHERE name IN "
+                    "(SELECT name FROM sqlite_master WHERE tbl_name = %s)",
+                    [table],
+                )
+
+            return cursor.fetchone()[0] or 0
+
+    @staticmethod
+    def _cleanup():
+        # raw sql, deleting the runs through the ORM would try to stop their jobs
+        pattern = BENCHMARK_NAME + "%"
+        runs = "(SELECT id FROM api_modelrun WHERE name LIKE %s)"
+        series = "(SELECT id FROM api_metricseries WHERE model_run_id IN {})".format(
+            runs
+        )
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "DELETE FROM api_kubemetric WHERE model_run_id IN " + runs, [pattern]
+            )
+            cursor.execute(
+                "DELETE FROM api_metricchunk WHERE series_id IN " + series, [pattern]
+            )
+            cursor.execute(
+                "DELETE FROM api_metricseries WHERE model_run_id IN " + runs, [pattern]
+            )
+            cursor.execute("DELETE FROM api_modelrun WHERE name LIKE %s", [pattern])
@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.utils.metric_buffer import consumer_name, drain_metrics
+
+
+class Command(BaseCommand):
+    help = "Continuously moves buffered metrics from the redis stream to the database"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=None,
+            help="Maximum number of metrics inserted at once",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once the buffer is empty",
+        )
+
+    def handle(self, *args, **options):
+        if not settings.METRICS_WRITE_BEHIND:
+            raise CommandError("Write-behind buffering of metrics is disabled")
+
+        consumer = consumer_name()
+
+        while True:
+            handled = drain_metrics(
+                consumer,
+                count=options["batch_size"],
+                block=None if options["once"] else 5000,
+            )
+
+            if handled:
+                self.stdout.write("Inserted {} buffered metrics".format(handled))
+            elif options["once"]:
+                break
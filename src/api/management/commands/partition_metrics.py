@@ -0,0 +1,82 @@
+from datetime import datetime
+
+import pytz
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from api.utils.metric_partitions import (
+    MONTHS_AHEAD,
+    disable_partitioning,
+    drop_partitions,
+    enable_partitioning,
+    list_partitions,
+    month_start,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Partitions the metric table by month (postgres only), creates future "
+        "partitions and removes old ones"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--months-ahead",
+            type=int,
+            default=MONTHS_AHEAD,
+            help="Number of future months to create partitions for",
+        )
+        parser.add_argument(
+            "--retention-months",
+            type=int,
+            default=None,
+            help="Remove the metrics of months older than this",
+        )
+        parser.add_argument(
+            "--detach-only",
+            action="store_true",
+            help="Detach old partitions into standalone tables instead of dropping them",
+        )
+        parser.add_argument(
+            "--disable",
+            action="store_true",
+            help="Stop routing new metrics into partitions",
+        )
+        parser.add_argument(
+            "--list", action="store_true", help="List the existing partitions"
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("Metric partitioning requires postgres")
+
+        if options["list"]:
+            for name, start in list_partitions():
+                self.stdout.write("{} from {}".format(name, start.date()))
+            return
+
+        if options["disable"]:
+            disable_partitioning()
+            self.stdout.write("New metrics are no longer partitioned")
+            return
+
+        if not settings.METRICS_PARTITIONING:
+            # inserts have to avoid RETURNING, see api/utils/metric_partitions.py
+            raise CommandError(
+                "Set MLBENCH_METRICS_PARTITIONING=true before partitioning metrics"
+            )
+
+        for name in enable_partitioning(options["months_ahead"]):
+            self.stdout.write("Created partition {}".format(name))
+
+        if options["retention_months"] is not None:
+            before = month_start(datetime.now(pytz.utc), -options["retention_months"])
+
+            for name in drop_partitions(before, detach_only=options["detach_only"]):
+                self.stdout.write(
+                    "{} partition {}".format(
+                        "Detached" if options["detach_only"] else "Dropped", name
+                    )
+                )
@@ -0,0 +1,27 @@
+# Generated by Django 2.2.22 on 2026-10-18 08:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_modelrun_use_horovod'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='kubemetric',
+            name='rank',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='kubemetric',
+            name='seq',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='kubemetric',
+            constraint=models.UniqueConstraint(fields=('model_run', 'rank', 'seq'), name='unique_metric_sequence'),
+        ),
+    ]
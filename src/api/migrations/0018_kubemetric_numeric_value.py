@@ -0,0 +1,118 @@
+# Generated by Django 2.2.22 on 2026-10-18 08:12
+
+import math
+
+from django.db import migrations, models
+
+BATCH_SIZE = 5000
+
+# Postgres only: values that are certainly valid floats, converted in SQL.
+# Everything else (text, huge exponents, nan/inf) goes through python.
+NUMERIC_RE = r"^\s*[-+]?([0-9]+(\.[0-9]*)?|\.[0-9]+)([eE][-+]?[0-9]{1,2})?\s*$"
+
+
+def _split_value(raw):
+    try:
+        value = float(raw)
+    except (TypeError, ValueError):
+        return None, raw
+
+    if not math.isfinite(value):
+        return None, raw
+
+    return value, ""
+
+
+def split_values(apps, schema_editor):
+    KubeMetric = apps.get_model("api", "KubeMetric")
+    db_alias = schema_editor.connection.alias
+
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(
+            "UPDATE api_kubemetric SET numeric_value = value::double precision "
+            "WHERE value ~ %s",
+            [NUMERIC_RE],
+        )
+
+    metrics = KubeMetric.objects.using(db_alias).filter(numeric_value__isnull=True)
+    last_id = 0
+
+    while True:
+        batch = list(
+            metrics.filter(id__gt=last_id).order_by("id").only("id", "value")[
+                :BATCH_SIZE
+            ]
+        )
+
+        if not batch:
+            break
+
+        for metric in batch:
+            metric.numeric_value, metric.text_value = _split_value(metric.value)
+
+        KubeMetric.objects.using(db_alias).bulk_update(
+            batch, ["numeric_value", "text_value"]
+        )
+        last_id = batch[-1].id
+
+
+def join_values(apps, schema_editor):
+    KubeMetric = apps.get_model("api", "KubeMetric")
+    db_alias = schema_editor.connection.alias
+    metrics = KubeMetric.objects.using(db_alias)
+    last_id = 0
+
+    while True:
+        batch = list(
+            metrics.filter(id__gt=last_id)
+            .order_by("id")
+            .only("id", "numeric_value", "text_value")[:BATCH_SIZE]
+        )
+
+        if not batch:
+            break
+
+        for metric in batch:
+            if metric.numeric_value is None:
+                metric.value = metric.text_value[:255]
+            else:
+                metric.value = str(metric.numeric_value)
+
+        metrics.bulk_update(batch, ["value"])
+        last_id = batch[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_kubemetric_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='kubemetric',
+            name='text_value',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='kubemetric',
+            name='numeric_value',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        # nullable, so the column can be re-added when migrating backwards
+        migrations.AlterField(
+            model_name='kubemetric',
+            name='value',
+            field=models.CharField(max_length=255, null=True),
+        ),
+        migrations.RunPython(split_values, join_values),
+        migrations.RemoveField(
+            model_name='kubemetric',
+            name='value',
+        ),
+        migrations.RenameField(
+            model_name='kubemetric',
+            old_name='numeric_value',
+            new_name='value',
+        ),
+    ]
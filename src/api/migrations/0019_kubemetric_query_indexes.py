@@ -0,0 +1,49 @@
+# Generated by Django 2.2.22 on 2026-10-18 08:13
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_brin_index(apps, schema_editor):
+    # metrics are appended in (roughly) chronological order, a BRIN index on
+    # date is a tiny fraction of a btree's size for time range scans
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(
+            "CREATE INDEX IF NOT EXISTS kubemetric_date_brin "
+            "ON api_kubemetric USING brin (date)"
+        )
+
+
+def drop_brin_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute("DROP INDEX IF EXISTS kubemetric_date_brin")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_kubemetric_numeric_value'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='kubemetric',
+            index=models.Index(fields=['model_run', 'name', 'date'], name='kubemetric_run_name_date'),
+        ),
+        migrations.AddIndex(
+            model_name='kubemetric',
+            index=models.Index(fields=['pod', 'name', 'date'], name='kubemetric_pod_name_date'),
+        ),
+        # the single column FK indexes are prefixes of the composite ones
+        migrations.AlterField(
+            model_name='kubemetric',
+            name='model_run',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='metrics', to='api.ModelRun'),
+        ),
+        migrations.AlterField(
+            model_name='kubemetric',
+            name='pod',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='metrics', to='api.KubePod'),
+        ),
+        migrations.RunPython(create_brin_index, drop_brin_index),
+    ]
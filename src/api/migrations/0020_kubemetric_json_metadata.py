@@ -0,0 +1,130 @@
+# Generated by Django 2.2.22 on 2026-10-18 09:02
+
+import ast
+import json
+
+import api.fields
+from django.db import migrations, models
+
+BATCH_SIZE = 5000
+
+
+def _parse_metadata(raw):
+    if not raw:
+        return None
+
+    try:
+        return json.loads(raw)
+    except ValueError:
+        pass
+
+    # dicts posted by workers were saved as their python repr
+    try:
+        metadata = ast.literal_eval(raw)
+        json.dumps(metadata)
+        return metadata
+    except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+        return raw
+
+
+def _metadata_int(metadata, key):
+    if not isinstance(metadata, dict):
+        return None
+
+    try:
+        return int(metadata[key])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def parse_metadata(apps, schema_editor):
+    KubeMetric = apps.get_model("api", "KubeMetric")
+    metrics = KubeMetric.objects.using(schema_editor.connection.alias)
+    last_id = 0
+
+    while True:
+        batch = list(
+            metrics.filter(id__gt=last_id)
+            .order_by("id")
+            .only("id", "metadata", "rank")[:BATCH_SIZE]
+        )
+
+        if not batch:
+            break
+
+        for metric in batch:
+            metric.metadata_json = _parse_metadata(metric.metadata)
+            metric.epoch = _metadata_int(metric.metadata_json, "epoch")
+
+            if metric.rank is None:
+                metric.rank = _metadata_int(metric.metadata_json, "rank")
+
+        metrics.bulk_update(batch, ["metadata_json", "epoch", "rank"])
+        last_id = batch[-1].id
+
+
+def serialize_metadata(apps, schema_editor):
+    KubeMetric = apps.get_model("api", "KubeMetric")
+    metrics = KubeMetric.objects.using(schema_editor.connection.alias)
+    last_id = 0
+
+    while True:
+        batch = list(
+            metrics.filter(id__gt=last_id)
+            .order_by("id")
+            .only("id", "metadata_json")[:BATCH_SIZE]
+        )
+
+        if not batch:
+            break
+
+        for metric in batch:
+            if metric.metadata_json is None:
+                metric.metadata = ""
+            elif isinstance(metric.metadata_json, str):
+                metric.metadata = metric.metadata_json
+            else:
+                metric.metadata = json.dumps(metric.metadata_json)
+
+        metrics.bulk_update(batch, ["metadata"])
+        last_id = batch[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0019_kubemetric_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='kubemetric',
+            name='metadata_json',
+            field=api.fields.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='kubemetric',
+            name='epoch',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        # nullable, so the column can be re-added when migrating backwards
+        migrations.AlterField(
+            model_name='kubemetric',
+            name='metadata',
+            field=models.TextField(null=True),
+        ),
+        migrations.RunPython(parse_metadata, serialize_metadata),
+        migrations.RemoveField(
+            model_name='kubemetric',
+            name='metadata',
+        ),
+        migrations.RenameField(
+            model_name='kubemetric',
+            old_name='metadata_json',
+            new_name='metadata',
+        ),
+        migrations.AddIndex(
+            model_name='kubemetric',
+            index=models.Index(fields=['model_run', 'epoch', 'rank'], name='kubemetric_run_epoch_rank'),
+        ),
+    ]
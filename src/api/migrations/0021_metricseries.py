@@ -0,0 +1,41 @@
+# Generated by Django 2.2.22 on 2026-10-18 09:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0020_kubemetric_json_metadata'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MetricSeries',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50)),
+                ('cumulative', models.BooleanField(default=False)),
+                ('count', models.BigIntegerField(default=0)),
+                ('first_date', models.DateTimeField(blank=True, null=True)),
+                ('last_date', models.DateTimeField(blank=True, null=True)),
+                ('last_value', models.FloatField(blank=True, null=True)),
+                ('model_run', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='series', to='api.ModelRun')),
+                ('pod', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='series', to='api.KubePod')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='metricseries',
+            constraint=models.UniqueConstraint(fields=('model_run', 'name'), name='unique_run_series'),
+        ),
+        migrations.AddConstraint(
+            model_name='metricseries',
+            constraint=models.UniqueConstraint(fields=('pod', 'name'), name='unique_pod_series'),
+        ),
+        migrations.AddField(
+            model_name='kubemetric',
+            name='series',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='points', to='api.MetricSeries'),
+        ),
+    ]
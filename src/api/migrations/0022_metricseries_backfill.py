@@ -0,0 +1,52 @@
+# Generated by Django 2.2.22 on 2026-10-18 09:40
+
+from django.db import migrations
+from django.db.models import Count, Max, Min
+
+
+def create_series(apps, schema_editor):
+    KubeMetric = apps.get_model("api", "KubeMetric")
+    MetricSeries = apps.get_model("api", "MetricSeries")
+    db_alias = schema_editor.connection.alias
+    metrics = KubeMetric.objects.using(db_alias)
+
+    owners = (
+        metrics.values("model_run_id", "pod_id", "name")
+        .annotate(
+            count=Count("id"),
+            first_date=Min("date"),
+            last_date=Max("date"),
+        )
+        .order_by()
+    )
+
+    for owner in list(owners):
+        points = metrics.filter(
+            model_run_id=owner["model_run_id"],
+            pod_id=owner["pod_id"],
+            name=owner["name"],
+        )
+        last = points.order_by("-date").only("value", "cumulative").first()
+
+        series = MetricSeries.objects.using(db_alias).create(
+            model_run_id=owner["model_run_id"],
+            pod_id=owner["pod_id"],
+            name=owner["name"],
+            cumulative=last.cumulative,
+            count=owner["count"],
+            first_date=owner["first_date"],
+            last_date=owner["last_date"],
+            last_value=last.value,
+        )
+        points.update(series=series)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0021_metricseries'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_series, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 2.2.22 on 2026-10-18 09:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Applied after the backfill, in a transaction of its own: postgres can't alter
+# the table while the foreign key checks of the updated rows are pending
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0022_metricseries_backfill'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='kubemetric',
+            name='series',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='points', to='api.MetricSeries'),
+        ),
+        migrations.AddIndex(
+            model_name='kubemetric',
+            index=models.Index(fields=['series', 'date'], name='kubemetric_series_date'),
+        ),
+        # metrics are read through their series from now on
+        migrations.RemoveIndex(
+            model_name='kubemetric',
+            name='kubemetric_run_name_date',
+        ),
+        migrations.RemoveIndex(
+            model_name='kubemetric',
+            name='kubemetric_pod_name_date',
+        ),
+        migrations.AlterField(
+            model_name='kubemetric',
+            name='pod',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='metrics', to='api.KubePod'),
+        ),
+    ]
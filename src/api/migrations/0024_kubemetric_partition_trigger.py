@@ -0,0 +1,52 @@
+# Generated by Django 2.2.22 on 2026-10-18 10:05
+
+from django.db import migrations
+
+# Routes a new metric into the partition of its month (see
+# api/utils/metric_partitions.py). Installed as a trigger only once
+# partitioning is enabled.
+CREATE_FUNCTION = """
+CREATE OR REPLACE FUNCTION kubemetric_partition_insert() RETURNS trigger AS $$
+BEGIN
+    EXECUTE format(
+        'INSERT INTO %I SELECT ($1).*',
+        'api_kubemetric_y' || to_char(NEW.date AT TIME ZONE 'UTC', 'YYYY"m"MM')
+    ) USING NEW;
+    RETURN NULL;
+EXCEPTION
+    WHEN undefined_table THEN
+        -- no partition for this month, keep the metric in the parent table
+        RETURN NEW;
+    WHEN unique_violation THEN
+        -- idempotency key already stored, same as ON CONFLICT DO NOTHING
+        RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+"""
+
+DROP_FUNCTION = """
+DROP TRIGGER IF EXISTS kubemetric_partition_insert ON api_kubemetric;
+DROP FUNCTION IF EXISTS kubemetric_partition_insert();
+"""
+
+
+def create_function(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        # no params, the function body contains format() placeholders
+        schema_editor.execute(CREATE_FUNCTION, params=None)
+
+
+def drop_function(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(DROP_FUNCTION)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0023_kubemetric_series_not_null'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_function, drop_function),
+    ]
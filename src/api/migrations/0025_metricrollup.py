@@ -0,0 +1,31 @@
+# Generated by Django 2.2.22 on 2026-10-18 11:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0024_kubemetric_partition_trigger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MetricRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.IntegerField()),
+                ('date', models.DateTimeField()),
+                ('count', models.IntegerField(default=0)),
+                ('sum', models.FloatField(default=0.0)),
+                ('min', models.FloatField(blank=True, null=True)),
+                ('max', models.FloatField(blank=True, null=True)),
+                ('series', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='api.MetricSeries')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='metricrollup',
+            constraint=models.UniqueConstraint(fields=('series', 'resolution', 'date'), name='unique_rollup_bucket'),
+        ),
+    ]
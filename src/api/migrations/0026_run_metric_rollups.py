@@ -0,0 +1,76 @@
+# Generated by Django 2.2.22 on 2026-10-18 12:10
+
+from datetime import datetime
+
+import pytz
+from django.db import migrations
+
+CHUNK_SIZE = 5000
+
+# see MetricRollup.INGEST_RESOLUTIONS
+RESOLUTIONS = (1, 10, 60, 600)
+
+
+def create_rollups(apps, schema_editor):
+    """Computes the rollups of the points of run series stored so far"""
+    MetricSeries = apps.get_model("api", "MetricSeries")
+    MetricRollup = apps.get_model("api", "MetricRollup")
+    db_alias = schema_editor.connection.alias
+
+    for series_id in list(
+        MetricSeries.objects.using(db_alias)
+        .filter(pod__isnull=True)
+        .values_list("id", flat=True)
+    ):
+        rollups = {}
+        points = (
+            MetricSeries.objects.using(db_alias)
+            .get(id=series_id)
+            .points.filter(value__isnull=False)
+            .values_list("date", "value")
+        )
+
+        for date, value in points.iterator(chunk_size=CHUNK_SIZE):
+            timestamp = int(date.timestamp())
+
+            for resolution in RESOLUTIONS:
+                key = (resolution, timestamp - timestamp % resolution)
+                rollup = rollups.get(key)
+
+                if rollup is None:
+                    rollups[key] = MetricRollup(
+                        series_id=series_id,
+                        resolution=resolution,
+                        date=datetime.fromtimestamp(key[1], tz=pytz.utc),
+                        count=1,
+                        sum=value,
+                        min=value,
+                        max=value,
+                    )
+                else:
+                    rollup.count += 1
+                    rollup.sum += value
+                    rollup.min = min(rollup.min, value)
+                    rollup.max = max(rollup.max, value)
+
+        MetricRollup.objects.using(db_alias).bulk_create(
+            rollups.values(), batch_size=CHUNK_SIZE
+        )
+
+
+def delete_rollups(apps, schema_editor):
+    MetricRollup = apps.get_model("api", "MetricRollup")
+    MetricRollup.objects.using(schema_editor.connection.alias).filter(
+        series__pod__isnull=True
+    ).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0025_metricrollup'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_rollups, delete_rollups),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.22 on 2026-10-18 12:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0026_run_metric_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MetricArchive',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.BigIntegerField()),
+                ('data', models.BinaryField()),
+                ('series', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='archive', to='api.MetricSeries')),
+            ],
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 2.2.22 on 2026-10-18 13:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0027_metricarchive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MetricChunk',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.DateTimeField()),
+                ('end', models.DateTimeField()),
+                ('count', models.IntegerField()),
+                ('data', models.BinaryField()),
+                ('series', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='api.MetricSeries')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='metricchunk',
+            index=models.Index(fields=['series', 'start'], name='metricchunk_series_start'),
+        ),
+    ]
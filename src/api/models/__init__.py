@@ -1,5 +1,17 @@
 from api.models.kubemetric import KubeMetric
 from api.models.kubepod import KubePod
+from api.models.metricarchive import MetricArchive
+from api.models.metricchunk import MetricChunk
+from api.models.metricrollup import MetricRollup
+from api.models.metricseries import MetricSeries
 from api.models.modelrun import ModelRun
 
-__all__ = ["KubePod", "KubeMetric", "ModelRun"]
+__all__ = [
+    "KubePod",
+    "KubeMetric",
+    "MetricArchive",
+    "MetricChunk",
+    "MetricRollup",
+    "MetricSeries",
+    "ModelRun",
+]
@@ -1,18 +1,50 @@
-from django.db import models
+import math
 
+from django.conf import settings
+from django.db import connection, models, transaction
+
+from api.fields import JSONField
 from api.models.kubepod import KubePod
+from api.models.metricrollup import MetricRollup
+from api.models.metricseries import MetricSeries
 from api.models.modelrun import ModelRun
 
 
+def _is_partitioned():
+    return settings.METRICS_PARTITIONING and connection.vendor == "postgresql"
+
+
 class KubeMetric(models.Model):
     name = models.CharField(max_length=50)
     date = models.DateTimeField()
-    value = models.CharField(max_length=255)
-    metadata = models.TextField()
+    value = models.FloatField(blank=True, null=True)
+    # Non-numeric values (e.g. the official task result), `value` is null then
+    text_value = models.TextField(blank=True, default="")
+    metadata = JSONField(blank=True, null=True)
     cumulative = models.BooleanField(default=False)
 
+    # Copied from `metadata` if present, so metrics can be filtered on them
+    epoch = models.IntegerField(blank=True, null=True)
+
+    # Optional idempotency key supplied by workers, (model_run, rank, seq).
+    # The rank defaults to the one in `metadata`.
+    rank = models.IntegerField(blank=True, null=True)
+    seq = models.BigIntegerField(blank=True, null=True)
+
+    series = models.ForeignKey(
+        MetricSeries, related_name="points", on_delete=models.CASCADE, db_index=False
+    )
+
+    # Not indexed, metrics are read through their series. The metrics of a
+    # deleted pod are deleted with its series, and those of a run through the
+    # `model_run` prefix of an index in `Meta`
     pod = models.ForeignKey(
-        KubePod, related_name="metrics", blank=True, null=True, on_delete=models.CASCADE
+        KubePod,
+        related_name="metrics",
+        blank=True,
+        null=True,
+        on_delete=models.DO_NOTHING,
+        db_index=False,
     )
 
     model_run = models.ForeignKey(
@@ -21,4 +53,110 @@ class KubeMetric(models.Model):
         blank=True,
         null=True,
         on_delete=models.CASCADE,
+        db_index=False,
     )
+
+    def save(self, *args, **kwargs):
+        """Saves the metric, creating its series if needed
+
+        Inserting many metrics this way is slow, use
+        :func:`api.utils.metric_utils.insert_metrics` instead.
+
+        Once the table is partitioned (see :mod:`api.utils.metric_partitions`),
+        the insert trigger returns no id, so it's taken from the sequence first.
+        """
+        adding = self._state.adding
+
+        if adding and self.pk is None and _is_partitioned():
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT nextval(pg_get_serial_sequence(%s, 'id'))",
+                    [self._meta.db_table],
+                )
+                self.pk = cursor.fetchone()[0]
+
+            kwargs["force_insert"] = True
+
+        if self.series_id is None:
+            self.series, _ = MetricSeries.objects.get_or_create(
+                model_run=self.model_run,
+                pod=self.pod,
+                name=self.name,
+                defaults={"cumulative": self.cumulative},
+            )
+
+        with transaction.atomic():
+            if adding:
+                # see :func:`api.utils.metric_utils.insert_metrics`
+                MetricSeries.objects.select_for_update().filter(
+                    id=self.series_id
+                ).exists()
+
+            super().save(*args, **kwargs)
+
+            if adding:
+                MetricSeries.record_points([self])
+                MetricRollup.record_points([self])
+
+    @staticmethod
+    def split_value(raw):
+        """Splits a posted value into its numeric and text representation
+
+        Args:
+            raw (str | float): The value as posted
+
+        Returns:
+            (tuple[float | None, str]): The numeric value and `""`, or `None`
+                and the text for values that aren't finite numbers
+        """
+        try:
+            value = float(raw)
+        except (TypeError, ValueError):
+            return None, str(raw)
+
+        if not math.isfinite(value):
+            return None, str(raw)
+
+        return value, ""
+
+    @staticmethod
+    def metadata_int(metadata, key):
+        """Gets an integer entry (e.g. `epoch`) of the metadata
+
+        Args:
+            metadata: The metadata of a metric
+            key (str): The entry to get
+
+        Returns:
+            (int | None): The entry, or `None` if it is missing or not an integer
+        """
+        if not isinstance(metadata, dict):
+            return None
+
+        try:
+            return int(metadata[key])
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    @property
+    def display_value(self):
+        """The value as string, as metrics were stored before values were numeric"""
+        if self.value is None:
+            return self.text_value
+
+        return str(self.value)
+
+    class Meta:
+        # All metric queries filter on the series and order by date. On
+        # postgres, migration 0019 also adds a BRIN index on `date`.
+        indexes = [
+            models.Index(
+                fields=["model_run", "epoch", "rank"], name="kubemetric_run_epoch_rank"
+            ),
+            models.Index(fields=["series", "date"], name="kubemetric_series_date"),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["model_run", "rank", "seq"], name="unique_metric_sequence"
+            )
+        ]
@@ -0,0 +1,17 @@
+from django.db import models
+
+from api.models.metricseries import MetricSeries
+
+
+class MetricArchive(models.Model):
+    """Points of a series of an ended run, packed into a compressed blob
+
+    The points are deleted from the metric table once archived, see
+    :mod:`api.utils.metric_archive` for the format.
+    """
+
+    series = models.OneToOneField(
+        MetricSeries, related_name="archive", on_delete=models.CASCADE
+    )
+    count = models.BigIntegerField()
+    data = models.BinaryField()
@@ -0,0 +1,27 @@
+from django.db import models
+
+from api.models.metricseries import MetricSeries
+
+
+class MetricChunk(models.Model):
+    """Up to `SIZE` consecutive numeric points of a series, Gorilla encoded
+
+    Only used if `settings.METRICS_CHUNK_STORAGE` is enabled, see
+    :mod:`api.utils.metric_chunks`. `start` and `end` are the dates of the
+    first and last point.
+    """
+
+    SIZE = 120
+
+    series = models.ForeignKey(
+        MetricSeries, related_name="chunks", on_delete=models.CASCADE, db_index=False
+    )
+    start = models.DateTimeField()
+    end = models.DateTimeField()
+    count = models.IntegerField()
+    data = models.BinaryField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["series", "start"], name="metricchunk_series_start")
+        ]
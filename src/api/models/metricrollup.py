@@ -0,0 +1,205 @@
+import operator
+from datetime import datetime
+from functools import reduce
+
+import pytz
+from django.db import IntegrityError, models, transaction
+from django.db.models import Q
+
+from api.models.metricseries import MetricSeries
+
+# Attempts of a merge before giving up when other merges keep creating the
+# same rollups first
+MAX_MERGE_ATTEMPTS = 5
+
+
+class MetricRollup(models.Model):
+    """Aggregate of the points of a series in a fixed time bucket
+
+    `resolution` is the width of the bucket in seconds and `date` its start,
+    so rollups can be filtered like points. Only numeric values are aggregated.
+
+    Run series have rollups at all `INGEST_RESOLUTIONS`, kept up to date as
+    points are inserted. Pod series get rollups when their points are
+    downsampled, see :mod:`api.utils.metric_rollups`.
+    """
+
+    INGEST_RESOLUTIONS = (1, 10, 60, 600)
+
+    series = models.ForeignKey(
+        MetricSeries, related_name="rollups", on_delete=models.CASCADE, db_index=False
+    )
+    resolution = models.IntegerField()
+    date = models.DateTimeField()
+
+    count = models.IntegerField(default=0)
+    sum = models.FloatField(default=0.0)
+    min = models.FloatField(blank=True, null=True)
+    max = models.FloatField(blank=True, null=True)
+
+    @property
+    def mean(self):
+        if not self.count:
+            return None
+
+        return self.sum / self.count
+
+    @staticmethod
+    def bucket_start(date, resolution):
+        """Start of the bucket of width `resolution` (in seconds) containing `date`"""
+        if date.tzinfo is None:
+            date = date.replace(tzinfo=pytz.utc)
+
+        timestamp = int(date.timestamp())
+        return datetime.fromtimestamp(timestamp - timestamp % resolution, tz=pytz.utc)
+
+    @classmethod
+    def merge(cls, series_id, resolution, buckets):
+        """Adds aggregated values to the rollups of a series, creating missing ones
+
+        Args:
+            series_id (int): Id of the :obj:`MetricSeries`
+            resolution (int): Width of the buckets in seconds
+            buckets (dict): Bucket start to `[count, sum, min, max]` of the
+                values to add
+        """
+        cls.merge_all({(series_id, resolution, date): b for date, b in buckets.items()})
+
+    @classmethod
+    def merge_all(cls, buckets):
+        """Like `merge`, for the buckets of several series and resolutions
+        at once, with a query per operation
+
+        Existing rollups are locked while they're updated, so concurrent
+        merges into the same buckets don't overwrite each other. If another
+        merge creates one of the missing rollups first, the merge is retried
+        up to `MAX_MERGE_ATTEMPTS` times.
+
+        Args:
+            buckets (dict): `(series id, resolution, bucket start)` to
+                `[count, sum, min, max]` of the values to add
+
+        Raises:
+            IntegrityError: If the last attempt fails too
+        """
+        if not buckets:
+            return
+
+        for attempt in range(MAX_MERGE_ATTEMPTS):
+            try:
+                with transaction.atomic():
+                    cls._merge(buckets)
+                return
+            except IntegrityError:
+                if attempt == MAX_MERGE_ATTEMPTS - 1:
+                    raise
+
+    @classmethod
+    def _merge(cls, buckets):
+        dates = {}
+
+        for series_id, resolution, date in buckets:
+            dates.setdefault((series_id, resolution), []).append(date)
+
+        rollups = list(
+            cls.objects.select_for_update()
+            .filter(
+                reduce(
+                    operator.or_,
+                    (
+                        Q(series_id=series_id, resolution=resolution, date__in=d)
+                        for (series_id, resolution), d in dates.items()
+                    ),
+                )
+            )
+            .order_by("series_id", "resolution", "date")
+        )
+
+        for rollup in rollups:
+            count, total, minimum, maximum = buckets[
+                rollup.series_id, rollup.resolution, rollup.date
+            ]
+            rollup.count += count
+            rollup.sum += total
+            rollup.min = min(rollup.min, minimum)
+            rollup.max = max(rollup.max, maximum)
+
+        cls.objects.bulk_update(rollups, ["count", "sum", "min", "max"])
+
+        existing = {(r.series_id, r.resolution, r.date) for r in rollups}
+        cls.objects.bulk_create(
+            [
+                cls(
+                    series_id=series_id,
+                    resolution=resolution,
+                    date=date,
+                    count=bucket[0],
+                    sum=bucket[1],
+                    min=bucket[2],
+                    max=bucket[3],
+                )
+                for (series_id, resolution, date), bucket in buckets.items()
+                if (series_id, resolution, date) not in existing
+            ]
+        )
+
+    @classmethod
+    def aggregate(cls, rows, resolution):
+        """Aggregates `(date, count, sum, min, max)` rows into buckets
+
+        Args:
+            rows (iterable[tuple]): The rows, e.g. `(date, 1, v, v, v)` for a
+                single value `v`
+            resolution (int): Width of the buckets in seconds
+
+        Returns:
+            (dict): Bucket start to `[count, sum, min, max]`
+        """
+        buckets = {}
+
+        for date, count, total, minimum, maximum in rows:
+            bucket = cls.bucket_start(date, resolution)
+            aggregate = buckets.get(bucket)
+
+            if aggregate is None:
+                buckets[bucket] = [count, total, minimum, maximum]
+            else:
+                aggregate[0] += count
+                aggregate[1] += total
+                aggregate[2] = min(aggregate[2], minimum)
+                aggregate[3] = max(aggregate[3], maximum)
+
+        return buckets
+
+    @classmethod
+    def record_points(cls, points):
+        """Adds newly inserted points of run series to their rollups at all
+        `INGEST_RESOLUTIONS`
+
+        Args:
+            points (list[:obj:`KubeMetric`]): The inserted points
+        """
+        by_series = {}
+
+        for point in points:
+            if point.pod_id is None and point.value is not None:
+                value = point.value
+                by_series.setdefault(point.series_id, []).append(
+                    (point.date, 1, value, value, value)
+                )
+
+        cls.merge_all(
+            {
+                (series_id, resolution, date): bucket
+                for series_id, rows in by_series.items()
+                for resolution in cls.INGEST_RESOLUTIONS
+                for date, bucket in cls.aggregate(rows, resolution).items()
+            }
+        )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["series", "resolution", "date"], name="unique_rollup_bucket"
+            )
+        ]
@@ -0,0 +1,77 @@
+from django.db import models
+from django.db.models import Case, F, Value, When
+from django.db.models.functions import Coalesce, Greatest, Least
+
+from api.models.kubepod import KubePod
+from api.models.modelrun import ModelRun
+
+
+class MetricSeries(models.Model):
+    """A single metric (e.g. `train_loss`) of a run or pod
+
+    Holds what would otherwise have to be aggregated over all its points:
+    the number of points, the first and last date and the last value.
+    """
+
+    name = models.CharField(max_length=50)
+    cumulative = models.BooleanField(default=False)
+
+    count = models.BigIntegerField(default=0)
+    first_date = models.DateTimeField(blank=True, null=True)
+    last_date = models.DateTimeField(blank=True, null=True)
+    last_value = models.FloatField(blank=True, null=True)
+
+    pod = models.ForeignKey(
+        KubePod, related_name="series", blank=True, null=True, on_delete=models.CASCADE
+    )
+
+    model_run = models.ForeignKey(
+        ModelRun,
+        related_name="series",
+        blank=True,
+        null=True,
+        on_delete=models.CASCADE,
+    )
+
+    @property
+    def key(self):
+        return self.model_run_id, self.pod_id, self.name
+
+    @classmethod
+    def record_points(cls, points):
+        """Updates the statistics of the series with newly inserted points
+
+        Updates are relative to the stored values, so concurrent inserts
+        into the same series don't overwrite each other.
+
+        Args:
+            points (list[:obj:`KubeMetric`]): The inserted points
+        """
+        by_series = {}
+
+        for point in points:
+            by_series.setdefault(point.series_id, []).append(point)
+
+        for series_id, series_points in by_series.items():
+            first = Value(min(p.date for p in series_points), models.DateTimeField())
+            last = max(series_points, key=lambda p: p.date)
+            last_date = Value(last.date, models.DateTimeField())
+
+            cls.objects.filter(id=series_id).update(
+                count=F("count") + len(series_points),
+                first_date=Least(Coalesce("first_date", first), first),
+                last_value=Case(
+                    When(last_date__gt=last.date, then=F("last_value")),
+                    default=Value(last.value),
+                    output_field=models.FloatField(),
+                ),
+                last_date=Greatest(Coalesce("last_date", last_date), last_date),
+            )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["model_run", "name"], name="unique_run_series"
+            ),
+            models.UniqueConstraint(fields=["pod", "name"], name="unique_pod_series"),
+        ]
@@ -4,10 +4,12 @@ from time import sleep
 
 import django_rq
 from django.db import models
-from django.db.models.signals import pre_delete
+from django.db.models.signals import post_delete, pre_delete
 from django.dispatch import receiver
 from rq.job import Job, JobStatus
 
+from api.utils.metric_cache import invalidate_runs
+
 
 class ModelRun(models.Model):
     INITIALIZED = "initialized"
@@ -74,3 +76,9 @@ def _remove_run_job(sender, instance, using, **kwargs):
 @receiver(pre_delete, sender=ModelRun, dispatch_uid="run_delete_job")
 def remove_run_job(sender, instance, using, **kwargs):
     _remove_run_job(sender, instance, using, **kwargs)
+
+
+@receiver(post_delete, sender=ModelRun, dispatch_uid="run_delete_metric_cache")
+def remove_run_metric_cache(sender, instance, using, **kwargs):
+    """Signal to delete the cached metric queries of a deleted run"""
+    invalidate_runs([instance.id])
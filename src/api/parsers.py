@@ -0,0 +1,38 @@
+import json
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+
+class NDJSONParser(BaseParser):
+    """Parses newline delimited JSON, one object per line.
+
+    The body is consumed lazily: the parsed data is a generator yielding one
+    object per (non-empty) line as the body is read. Lines that aren't valid
+    JSON are yielded as :obj:`ParseError` so the consumer can report them
+    without aborting the rest of the upload.
+    """
+
+    media_type = "application/x-ndjson"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get("encoding", settings.DEFAULT_CHARSET)
+
+        return self._iter_objects(stream, encoding)
+
+    @staticmethod
+    def _iter_objects(stream, encoding):
+        if stream is None:
+            return
+
+        for line in stream:
+            line = line.strip()
+            if not line:
+                continue
+
+            try:
+                yield json.loads(line.decode(encoding))
+            except ValueError as e:
+                yield ParseError("JSON parse error - {}".format(e))
@@ -26,9 +26,9 @@ class ModelRunSerializer(serializers.HyperlinkedModelSerializer):
 
 class KubeMetricsSerializer(serializers.HyperlinkedModelSerializer):
     name = serializers.CharField(max_length=50)
-    value = serializers.CharField(max_length=100)
+    value = serializers.CharField(source="display_value", read_only=True)
     date = serializers.DateTimeField(format="%Y-%m-%dT%H:%M:%S.%fZ")
-    metadata = serializers.CharField()
+    metadata = serializers.JSONField(required=False)
     cumulative = serializers.BooleanField(default=False)
 
     class Meta:
@@ -1,15 +1,27 @@
 import datetime as dt
+import io
 import json
 import random
+import time
+import zipfile
 from ast import literal_eval
 from unittest.mock import MagicMock, create_autospec, patch
 
+from django.db import IntegrityError, connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from rest_framework import status
 from rest_framework.test import APITestCase
 
-from api.models import KubeMetric, ModelRun
+from api.models import KubeMetric, KubePod, MetricArchive, MetricRollup, ModelRun
+from api.models.metricrollup import MAX_MERGE_ATTEMPTS
+from api.utils.metric_archive import archive_ended_runs, archive_series
+from api.utils.metric_buffer import CLAIM_MIN_IDLE_MS, drain_metrics
+from api.utils.metric_rollups import downsample_series
+from api.utils.metric_utils import insert_metrics
 from api.utils.pod_monitor import _check_and_create_new_pods
+from api.views import warm_metric_cache
 
 
 class KubePodTests(APITestCase):
@@ -129,6 +141,42 @@ class ModelRunTests(APITestCase):
             runs = ModelRun.objects.all()
             self.assertEqual(len(runs), 0)
 
+    def test_conditional_get(self):
+        """Ensure unchanged runs are answered with 304, without their job for
+        finished runs"""
+        run = ModelRun.objects.create(name="Run1", job_id="job")
+        url = "/api/runs/{}/".format(run.pk)
+        job = MagicMock(meta={"stdout": ["Initializing run"]})
+
+        with patch("api.views.django_rq.get_connection"), patch(
+            "api.views.Job.fetch", return_value=job
+        ) as fetch:
+            response = self.client.get(url, format="json")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response["Cache-Control"], "no-cache")
+            etag = response["ETag"]
+
+            response = self.client.get(url, format="json", HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+            job.meta["stdout"].append("Created stateful set, starting run.")
+            response = self.client.get(url, format="json", HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+            run.state = ModelRun.FINISHED
+            run.finished_at = timezone.now()
+            run.save()
+            response = self.client.get(url, format="json")
+            self.assertEqual(response["Cache-Control"], "no-cache")
+            self.assertIn("Last-Modified", response)
+
+            fetch.reset_mock()
+            response = self.client.get(
+                url, format="json", HTTP_IF_NONE_MATCH=response["ETag"]
+            )
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+            fetch.assert_not_called()
+
     def test_invalid_run_name(self):
         response = self.client.post(
             "/api/runs/",
@@ -153,6 +201,7 @@ class ModelRunTests(APITestCase):
 
 
 class KubeMetricTests(APITestCase):
+    start = dt.datetime(2020, 6, 1, 12, tzinfo=dt.timezone.utc)
     names = [
         "start",
         "batch_load",
@@ -180,9 +229,9 @@ class KubeMetricTests(APITestCase):
         )
         self.run.save()
 
-        for i in range(100):
-            for j, name in enumerate(self.names):
-                metric = KubeMetric(
+        insert_metrics(
+            [
+                KubeMetric(
                     name=name,
                     date=(
                         timezone.now() - dt.timedelta(seconds=(100 - i) * 10 + (10 - j))
@@ -192,7 +241,47 @@ class KubeMetricTests(APITestCase):
                     cumulative=False,
                     model_run=self.run,
                 )
-                metric.save()
+                for i in range(100)
+                for j, name in enumerate(self.names)
+            ]
+        )
+
+    def insert_points(
+        self, names, indices, start=None, step=1, value=float, epoch=None, **kwargs
+    ):
+        """Inserts a point of each metric every `step` seconds from `start`
+
+        Arguments:
+            names {str|list} -- Name of the metrics
+            indices {iterable} -- Index of the points, in steps from `start`
+            start {datetime} -- Date of the point at index 0, `self.start` by default
+            step {int} -- Seconds between two points
+            value {callable} -- Value of the point at an index
+            epoch {callable} -- Epoch of the point at an index, None for no epoch
+            kwargs -- Other fields of the points, `model_run=self.run` by default
+        """
+        if isinstance(names, str):
+            names = [names]
+
+        kwargs.setdefault("cumulative", False)
+        kwargs.setdefault("model_run", self.run)
+        points = []
+
+        for i in indices:
+            if epoch is not None:
+                kwargs.update(metadata={"epoch": epoch(i)}, epoch=epoch(i))
+
+            for name in names:
+                points.append(
+                    KubeMetric(
+                        name=name,
+                        date=(start or self.start) + dt.timedelta(seconds=step * i),
+                        value=value(i),
+                        **kwargs,
+                    )
+                )
+
+        insert_metrics(points)
 
     def test_get_metric(self):
         """
@@ -226,3 +315,1173 @@ class KubeMetricTests(APITestCase):
 
         for name in self.names:
             assert len(res[name]) == 5
+
+    def test_create_metric(self):
+        """Ensure a single metric can be posted"""
+        # the rollups of all resolutions are locked and written at once
+        with self.assertNumQueries(13):
+            response = self.client.post(
+                "/api/metrics/",
+                {
+                    "run_id": self.run.id,
+                    "name": "accuracy",
+                    "date": "2018-08-03T09:21:44.331823Z",
+                    "value": "0.7845",
+                    "metadata": "",
+                    "cumulative": False,
+                },
+                format="json",
+            )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["value"], "0.7845")
+        self.assertEqual(self.run.metrics.filter(name="accuracy").count(), 1)
+
+        response = self.client.post(
+            "/api/metrics/",
+            {"run_id": self.run.id + 1, "name": "accuracy"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_create_metrics_batch(self):
+        """Ensure a batch of metrics for several runs is inserted at once"""
+        other_run = ModelRun(name="OtherRun")
+        other_run.save()
+
+        batch = [
+            {
+                "run_id": run_id,
+                "name": "loss",
+                "date": "2018-08-03T09:21:{:02d}.000000Z".format(i),
+                "value": str(i),
+                "metadata": {"epoch": i, "rank": 0},
+                "cumulative": False,
+            }
+            for i, run_id in enumerate([self.run.id, other_run.id, self.run.id])
+        ]
+        batch.append(dict(batch[0], run_id=other_run.id + 1))
+        batch.append({"run_id": self.run.id, "name": "loss"})
+        batch.append(dict(batch[0], date="not a date"))
+        # fields that don't fit their column
+        batch.append(dict(batch[0], cumulative="maybe"))
+        batch.append(dict(batch[0], rank=2 ** 40, seq=0))
+        batch.append(dict(batch[0], metadata={"epoch": 2 ** 40}))
+
+        response = self.client.post("/api/metrics/", batch, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["created"], 3)
+        self.assertEqual(
+            [e["index"] for e in response.data["errors"]], [3, 4, 5, 6, 7, 8]
+        )
+        self.assertEqual(self.run.metrics.filter(name="loss").count(), 2)
+        self.assertEqual(other_run.metrics.filter(name="loss").count(), 1)
+
+        response = self.client.post("/api/metrics/", batch[3:], format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data["created"], 0)
+
+    def test_create_metrics_ndjson(self):
+        """Ensure newline delimited metrics are streamed into the db in chunks"""
+        lines = [
+            json.dumps(
+                {
+                    "run_id": self.run.id,
+                    "name": "loss",
+                    "date": "2018-08-03T09:21:{:02d}.000000Z".format(i),
+                    "value": str(i),
+                    "metadata": {"epoch": i, "rank": 0},
+                    "cumulative": False,
+                }
+            )
+            for i in range(5)
+        ]
+        lines.insert(2, "{not json")
+        lines.insert(4, "")
+
+        with patch("api.utils.metric_utils.STREAM_CHUNK_SIZE", 2), patch.object(
+            ModelRun.objects, "in_bulk", wraps=ModelRun.objects.in_bulk
+        ) as in_bulk:
+            response = self.client.post(
+                "/api/metrics/",
+                "\n".join(lines),
+                content_type="application/x-ndjson",
+            )
+
+            # the run is only looked up once for the whole stream
+            in_bulk.assert_called_once()
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["created"], 5)
+        self.assertEqual(response.data["failed"], 1)
+        self.assertEqual(response.data["errors"][0]["index"], 2)
+        self.assertEqual(self.run.metrics.filter(name="loss").count(), 5)
+
+    def test_create_metrics_idempotent(self):
+        """Ensure retried metrics with the same sequence number are stored once"""
+        batch = [
+            {
+                "run_id": self.run.id,
+                "name": "loss",
+                "date": "2018-08-03T09:21:{:02d}.000000Z".format(i),
+                "value": str(i),
+                "rank": 1,
+                "seq": i,
+            }
+            for i in range(3)
+        ]
+
+        response = self.client.post("/api/metrics/", batch + batch[:1], format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.run.metrics.filter(name="loss").count(), 3)
+
+        # retry of a partially stored batch
+        batch.append(dict(batch[0], seq=3))
+        response = self.client.post("/api/metrics/", batch, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["errors"], [])
+        self.assertEqual(self.run.metrics.filter(name="loss").count(), 4)
+
+        # same sequence number from another rank is a different metric
+        response = self.client.post(
+            "/api/metrics/", dict(batch[0], rank=2), format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.run.metrics.filter(name="loss").count(), 5)
+
+        response = self.client.post("/api/metrics/", batch[0], format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.run.metrics.filter(name="loss").count(), 5)
+
+        # only inserted metrics are counted, also once archived
+        series = self.run.series.get(name="loss")
+        self.assertEqual(series.count, 5)
+        self.assertEqual(
+            sum(series.rollups.filter(resolution=1).values_list("count", flat=True)), 5
+        )
+        archive_series(series)
+
+        response = self.client.post("/api/metrics/", batch, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.run.metrics.filter(name="loss").count(), 0)
+        series.refresh_from_db()
+        self.assertEqual(series.count, 5)
+
+    def test_numeric_and_text_values(self):
+        """Ensure values are stored as numbers but still returned as strings"""
+        batch = [
+            {
+                "run_id": self.run.id,
+                "name": name,
+                "date": "2018-08-03T09:21:44.331823Z",
+                "value": value,
+            }
+            for name, value in [("accuracy", "0.75"), ("TaskResult @ 0", "done")]
+        ]
+        self.client.post("/api/metrics/", batch, format="json")
+
+        accuracy = self.run.metrics.get(name="accuracy")
+        self.assertEqual(accuracy.value, 0.75)
+        task_result = self.run.metrics.get(name="TaskResult @ 0")
+        self.assertIsNone(task_result.value)
+        self.assertEqual(task_result.text_value, "done")
+
+        response = self.client.get(
+            "/api/metrics/{}/?metric_type=run".format(self.run.id), format="json"
+        )
+        res = response.json()
+        self.assertEqual(res["accuracy"][0]["value"], "0.75")
+        self.assertEqual(res["TaskResult @ 0"][0]["value"], "done")
+        self.assertIsInstance(res["init"][0]["value"], str)
+
+    def test_metric_metadata(self):
+        """Ensure metadata is stored as JSON and epoch and rank can be filtered on"""
+        batch = [
+            {
+                "run_id": self.run.id,
+                "name": "loss",
+                "date": "2018-08-03T09:21:{:02d}.000000Z".format(i),
+                "value": str(i),
+                "metadata": {"epoch": i // 2, "rank": i % 2, "type": "train"},
+            }
+            for i in range(6)
+        ]
+        self.client.post("/api/metrics/", batch, format="json")
+
+        metric = self.run.metrics.get(name="loss", date__second=3)
+        self.assertEqual(metric.metadata, {"epoch": 1, "rank": 1, "type": "train"})
+        self.assertEqual((metric.epoch, metric.rank), (1, 1))
+
+        response = self.client.get(
+            "/api/metrics/{}/?metric_type=run&epoch=1&rank=1".format(self.run.id),
+            format="json",
+        )
+        res = response.json()
+        self.assertEqual(list(res), ["loss"])
+        self.assertEqual([m["value"] for m in res["loss"]], ["3.0"])
+
+    def test_metric_series(self):
+        """Ensure each run metric has a series tracking its points"""
+        self.assertEqual(
+            sorted(self.run.series.values_list("name", flat=True)), sorted(self.names)
+        )
+
+        batch = [
+            {
+                "run_id": self.run.id,
+                "name": "loss",
+                "date": "2018-08-03T09:21:{:02d}.000000Z".format(i),
+                "value": str(i),
+            }
+            for i in [5, 2, 7]
+        ]
+        self.client.post("/api/metrics/", batch[:2], format="json")
+        self.client.post("/api/metrics/", batch[2:], format="json")
+
+        # single metrics are saved into the same series
+        KubeMetric(
+            name="loss",
+            date=timezone.make_aware(dt.datetime(2018, 8, 3, 9, 21, 6)),
+            value=6.0,
+            model_run=self.run,
+        ).save()
+
+        series = self.run.series.get(name="loss")
+        self.assertEqual(series.count, 4)
+        self.assertEqual(series.points.count(), 4)
+        self.assertEqual(series.first_date.second, 2)
+        self.assertEqual(series.last_date.second, 7)
+        self.assertEqual(series.last_value, 7.0)
+
+    def test_summarize_rollups(self):
+        """Ensure summarized metrics are read from the rollups"""
+        self.insert_points("acc", range(60), epoch=lambda i: i // 30)
+
+        series = self.run.series.get(name="acc")
+        self.assertEqual(
+            sorted(series.rollups.values_list("resolution", "count")),
+            [(1, 1)] * 60 + [(10, 10)] * 6 + [(60, 60), (600, 60)],
+        )
+
+        response = self.client.get(
+            "/api/metrics/{}/?metric_type=run&summarize=6&metric_filter=acc".format(
+                self.run.id
+            ),
+            format="json",
+        )
+        self.assertEqual(
+            [m["value"] for m in response.json()["acc"]],
+            ["4.5", "14.5", "24.5", "34.5", "44.5", "54.5"],
+        )
+
+        # filters on the points can't use the rollups
+        response = self.client.get(
+            "/api/metrics/{}/?metric_type=run&summarize=3&epoch=1&metric_filter=acc".format(
+                self.run.id
+            ),
+            format="json",
+        )
+        self.assertEqual(
+            [m["value"] for m in response.json()["acc"]], ["34.5", "44.5", "54.5"]
+        )
+
+        # groups of 9, the last incomplete one is dropped as for the points
+        url = "/api/metrics/{}/?metric_type=run&summarize=7&metric_filter=acc".format(
+            self.run.id
+        )
+        result = self.client.get(url, format="json").json()
+        self.assertEqual(len(result["acc"]), 6)
+
+        with patch("api.views._rollup_summaries", return_value={}):
+            self.assertEqual(self.client.get(url, format="json").json(), result)
+
+        for summarize in ("0", "-1", "many"):
+            response = self.client.get(
+                "/api/metrics/{}/?metric_type=run&summarize={}".format(
+                    self.run.id, summarize
+                ),
+                format="json",
+            )
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_rollup_merge_attempts(self):
+        """Ensure a merge that keeps conflicting gives up instead of looping"""
+        with patch.object(
+            MetricRollup, "_merge", side_effect=IntegrityError
+        ) as merge, self.assertRaises(IntegrityError):
+            self.insert_points("acc", range(3))
+
+        self.assertEqual(merge.call_count, MAX_MERGE_ATTEMPTS)
+
+    def test_last_n(self):
+        """Ensure last_n returns the same points in json, zip and without
+        window functions"""
+        start = timezone.now() + dt.timedelta(minutes=1)
+        self.insert_points(["acc", "loss"], range(20), start=start)
+        url = "/api/metrics/{}/?metric_type=run&last_n=3".format(self.run.id)
+
+        result = self.client.get(url, format="json").json()
+        self.assertEqual([m["value"] for m in result["acc"]], ["17.0", "18.0", "19.0"])
+        self.assertEqual(result["loss"], result["acc"])
+        self.assertEqual(len(result["start"]), 3)
+
+        with patch.object(connection.features, "supports_over_clause", False):
+            self.assertEqual(self.client.get(url, format="json").json(), result)
+
+        response = self.client.get(url + "&format=zip")
+
+        with zipfile.ZipFile(io.BytesIO(response.content)) as zf:
+            self.assertEqual(
+                [m["value"] for m in json.loads(zf.read("result_acc.json"))],
+                ["17.0", "18.0", "19.0"],
+            )
+
+    def test_downsample_modes(self):
+        """Ensure lttb and m4 keep the spikes averaging summaries flatten"""
+        self.insert_points(
+            "loss", range(500), value=lambda i: 100.0 if i == 123 else 1.0
+        )
+        url = "/api/metrics/{}/?metric_type=run&metric_filter=loss&summarize=20".format(
+            self.run.id
+        )
+
+        res = self.client.get(url, format="json").json()["loss"]
+        self.assertNotIn("100.0", [m["value"] for m in res])
+
+        res = self.client.get(url + "&downsample=lttb", format="json").json()["loss"]
+        self.assertEqual(len(res), 20)
+        self.assertIn(
+            {"date": "2020-06-01T12:02:03Z", "value": "100.0", "cumulative": False},
+            res,
+        )
+
+        res = self.client.get(url + "&downsample=m4", format="json").json()["loss"]
+        self.assertLessEqual(len(res), 4 * 20)
+        self.assertIn("100.0", [m["value"] for m in res])
+
+        response = self.client.get(url + "&downsample=median", format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_summarize_in_database(self):
+        """Ensure points are summarized the same in the database and in python"""
+        self.insert_points("loss", range(35), epoch=lambda i: 0)
+        url = "/api/metrics/{}/?metric_type=run&summarize=4&epoch=0".format(self.run.id)
+
+        result = self.client.get(url, format="json").json()
+        self.assertEqual(
+            [(m["date"], m["value"]) for m in result["loss"]],
+            [
+                ("2020-06-01T12:00:00Z", "4.0"),
+                ("2020-06-01T12:00:09Z", "13.0"),
+                ("2020-06-01T12:00:18Z", "22.0"),
+            ],
+        )
+
+        with patch.object(connection.features, "supports_over_clause", False):
+            self.assertEqual(self.client.get(url, format="json").json(), result)
+
+    def test_constant_queries(self):
+        """Ensure the number of queries doesn't depend on the number of series"""
+        urls = [
+            "/api/metrics/{}/?metric_type=run".format(self.run.id),
+            "/api/metrics/{}/?metric_type=run&summarize=10".format(self.run.id),
+            "/api/metrics/{}/?metric_type=run&summarize=10&epoch=0".format(self.run.id),
+        ]
+
+        def count_queries():
+            counts = []
+
+            for url in urls:
+                with CaptureQueriesContext(connection) as queries:
+                    self.client.get(url, format="json")
+
+                counts.append(len(queries))
+
+            return counts
+
+        def insert_series(names):
+            self.insert_points(
+                names, range(30), start=timezone.now(), step=-1, epoch=lambda i: 0
+            )
+
+        insert_series("extra_0")
+        before = count_queries()
+        insert_series(["extra_{}".format(j) for j in range(1, 20)])
+
+        self.assertEqual(count_queries(), before)
+
+    def test_aggregate(self):
+        """Ensure metrics can be aggregated into time buckets"""
+        self.insert_points("loss", range(5, 30))
+        url = "/api/metrics/{}/aggregate/?metric_type=run&metric_filter=loss".format(
+            self.run.id
+        )
+        expected = [
+            {"date": "2020-06-01T12:00:00Z", "mean": 7.0, "min": 5.0, "count": 5},
+            {"date": "2020-06-01T12:00:10Z", "mean": 14.5, "min": 10.0, "count": 10},
+            {"date": "2020-06-01T12:00:20Z", "mean": 24.5, "min": 20.0, "count": 10},
+        ]
+
+        res = self.client.get(url + "&bucket=10s&fn=mean,min&fn=count").json()
+        self.assertEqual(res, {"loss": expected})
+
+        # percentiles aren't supported by sqlite, nor archives by the database
+        res = self.client.get(url + "&bucket=10s&fn=p50,max").json()
+        self.assertEqual(
+            [(b["p50"], b["max"]) for b in res["loss"]],
+            [(7.0, 9.0), (14.5, 19.0), (24.5, 29.0)],
+        )
+
+        archive_series(self.run.series.get(name="loss"))
+        res = self.client.get(url + "&bucket=10s&fn=mean,min,count").json()
+        self.assertEqual(res, {"loss": expected})
+
+        res = self.client.get(url + "&bucket=1m&fn=sum").json()
+        self.assertEqual(res["loss"], [{"date": "2020-06-01T12:00:00Z", "sum": 425.0}])
+
+        for query in ("&bucket=10x", "&bucket=10s&fn=median"):
+            response = self.client.get(url + query)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_stats(self):
+        """Ensure statistics of metrics are computed without their values"""
+        self.insert_points("loss", range(1, 5), step=10)
+        self.insert_points(
+            "samples", range(1, 5), step=10, value=lambda i: 5.0 * i, cumulative=True
+        )
+        self.insert_points("TaskResult", [0], value=lambda i: None, text_value="done")
+        url = "/api/metrics/{}/stats/?metric_type=run".format(self.run.id)
+        expected = {
+            "loss": {
+                "count": 4,
+                "first_date": "2020-06-01T12:00:10Z",
+                "last_date": "2020-06-01T12:00:40Z",
+                "min": 1.0,
+                "max": 4.0,
+                "mean": 2.5,
+                "last_value": 4.0,
+                "rate": None,
+            },
+            "samples": {
+                "count": 4,
+                "first_date": "2020-06-01T12:00:10Z",
+                "last_date": "2020-06-01T12:00:40Z",
+                "min": 5.0,
+                "max": 20.0,
+                "mean": 12.5,
+                "last_value": 20.0,
+                "rate": 0.5,
+            },
+        }
+
+        # one query for the values however many series, two on sqlite
+        with self.assertNumQueries(5 if connection.vendor == "postgresql" else 6):
+            res = self.client.get(url).json()
+
+        self.assertNotIn("TaskResult", res)
+        self.assertEqual({k: res[k] for k in expected}, expected)
+
+        res = self.client.get(url + "&since=2020-06-01T12:00:25.000Z").json()
+        self.assertEqual(res["loss"]["count"], 2)
+        self.assertEqual(res["samples"]["rate"], 0.5)
+
+        # archives are read
+        archive_series(self.run.series.get(name="samples"))
+        res = self.client.get(url).json()
+        self.assertEqual({k: res[k] for k in expected}, expected)
+
+    def test_compare_runs(self):
+        """Ensure the metrics of runs are aligned on a common grid"""
+        other = ModelRun.objects.create(
+            name="OtherRun",
+            num_workers=1,
+            cpu_limit="1000m",
+            image="Testimage",
+            command="Testcommand",
+            backend="mpi",
+        )
+        starts = {}
+
+        for run, offset, scale in ((self.run, 0, 1.0), (other, 3600, 2.0)):
+            starts[run.id] = dt.datetime(
+                2020, 6, 1, 12, tzinfo=dt.timezone.utc
+            ) + dt.timedelta(seconds=offset)
+            ModelRun.objects.filter(id=run.id).update(created_at=starts[run.id])
+            self.insert_points(
+                "loss",
+                range(21),
+                start=starts[run.id],
+                step=10,
+                value=lambda i: scale * i,
+                epoch=lambda i: i // 5,
+                model_run=run,
+            )
+
+        url = "/api/metrics/compare/?runs={},{}&metrics=loss,acc".format(
+            self.run.id, other.id
+        )
+
+        res = self.client.get(url + "&points=5").json()
+        self.assertEqual(res["grid"], [0, 50, 100, 150, 200])
+        self.assertEqual(
+            res["runs"][str(self.run.id)],
+            {"name": "TestRun", "metrics": {"loss": [2.0, 7.0, 12.0, 17.0, 20.0]}},
+        )
+        self.assertEqual(
+            res["runs"][str(other.id)]["metrics"]["loss"], [4.0, 14.0, 24.0, 34.0, 40.0]
+        )
+
+        res = self.client.get(url + "&align=epoch").json()
+        self.assertEqual(res["grid"], [0, 1, 2, 3, 4])
+        self.assertEqual(
+            res["runs"][str(self.run.id)]["metrics"]["loss"],
+            [2.0, 7.0, 12.0, 17.0, 20.0],
+        )
+
+        response = self.client.get(url + "&align=step")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(METRICS_ARCHIVE_DELAY=60 * 60)
+    def test_archive_run(self):
+        """Ensure metrics of ended runs are archived and still returned"""
+        url = "/api/metrics/{}/?metric_type=run".format(self.run.id)
+        since = (timezone.now() - dt.timedelta(seconds=500)).strftime(
+            "%Y-%m-%dT%H:%M:%S.%fZ"
+        )
+        queries = ["", "&summarize=10", "&last_n=3", "&since=" + since]
+        results = [self.client.get(url + q, format="json").json() for q in queries]
+
+        self.run.state = ModelRun.FINISHED
+        self.run.save()
+        archive_ended_runs()
+
+        # too recent to be archived
+        self.assertEqual(MetricArchive.objects.count(), 0)
+
+        tomorrow = timezone.now() + dt.timedelta(days=1)
+
+        with patch("api.utils.metric_archive.timezone.now", return_value=tomorrow):
+            # disabled by default
+            with override_settings(METRICS_ARCHIVE_DELAY=None):
+                archive_ended_runs()
+
+            self.assertEqual(MetricArchive.objects.count(), 0)
+            archive_ended_runs()
+
+        self.assertFalse(KubeMetric.objects.filter(model_run=self.run).exists())
+        self.assertEqual(
+            list(self.run.series.values_list("archive__count", flat=True)),
+            [100] * len(self.names),
+        )
+        self.assertEqual(
+            [self.client.get(url + q, format="json").json() for q in queries], results
+        )
+
+        # late points are merged into the archive
+        self.client.post(
+            "/api/metrics/",
+            {
+                "run_id": self.run.id,
+                "name": "start",
+                "date": "2018-08-03T09:21:44.331823Z",
+                "value": "late",
+            },
+            format="json",
+        )
+        res = self.client.get(url, format="json").json()
+        self.assertEqual(res["start"][0]["value"], "late")
+        self.assertEqual(res["start"][1:], results[0]["start"])
+
+        archive_series(self.run.series.get(name="start"))
+        self.assertEqual(self.client.get(url, format="json").json(), res)
+
+        response = self.client.get(url + "&format=zip")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(METRICS_CHUNK_STORAGE=True)
+    def test_chunk_storage(self):
+        """Ensure numeric metrics can be stored in chunks"""
+        cpu = dict(step=5, value=lambda i: i / 10)
+        self.insert_points("cpu", range(200), **cpu)
+        self.insert_points("cpu", range(200, 250), **cpu)
+
+        # older than the latest chunk, or with metadata
+        self.insert_points("cpu", [-1], **cpu)
+        self.insert_points("cpu", [250], epoch=lambda i: 1, **cpu)
+
+        series = self.run.series.get(name="cpu")
+        self.assertEqual(
+            list(series.chunks.order_by("start").values_list("count", flat=True)),
+            [120, 120, 10],
+        )
+        self.assertEqual(series.points.count(), 2)
+        self.assertEqual(series.count, 252)
+
+        url = "/api/metrics/{}/?metric_type=run&metric_filter=cpu".format(self.run.id)
+        res = self.client.get(url, format="json").json()["cpu"]
+        self.assertEqual(
+            [m["value"] for m in res], [str(i / 10) for i in range(-1, 251)]
+        )
+        self.assertEqual(res[1]["date"], "2020-06-01T12:00:00Z")
+
+        res = self.client.get(
+            url + "&since=2020-06-01T12:20:00.000000Z", format="json"
+        ).json()["cpu"]
+        self.assertEqual(len(res), 11)
+
+        res = self.client.get(url + "&epoch=1", format="json").json()["cpu"]
+        self.assertEqual([m["value"] for m in res], ["25.0"])
+
+        res = self.client.get(url + "&last_n=3", format="json").json()["cpu"]
+        self.assertEqual([m["value"] for m in res], ["24.8", "24.9", "25.0"])
+
+        archive_series(series)
+        self.assertFalse(series.chunks.exists())
+        self.assertEqual(series.archive.count, 252)
+
+    def test_conditional_get(self):
+        """Ensure unchanged metrics are answered with 304"""
+        url = "/api/metrics/{}/?metric_type=run&summarize=10".format(self.run.id)
+
+        response = self.client.get(url, format="json")
+        etag = response["ETag"]
+        response = self.client.get(url, format="json", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.insert_points("start", [0], start=timezone.now())
+        response = self.client.get(url, format="json", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(response["Cache-Control"], "no-cache")
+
+        # ended runs are revalidated too, as late metrics change them
+        self.run.state = ModelRun.FINISHED
+        self.run.save()
+        response = self.client.get(url, format="json")
+        self.assertEqual(response["Cache-Control"], "no-cache")
+        etag = response["ETag"]
+
+        self.insert_points("start", [1], start=timezone.now())
+        response = self.client.get(url, format="json", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(METRICS_CHUNK_STORAGE=True)
+    def test_metric_cursor(self):
+        """Ensure polling with a cursor returns every new point exactly once"""
+
+        def poll(cursor):
+            response = self.client.get(
+                url,
+                {"metric_type": "run", "metric_filter": "acc", "cursor": cursor},
+                format="json",
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+            return response.json(), response["X-Metrics-Cursor"]
+
+        url = "/api/metrics/{}/".format(self.run.id)
+        # chunked points, and rows for those with an epoch
+        self.insert_points("acc", range(100), step=5)
+        self.insert_points("acc", range(5), step=5, epoch=lambda i: i)
+
+        result, cursor = poll("")
+        values = [float(m["value"]) for m in result["acc"]]
+        self.assertEqual(len(values), 105)
+
+        result, cursor = poll(cursor)
+        self.assertEqual(result, {})
+
+        # the latest chunk grows, a new one starts, older points become rows
+        self.insert_points("acc", range(100, 250), step=5)
+        self.insert_points("acc", [3], step=5)
+        self.insert_points("acc", [250], step=5, epoch=lambda i: i)
+
+        result, cursor = poll(cursor)
+        values += [float(m["value"]) for m in result["acc"]]
+        self.assertEqual(
+            sorted(values), sorted(list(range(251)) + list(range(5)) + [3])
+        )
+
+        result, cursor = poll(cursor)
+        self.assertEqual(result, {})
+
+        response = self.client.get(
+            url + "?metric_type=run&cursor=invalid", format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_pod_metric_retention(self):
+        """Ensure old pod metrics are rolled up and still returned"""
+        pod = KubePod.objects.create(
+            name="worker-0", labels="{}", phase="Running", ip="10.0.0.1", node_name="n"
+        )
+        now = dt.datetime(2020, 6, 1, 12, tzinfo=dt.timezone.utc)
+        points = [
+            (dt.datetime(2020, 4, 20, 10, 5), 1.0),
+            (dt.datetime(2020, 4, 20, 10, 35), 3.0),
+            (dt.datetime(2020, 5, 30, 8, 0, 0), 1.0),
+            (dt.datetime(2020, 5, 30, 8, 0, 15), 2.0),
+            (dt.datetime(2020, 5, 30, 8, 0, 30), 3.0),
+            (dt.datetime(2020, 5, 30, 8, 0, 45), 4.0),
+            (dt.datetime(2020, 6, 1, 11, 0, 0), 5.0),
+            (dt.datetime(2020, 6, 1, 11, 0, 10), 6.0),
+        ]
+        insert_metrics(
+            [
+                KubeMetric(
+                    name="cpu",
+                    date=date.replace(tzinfo=dt.timezone.utc),
+                    value=value,
+                    cumulative=False,
+                    pod=pod,
+                )
+                for date, value in points
+            ]
+        )
+
+        series = pod.series.get(name="cpu")
+        downsample_series(series, [(0, 86400), (60, 30 * 86400), (3600, None)], now)
+
+        series.refresh_from_db()
+        self.assertEqual(series.count, 2)
+        self.assertEqual(series.points.count(), 2)
+        self.assertEqual(
+            list(series.rollups.order_by("date").values_list("resolution", "count")),
+            [(3600, 2), (60, 4)],
+        )
+
+        response = self.client.get("/api/metrics/{}/".format(pod.name), format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [m["value"] for m in response.json()["cpu"]], ["2.0", "2.5", "5.0", "6.0"]
+        )
+
+        # aggregated from the rollups where they replace the points
+        url = "/api/metrics/{}/aggregate/?bucket=1d&fn=mean,max,count".format(pod.name)
+        self.assertEqual(
+            self.client.get(url).json()["cpu"],
+            [
+                {"date": "2020-04-20T00:00:00Z", "mean": 2.0, "max": 3.0, "count": 2},
+                {"date": "2020-05-30T00:00:00Z", "mean": 2.5, "max": 4.0, "count": 4},
+                {"date": "2020-06-01T00:00:00Z", "mean": 5.5, "max": 6.0, "count": 2},
+            ],
+        )
+        res = self.client.get(url + "&fn=p50").json()
+        self.assertEqual([b["p50"] for b in res["cpu"]], [None, None, 5.5])
+
+        # and so are the statistics
+        res = self.client.get("/api/metrics/{}/stats/".format(pod.name)).json()
+        self.assertEqual(
+            res["cpu"],
+            {
+                "count": 8,
+                "first_date": "2020-04-20T10:00:00Z",
+                "last_date": "2020-06-01T11:00:10Z",
+                "min": 1.0,
+                "max": 6.0,
+                "mean": 3.125,
+                "last_value": 6.0,
+                "rate": None,
+            },
+        )
+        res = self.client.get(
+            "/api/metrics/{}/stats/?since=2020-05-01T00:00:00.000000Z".format(pod.name)
+        ).json()
+        self.assertEqual(res["cpu"]["count"], 6)
+        self.assertEqual(res["cpu"]["first_date"], "2020-05-30T08:00:00Z")
+
+        # the metrics are deleted with the series of the pod
+        pod.delete()
+        self.assertFalse(KubeMetric.objects.filter(series=series).exists())
+
+
+class FakeStreamRedis:
+    """In-memory stand-in for the redis stream commands used by the metric buffer"""
+
+    def __init__(self):
+        self.entries = {}
+        self.pending = {}
+        self.delivered = []
+        self.next_id = 0
+        self.counters = {}
+
+    def pipeline(self, transaction=True):
+        conn = self
+
+        class Pipeline:
+            def __init__(self):
+                self.commands = []
+
+            def execute_command(self, *args):
+                self.commands.append(args)
+
+            def execute(self):
+                return [conn.execute_command(*c) for c in self.commands]
+
+        return Pipeline()
+
+    def _entry(self, entry_id):
+        return [entry_id.encode(), self.entries.get(entry_id)]
+
+    def incrby(self, key, amount):
+        self.counters[key] = self.counters.get(key, 0) + amount
+        return self.counters[key]
+
+    def get(self, key):
+        return self.counters.get(key)
+
+    def execute_command(self, command, *args):
+        if command == "XADD":
+            self.next_id += 1
+            entry_id = "{}-{}".format(int(time.time() * 1000), self.next_id)
+            self.entries[entry_id] = [a.encode() for a in args[5:]]
+            # trims exactly, redis may keep a few more entries with "~"
+            for i in list(self.entries)[: -args[3]]:
+                del self.entries[i]
+            return entry_id.encode()
+        if command == "XREADGROUP":
+            consumer, last_id = args[2], args[-1]
+            if last_id == ">":
+                ids = [i for i in self.entries if i not in self.delivered]
+                ids = ids[: args[args.index("COUNT") + 1]]
+                self.delivered += ids
+                self.pending.update({i: [consumer, 0] for i in ids})
+            else:
+                ids = [i for i, (c, _) in self.pending.items() if c == consumer]
+            return [[b"stream", [self._entry(i) for i in ids]]] if ids else None
+        if command == "XPENDING":
+            if len(args) == 2:
+                return [len(self.pending), None, None, None]
+            return [
+                [i.encode(), c.encode(), idle, 1]
+                for i, (c, idle) in self.pending.items()
+            ]
+        if command == "XCLAIM":
+            ids = [i.decode() for i in args[4:]]
+            self.pending.update({i: [args[2], 0] for i in ids})
+            return [self._entry(i) for i in ids]
+        if command == "XACK":
+            return sum(self.pending.pop(i, None) is not None for i in args[2:])
+        if command == "XDEL":
+            return sum(self.entries.pop(i, None) is not None for i in args[1:])
+        if command == "XLEN":
+            return len(self.entries)
+        if command == "XRANGE":
+            return [self._entry(i) for i in list(self.entries)[:1]]
+        if command == "XGROUP":
+            return b"OK"
+        raise NotImplementedError(command)
+
+
+@override_settings(METRICS_WRITE_BEHIND=True)
+class MetricBufferTests(APITestCase):
+    """Tests the write-behind buffering of posted metrics"""
+
+    def setUp(self):
+        self.run = ModelRun(name="TestRun")
+        self.run.save()
+
+        self.redis = FakeStreamRedis()
+        patcher = patch("django_rq.get_connection", return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _post_metrics(self, n):
+        return self.client.post(
+            "/api/metrics/",
+            [
+                {
+                    "run_id": self.run.id,
+                    "name": "loss",
+                    "date": "2018-08-03T09:21:{:02d}.000000Z".format(i),
+                    "value": str(i),
+                }
+                for i in range(n)
+            ],
+            format="json",
+        )
+
+    def test_buffer_and_drain(self):
+        response = self._post_metrics(3)
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(self.run.metrics.count(), 0)
+
+        response = self.client.get("/api/metrics/buffer/", format="json")
+        self.assertEqual(response.data["depth"], 3)
+
+        self.assertEqual(drain_metrics("drainer-1"), 3)
+        self.assertEqual(drain_metrics("drainer-1"), 0)
+        self.assertEqual(self.run.metrics.count(), 3)
+
+        response = self.client.get("/api/metrics/buffer/", format="json")
+        self.assertEqual(response.data["depth"], 0)
+        self.assertEqual(response.data["pending"], 0)
+
+    def test_drainer_crash(self):
+        self._post_metrics(3)
+
+        with patch(
+            "api.utils.metric_buffer.create_metrics", side_effect=RuntimeError
+        ), self.assertRaises(RuntimeError):
+            drain_metrics("drainer-1")
+
+        # Nothing was acknowledged, the entries are not handed out again as new
+        self.assertEqual(self.run.metrics.count(), 0)
+        self.assertEqual(len(self.redis.pending), 3)
+        self.assertEqual(drain_metrics("drainer-2"), 0)
+
+        # until they've been idle long enough to be claimed
+        for entry in self.redis.pending.values():
+            entry[1] = CLAIM_MIN_IDLE_MS
+
+        self.assertEqual(drain_metrics("drainer-2"), 3)
+        self.assertEqual(self.run.metrics.count(), 3)
+        self.assertEqual(len(self.redis.entries), 0)
+
+    @override_settings(METRICS_BUFFER_MAXLEN=5)
+    def test_buffer_full(self):
+        self._post_metrics(3)
+        response = self._post_metrics(4)
+
+        # the batch is still accepted, but the oldest metrics were dropped
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+
+        response = self.client.get("/api/metrics/buffer/", format="json")
+        self.assertEqual(response.data["depth"], 5)
+        self.assertEqual(response.data["max_depth"], 5)
+        self.assertEqual(response.data["dropped"], 2)
+
+        self.assertEqual(drain_metrics("drainer-1"), 5)
+        self.assertEqual(
+            sorted(m.value for m in self.run.metrics.all()), [0, 1, 2, 2, 3]
+        )
+
+
+class FakeCacheRedis:
+    """In-memory stand-in for the redis commands used by the metric cache"""
+
+    def __init__(self):
+        self.data = {}
+
+    def pipeline(self, transaction=True):
+        conn = self
+
+        class Pipeline:
+            def __init__(self):
+                self.commands = []
+
+            def __getattr__(self, name):
+                return lambda *args: self.commands.append((name, args))
+
+            def execute(self):
+                return [getattr(conn, name)(*args) for name, args in self.commands]
+
+        return Pipeline()
+
+    @staticmethod
+    def _key(key):
+        return key.encode() if isinstance(key, str) else key
+
+    def _get(self, key, default):
+        return self.data.setdefault(self._key(key), default)
+
+    def get(self, key):
+        return self.data.get(self._key(key))
+
+    def incrby(self, key, amount):
+        self.data[self._key(key)] = int(self.data.get(self._key(key), 0)) + amount
+
+    def decrby(self, key, amount):
+        self.incrby(key, -amount)
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(self._key(key), None)
+
+    def hgetall(self, key):
+        return dict(self.data.get(self._key(key), {}))
+
+    def hget(self, key, field):
+        return self.data.get(self._key(key), {}).get(self._key(field))
+
+    def hmget(self, key, fields):
+        return [self.hget(key, f) for f in fields]
+
+    def hset(self, key, field, value):
+        self._get(key, {})[self._key(field)] = str(value).encode()
+
+    def hmset(self, key, mapping):
+        for field, value in mapping.items():
+            self._get(key, {})[self._key(field)] = self._key(value)
+
+    def hdel(self, key, *fields):
+        for field in fields:
+            self._get(key, {}).pop(self._key(field), None)
+
+    def sadd(self, key, member):
+        self._get(key, set()).add(self._key(member))
+
+    def srem(self, key, member):
+        self._get(key, set()).discard(self._key(member))
+
+    def smembers(self, key):
+        return set(self.data.get(self._key(key), set()))
+
+    def zrange(self, key, start, end):
+        members = sorted(self._get(key, {}).items(), key=lambda m: m[1])
+        return [m for m, _ in members][start : None if end == -1 else end + 1]
+
+    def zrem(self, key, *members):
+        for member in members:
+            self._get(key, {}).pop(self._key(member), None)
+
+    def execute_command(self, command, key, score, member):
+        assert command == "ZADD"
+        self._get(key, {})[self._key(member)] = score
+
+
+@override_settings(METRICS_CACHE_SIZE=10 ** 6)
+class MetricCacheTests(APITestCase):
+    """Tests the cache of metric queries about ended runs"""
+
+    start = KubeMetricTests.start
+    insert_points = KubeMetricTests.insert_points
+
+    def setUp(self):
+        self.run = ModelRun.objects.create(name="TestRun", state=ModelRun.FINISHED)
+        self.insert_points(["acc", "loss"], range(50))
+        self.url = "/api/metrics/{}/".format(self.run.id)
+
+        self.redis = FakeCacheRedis()
+        patcher = patch("django_rq.get_connection", return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _get(self, **params):
+        return self.client.get(self.url, dict(params, metric_type="run"), format="json")
+
+    def test_cache(self):
+        response = self._get(summarize=10)
+        result = response.json()
+        self.assertEqual(len(result["acc"]), 10)
+
+        with patch("api.views._read_series") as read:
+            response = self._get(summarize=10)
+            read.assert_not_called()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), result)
+        self.assertEqual(response["Cache-Control"], "no-cache")
+
+        # late metrics are read
+        self.insert_points("acc", [0], start=timezone.now())
+        self.assertNotEqual(self._get(summarize=10).json(), result)
+
+        run_id = self.run.id
+        with patch("api.models.modelrun._remove_run_job"):
+            self.run.delete()
+
+        self.assertEqual(
+            self.redis.smembers("mlbench:metric-cache:run:{}".format(run_id)), set()
+        )
+        self.assertEqual(int(self.redis.get("mlbench:metric-cache:total")), 0)
+
+    def test_cached_stats(self):
+        url = self.url + "stats/"
+        result = self.client.get(url, {"metric_type": "run"}, format="json").json()
+        self.assertEqual(result["acc"]["count"], 50)
+
+        with patch("api.views.series_stats") as stats:
+            response = self.client.get(url, {"metric_type": "run"}, format="json")
+            stats.assert_not_called()
+
+        self.assertEqual(response.json(), result)
+        # metrics of the same query aren't served for statistics
+        self.assertIsInstance(self._get().json()["acc"], list)
+
+    def test_eviction(self):
+        self._get(summarize=10)
+        size = int(self.redis.get("mlbench:metric-cache:total"))
+
+        with override_settings(METRICS_CACHE_SIZE=2 * size + 100):
+            self._get(summarize=10, metric_filter="acc")
+            self._get(summarize=10)
+            # the least recently used is evicted
+            self._get(summarize=9)
+
+            with patch("api.views._read_series") as read:
+                self._get(summarize=10)
+                read.assert_not_called()
+
+            self.assertLessEqual(
+                int(self.redis.get("mlbench:metric-cache:total")), 2 * size + 100
+            )
+            self.assertEqual(
+                len(self.redis.zrange("mlbench:metric-cache:lru", 0, -1)), 2
+            )
+
+    def test_live_summaries(self):
+        """Ensure summaries of live runs only read the new points"""
+        self.run.state = ModelRun.STARTED
+        self.run.save()
+        start = self.start + dt.timedelta(hours=1)
+
+        # 50 points, groups of 4
+        values = [m["value"] for m in self._get(summarize=20).json()["acc"]]
+        self.assertEqual(values, [str(i + 1.5) for i in range(0, 48, 4)])
+
+        # 100 points, groups of 8
+        self.insert_points("acc", range(50), start=start)
+
+        with patch("api.utils.metric_summaries.read_points") as read:
+            result = self._get(summarize=20).json()
+            read.assert_not_called()
+
+        self.assertEqual(len(result["acc"]), 12)
+        self.assertEqual(result["acc"][0]["value"], "3.5")
+
+        # same as built from scratch
+        self.redis.data.clear()
+        self.assertEqual(self._get(summarize=20).json(), result)
+
+        # a point older than those summarized
+        self.insert_points("acc", [-3660], start=start)
+        values = [m["value"] for m in self._get(summarize=20).json()["acc"]]
+        self.assertEqual(values[0], str((-3660 + sum(range(7))) / 8))
+
+    def test_live_summaries_round_trips(self):
+        """Ensure the summaries of all series are read and stored at once"""
+        self.run.state = ModelRun.STARTED
+        self.run.save()
+
+        def round_trips():
+            with patch.object(
+                self.redis, "pipeline", wraps=self.redis.pipeline
+            ) as pipeline:
+                self._get(summarize=20)
+
+            return pipeline.call_count
+
+        self._get(summarize=20)
+        before = round_trips()
+
+        self.insert_points(["lr", "momentum"], range(50))
+        self._get(summarize=20)
+
+        self.assertEqual(round_trips(), before)
+
+    def test_warm(self):
+        warm_metric_cache(self.run.id)
+
+        with patch("api.views._read_series") as read, patch(
+            "api.views.series_cursor"
+        ) as cursor:
+            response = self._get(cursor="", summarize=1000, downsample="lttb")
+            read.assert_not_called()
+            cursor.assert_not_called()
+
+        self.assertEqual(len(response.json()["loss"]), 50)
+
+        response = self._get(cursor=response["X-Metrics-Cursor"])
+        self.assertEqual(response.json(), {})
@@ -1,14 +1,31 @@
 import os
 import tempfile
+from datetime import datetime
 from time import sleep
+from unittest import skipUnless
 from unittest.mock import MagicMock, patch
 
 import docker
-from django.test import TestCase
+import numpy as np
+import pytz
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
 from kubernetes import client, config
 from pytest_kind import KindCluster
 
-from api.models import KubePod, ModelRun
+from api.models import KubeMetric, KubePod, ModelRun
+from api.utils import gorilla
+from api.utils.downsampling import lttb, m4
+from api.utils.metric_cursor import snapshot
+from api.utils.metric_partitions import (
+    disable_partitioning,
+    enable_partitioning,
+    month_start,
+    partition_name,
+)
+from api.utils.metric_utils import insert_metrics
 from api.utils.pod_monitor import (
     _check_and_create_new_pods,
     _check_and_update_pod_phase,
@@ -432,3 +449,130 @@ class RunUtilsTests(TestCase):
             available,
             total_workers - run_1.num_workers - run_2.num_workers >= run_3.num_workers,
         )
+
+
+class MetricPartitionTests(TestCase):
+    """Tests the functions in `api/utils/metric_partitions.py`
+
+    Partitioning itself requires postgres, its tests are skipped on sqlite.
+    """
+
+    def test_partition_months(self):
+        date = datetime(2020, 12, 31, 23, 30, tzinfo=pytz.timezone("Etc/GMT+2"))
+
+        # 2021-01-01 01:30 in UTC
+        self.assertEqual(month_start(date), datetime(2021, 1, 1, tzinfo=pytz.utc))
+        self.assertEqual(partition_name(date), "api_kubemetric_y2021m01")
+        self.assertEqual(month_start(date, -13), datetime(2019, 12, 1, tzinfo=pytz.utc))
+
+    def test_requires_postgres(self):
+        with self.assertRaises(CommandError):
+            call_command("partition_metrics")
+
+    @skipUnless(connection.vendor == "postgresql", "requires postgres")
+    @override_settings(METRICS_PARTITIONING=True)
+    def test_insert_into_partition(self):
+        enable_partitioning(months_ahead=0)
+        self.addCleanup(disable_partitioning)
+
+        run = ModelRun.objects.create(name="TestRun")
+        now = datetime.now(pytz.utc)
+        inserted = insert_metrics(
+            [
+                KubeMetric(
+                    name="loss",
+                    date=now,
+                    value=float(i),
+                    cumulative=False,
+                    model_run=run,
+                    rank=0 if i % 2 else None,
+                    seq=i if i % 2 else None,
+                )
+                for i in range(4)
+            ]
+        )
+        self.assertEqual(len(inserted), 4)
+
+        metric = KubeMetric(
+            name="loss", date=now, value=4.0, cumulative=False, model_run=run
+        )
+        metric.save()
+        self.assertIsNotNone(metric.pk)
+
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM ONLY {}".format(partition_name(now)))
+            self.assertEqual(cursor.fetchone()[0], 5)
+
+        self.assertEqual(KubeMetric.objects.filter(pk=metric.pk).count(), 1)
+        self.assertEqual(run.series.get(name="loss").count, 5)
+
+
+@skipUnless(connection.vendor == "postgresql", "requires postgres")
+class MetricCursorTests(TransactionTestCase):
+    """Tests the functions in `api/utils/metric_cursor.py`
+
+    Not in a test transaction, which would keep its isolation level.
+    """
+
+    def test_snapshot_isolation(self):
+        with snapshot(), connection.cursor() as cursor:
+            cursor.execute("SHOW transaction_isolation")
+            self.assertEqual(cursor.fetchone()[0], "repeatable read")
+
+
+class GorillaTests(TestCase):
+    """Tests the encoding in `api/utils/gorilla.py`"""
+
+    def test_round_trip(self):
+        timestamps = [10 ** 15 + i * 5 * 10 ** 6 for i in range(100)]
+        # irregular and decreasing deltas
+        timestamps += [timestamps[-1] + d for d in (1, 2 ** 10, 2 ** 40, 2 ** 41)]
+        timestamps.append(timestamps[-1] - 2 ** 41)
+        values = [0.25] * 50 + [i / 7 for i in range(50)] + [-0.0, 1e308, -1.5, 3, 0]
+
+        self.assertEqual(
+            gorilla.decode(gorilla.encode(timestamps, values)), (timestamps, values)
+        )
+        self.assertEqual(gorilla.decode(gorilla.encode([], [])), ([], []))
+
+    def test_regular_series(self):
+        timestamps = [10 ** 15 + i * 5 * 10 ** 6 for i in range(120)]
+        values = [512.0] * 60 + [768.0] * 40 + [1024.0] * 20
+
+        # 16 bytes per point as rows of (date, value)
+        self.assertLess(len(gorilla.encode(timestamps, values)), 120 * 16 / 10)
+
+
+class DownsamplingTests(TestCase):
+    """Tests the selection of points in `api/utils/downsampling.py`"""
+
+    def test_lttb(self):
+        x = np.arange(1000, dtype=float)
+        y = np.sin(x / 50)
+        y[321] = 10
+        y[654] = -10
+
+        selected = lttb(x, y, 50)
+
+        self.assertEqual(len(selected), 50)
+        self.assertEqual((selected[0], selected[-1]), (0, 999))
+        self.assertTrue(np.all(np.diff(selected) > 0))
+        self.assertIn(321, selected)
+        self.assertIn(654, selected)
+
+        self.assertEqual(list(lttb(x[:10], y[:10], 20)), list(range(10)))
+
+    def test_m4(self):
+        x = np.arange(12, dtype=float)
+        y = np.array([1, 5, 0, 2, 3, 3, 3, 3, 9, -1, 4, 2], dtype=float)
+
+        # first, maximum, minimum and last of each bucket of 4
+        self.assertEqual(list(m4(x, y, 3)), [0, 1, 2, 3, 4, 7, 8, 9, 11])
+
+        x = np.arange(10000, dtype=float)
+        y = np.random.random(10000)
+        y[4321] = 5
+
+        selected = m4(x, y, 100)
+        self.assertLessEqual(len(selected), 400)
+        self.assertIn(4321, selected)
@@ -0,0 +1,138 @@
+"""Downsampling of series for charts.
+
+Unlike averaging groups of points, these keep actual points of the series,
+so spikes and jumps remain visible once plotted.
+"""
+import numpy as np
+
+
+def lttb(x, y, threshold):
+    """Selects points with Largest-Triangle-Three-Buckets
+
+    The first and last points are kept, the others are split into
+    `threshold - 2` buckets of equal size. In each bucket, the point forming
+    the largest triangle with the previously selected point and the average
+    of the next bucket is selected (Steinarsson, "Downsampling Time Series for
+    Visual Representation", 2013). Buckets are handled one after the other,
+    the points of a bucket at once.
+
+    Args:
+        x (:obj:`numpy.ndarray`): The x coordinates (e.g. timestamps), ordered
+        y (:obj:`numpy.ndarray`): The y coordinates
+        threshold (int): Number of points to select
+
+    Returns:
+        (:obj:`numpy.ndarray`): The indices of the selected points, ordered
+    """
+    n = len(x)
+
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    # buckets [edges[i], edges[i + 1]) between the first and the last point
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    sizes = np.diff(edges)
+
+    # the average of the bucket after each bucket, the last point for the last
+    next_x = np.append(np.add.reduceat(x[:-1], edges[:-1])[1:] / sizes[1:], x[-1])
+    next_y = np.append(np.add.reduceat(y[:-1], edges[:-1])[1:] / sizes[1:], y[-1])
+
+    selected = np.empty(threshold, dtype=int)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        # twice the area of the triangles, which doesn't change the largest
+        areas = np.abs(
+            (x[a] - next_x[i]) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (next_y[i] - y[a])
+        )
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+
+    return selected
+
+
+def m4(x, y, width):
+    """Selects the first, last, minimum and maximum points of each pixel
+    column (M4, Jugel et al., "M4: A Visualization-Oriented Time Series Data
+    Aggregation", 2014)
+
+    The range of `x` is split into `width` buckets of equal duration, so a
+    line chart of the selected points is the same as one of all points at
+    that width, and at most `4 * width` points are selected.
+
+    Args:
+        x (:obj:`numpy.ndarray`): The x coordinates (e.g. timestamps), ordered
+        y (:obj:`numpy.ndarray`): The y coordinates
+        width (int): Number of buckets, e.g. the width of the chart in pixels
+
+    Returns:
+        (:obj:`numpy.ndarray`): The indices of the selected points, ordered
+    """
+    n = len(x)
+
+    if n == 0:
+        return np.arange(0)
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    span = x[-1] - x[0]
+
+    if span > 0:
+        buckets = np.minimum(((x - x[0]) * width / span).astype(int), width - 1)
+    else:
+        buckets = np.zeros(n, dtype=int)
+
+    starts = np.flatnonzero(np.diff(buckets, prepend=-1))
+    sizes = np.diff(np.append(starts, n))
+    selected = [starts, starts + sizes - 1]
+
+    for extreme in (np.minimum, np.maximum):
+        # the first point of each bucket equal to its extreme
+        candidates = np.flatnonzero(y == np.repeat(extreme.reduceat(y, starts), sizes))
+        first = np.diff(buckets[candidates], prepend=-1) != 0
+        selected.append(candidates[first])
+
+    return np.unique(np.concatenate(selected))
+
+
+def resample(x, y, step, size):
+    """Resamples points onto the grid `0, step, ..., (size - 1) * step`
+
+    The value at a grid position is the mean of the points in
+    `[position, position + step)`, or interpolated from the neighbouring
+    positions if there are none. Positions before the first or after the
+    last point are NaN.
+
+    Args:
+        x (:obj:`numpy.ndarray`): The x coordinates, e.g. seconds since a start
+        y (:obj:`numpy.ndarray`): The y coordinates
+        step (float): Distance between grid positions
+        size (int): Number of grid positions
+
+    Returns:
+        (:obj:`numpy.ndarray`): The values at the grid positions
+    """
+    cells = np.floor(np.asarray(x, dtype=float) / step).astype(int)
+    inside = (cells >= 0) & (cells < size)
+    cells = cells[inside]
+    y = np.asarray(y, dtype=float)[inside]
+
+    counts = np.bincount(cells, minlength=size)
+    sums = np.bincount(cells, weights=y, minlength=size)
+    known = np.flatnonzero(counts)
+    values = np.full(size, np.nan)
+
+    if len(known) == 0:
+        return values
+
+    positions = np.arange(known[0], known[-1] + 1)
+    values[positions] = np.interp(positions, known, sums[known] / counts[known])
+
+    return values
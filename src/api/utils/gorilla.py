@@ -0,0 +1,187 @@
+"""Gorilla compression of time series chunks.
+
+Implements the encoding of "Gorilla: A Fast, Scalable, In-Memory Time Series
+Database" (Pelkonen et al., 2015): timestamps are stored as the difference
+of consecutive deltas (delta of delta), and values as the XOR with the
+previous value, which is mostly zero bits for slowly changing series.
+
+Our timestamps are in microseconds rather than seconds, so the delta of
+delta buckets go up to 64 bits instead of 32.
+"""
+import struct
+
+# Bits of the delta of delta, by size. A delta of delta of the i-th size is
+# prefixed by i + 1 one bits and a zero bit (omitted for the last size), an
+# unchanged delta by a single zero bit
+DOD_BITS = (7, 9, 12, 32, 64)
+
+
+class BitWriter:
+    """Appends bits to a growing buffer"""
+
+    def __init__(self):
+        self.value = 0
+        self.length = 0
+
+    def write(self, bits, n):
+        """Appends the lowest `n` bits of `bits`"""
+        self.value = (self.value << n) | (bits & ((1 << n) - 1))
+        self.length += n
+
+    def to_bytes(self):
+        padding = -self.length % 8
+        return (self.value << padding).to_bytes((self.length + padding) // 8, "big")
+
+
+class BitReader:
+    """Reads bits from a buffer written by :obj:`BitWriter`"""
+
+    def __init__(self, data):
+        self.value = int.from_bytes(data, "big")
+        self.length = len(data) * 8
+        self.position = 0
+
+    def read(self, n):
+        self.position += n
+
+        if self.position > self.length:
+            raise ValueError("Truncated chunk")
+
+        return (self.value >> (self.length - self.position)) & ((1 << n) - 1)
+
+
+def _signed(value, n):
+    return value - (1 << n) if value >= 1 << (n - 1) else value
+
+
+def _float_bits(value):
+    return struct.unpack(">Q", struct.pack(">d", value))[0]
+
+
+def _bits_float(bits):
+    return struct.unpack(">d", struct.pack(">Q", bits))[0]
+
+
+def _leading_zeros(bits):
+    return 64 - bits.bit_length()
+
+
+def _trailing_zeros(bits):
+    return (bits & -bits).bit_length() - 1
+
+
+def encode(timestamps, values):
+    """Encodes a chunk of points
+
+    Args:
+        timestamps (list[int]): Timestamps in microseconds, ordered
+        values (list[float]): The values
+
+    Returns:
+        (bytes): The encoded chunk
+    """
+    writer = BitWriter()
+    writer.write(len(timestamps), 32)
+
+    if not timestamps:
+        return writer.to_bytes()
+
+    writer.write(timestamps[0], 64)
+    writer.write(_float_bits(values[0]), 64)
+
+    delta = 0
+    previous = _float_bits(values[0])
+    leading, trailing = 65, 0
+
+    for i in range(1, len(timestamps)):
+        new_delta = timestamps[i] - timestamps[i - 1]
+        dod = new_delta - delta
+        delta = new_delta
+
+        if dod == 0:
+            writer.write(0, 1)
+        else:
+            for size, n in enumerate(DOD_BITS, 1):
+                if n == DOD_BITS[-1]:
+                    writer.write((1 << size) - 1, size)
+                    break
+
+                if -(1 << (n - 1)) <= dod < 1 << (n - 1):
+                    writer.write(((1 << size) - 1) << 1, size + 1)
+                    break
+
+            writer.write(dod, n)
+
+        bits = _float_bits(values[i])
+        xor = bits ^ previous
+        previous = bits
+
+        if xor == 0:
+            writer.write(0, 1)
+            continue
+
+        writer.write(1, 1)
+        new_leading = min(_leading_zeros(xor), 31)
+        new_trailing = _trailing_zeros(xor)
+
+        if new_leading >= leading and new_trailing >= trailing:
+            # fits in the window of meaningful bits of the previous value
+            writer.write(0, 1)
+            writer.write(xor >> trailing, 64 - leading - trailing)
+        else:
+            leading, trailing = new_leading, new_trailing
+            meaningful = 64 - leading - trailing
+            writer.write(1, 1)
+            writer.write(leading, 5)
+            writer.write(meaningful % 64, 6)
+            writer.write(xor >> trailing, meaningful)
+
+    return writer.to_bytes()
+
+
+def decode(data):
+    """Decodes a chunk
+
+    Args:
+        data (bytes): A chunk encoded by `encode`
+
+    Returns:
+        (tuple[list[int], list[float]]): The timestamps and values
+    """
+    reader = BitReader(bytes(data))
+    count = reader.read(32)
+
+    if not count:
+        return [], []
+
+    timestamps = [_signed(reader.read(64), 64)]
+    previous = reader.read(64)
+    values = [_bits_float(previous)]
+
+    delta = 0
+    leading, trailing = 0, 0
+
+    for _ in range(1, count):
+        if reader.read(1) == 0:
+            dod = 0
+        else:
+            for n in DOD_BITS:
+                if n == DOD_BITS[-1] or reader.read(1) == 0:
+                    break
+
+            dod = _signed(reader.read(n), n)
+
+        delta += dod
+        timestamps.append(timestamps[-1] + delta)
+
+        if reader.read(1) == 1:
+            if reader.read(1) == 1:
+                leading = reader.read(5)
+                meaningful = reader.read(6) or 64
+                trailing = 64 - leading - meaningful
+
+            previous ^= reader.read(64 - leading - trailing) << trailing
+
+        values.append(_bits_float(previous))
+
+    return timestamps, values
@@ -0,0 +1,529 @@
+"""Aggregation of metrics into time buckets.
+
+Buckets are aligned on multiples of their duration since the epoch, so the
+buckets of different series (and runs) line up. Points in the metric table
+and the rollups of pod series are aggregated by the database, the points of
+archives and chunks with NumPy.
+"""
+import operator
+import re
+from datetime import datetime, timedelta
+from functools import reduce
+
+import numpy as np
+import pytz
+from django.conf import settings
+from django.db import connection
+from django.db.models import (
+    Aggregate,
+    Avg,
+    BigIntegerField,
+    Count,
+    FloatField,
+    Func,
+    Max,
+    Min,
+    Q,
+    Sum,
+)
+
+from api.models import KubeMetric, MetricRollup
+from api.utils.metric_archive import get_archive, read_points
+
+EPOCH = datetime(1970, 1, 1, tzinfo=pytz.utc)
+
+BUCKET_UNITS = {"s": 1, "m": 60, "h": 60 * 60, "d": 24 * 60 * 60}
+
+PERCENTILES = {"p50": 50, "p95": 95, "p99": 99}
+
+FUNCTIONS = ["mean", "min", "max", "sum", "count"] + list(PERCENTILES)
+
+
+class TimeBucket(Func):
+    """Start of the bucket a date falls in, in seconds since the epoch"""
+
+    output_field = BigIntegerField()
+
+    def __init__(self, expression, seconds):
+        super().__init__(expression, seconds=int(seconds))
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler,
+            connection,
+            template="CAST(strftime('%%%%s', %(expressions)s) AS INTEGER)"
+            " / %(seconds)s * %(seconds)s",
+            **extra_context,
+        )
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler,
+            connection,
+            template="CAST(FLOOR(EXTRACT(EPOCH FROM %(expressions)s) / %(seconds)s)"
+            " AS BIGINT) * %(seconds)s",
+            **extra_context,
+        )
+
+
+class PercentileCont(Aggregate):
+    """Continuous percentile of a column, only supported by postgres"""
+
+    function = "PERCENTILE_CONT"
+    template = "%(function)s(%(fraction)s) WITHIN GROUP (ORDER BY %(expressions)s)"
+    output_field = FloatField()
+
+    def __init__(self, expression, percentile):
+        super().__init__(expression, fraction=float(percentile) / 100)
+
+
+class EndValue(Aggregate):
+    """Value of the first (or last) point of a group by date, only supported
+    by postgres"""
+
+    template = '(ARRAY_AGG(%(expressions)s ORDER BY "date" %(direction)s, "id" %(direction)s))[1]'
+    output_field = FloatField()
+
+    def __init__(self, expression, last=False):
+        super().__init__(expression, direction="DESC" if last else "ASC")
+
+
+def parse_bucket(bucket):
+    """Parses a bucket duration like `10s`, `1m`, `6h` or `1d`
+
+    Args:
+        bucket (str): The duration
+
+    Returns:
+        (int): The duration in seconds
+
+    Raises:
+        ValueError: If the duration is invalid
+    """
+    match = re.fullmatch(r"([1-9][0-9]*)([smhd])", bucket)
+
+    if match is None:
+        raise ValueError("Invalid bucket {}".format(bucket))
+
+    return int(match.group(1)) * BUCKET_UNITS[match.group(2)]
+
+
+def _aggregates(functions):
+    aggregates = {
+        "mean": Avg("value"),
+        "min": Min("value"),
+        "max": Max("value"),
+        "sum": Sum("value"),
+        "count": Count("value"),
+    }
+
+    for name, percentile in PERCENTILES.items():
+        aggregates[name] = PercentileCont("value", percentile)
+
+    return {name: aggregates[name] for name in functions}
+
+
+def aggregate_points(points, seconds, functions):
+    """Aggregates points into time buckets
+
+    Args:
+        points (list[dict]): The points, with `date` and `value`, ordered by date
+        seconds (int): The duration of the buckets
+        functions (list[str]): The aggregates to compute, see `FUNCTIONS`
+
+    Returns:
+        (list[dict]): The `date` (start) and aggregates of each bucket with
+            numeric values, ordered by date
+    """
+    points = [p for p in points if p["value"] is not None]
+
+    if not points:
+        return []
+
+    stamps = np.fromiter(
+        ((p["date"] - EPOCH) // timedelta(seconds=1) for p in points),
+        np.int64,
+        len(points),
+    )
+    values = np.fromiter((p["value"] for p in points), float, len(points))
+
+    buckets = stamps // seconds * seconds
+    starts = np.flatnonzero(np.diff(buckets, prepend=buckets[0] - 1))
+    sizes = np.diff(np.append(starts, len(points)))
+
+    columns = {
+        "mean": lambda: np.add.reduceat(values, starts) / sizes,
+        "min": lambda: np.minimum.reduceat(values, starts),
+        "max": lambda: np.maximum.reduceat(values, starts),
+        "sum": lambda: np.add.reduceat(values, starts),
+        "count": lambda: sizes,
+    }
+
+    for name, percentile in PERCENTILES.items():
+        columns[name] = lambda percentile=percentile: [
+            np.percentile(values[start : start + size], percentile)
+            for start, size in zip(starts, sizes)
+        ]
+
+    columns = {name: columns[name]() for name in functions}
+
+    return [
+        dict(
+            {name: column[i].item() for name, column in columns.items()},
+            date=EPOCH + timedelta(seconds=int(buckets[start])),
+        )
+        for i, start in enumerate(starts)
+    ]
+
+
+def _rollup_buckets(series, dates, seconds, bounds):
+    """Aggregates the rollups of pod series into time buckets, for the part
+    of the range older than their points (see :mod:`api.utils.metric_rollups`)
+
+    Rollups are counted in the bucket of their start.
+
+    Args:
+        series (list[:obj:`MetricSeries`]): The series of pods
+        dates (dict): Lookups on the dates
+        seconds (int): The duration of the buckets
+        bounds (dict): Date of the first point of each series with points, by
+            series id. Updated with the first rollup read
+
+    Returns:
+        (dict): `[count, sum, min, max]` by bucket start (in seconds since
+            the epoch) of each series, by series id
+    """
+    result = {s.id: {} for s in series}
+
+    for resolution, _ in settings.POD_METRICS_RETENTION:
+        if resolution == 0:
+            continue
+
+        rows = (
+            MetricRollup.objects.filter(
+                reduce(
+                    operator.or_,
+                    (
+                        Q(series_id=s.id, date__lt=bounds[s.id])
+                        if s.id in bounds
+                        else Q(series_id=s.id)
+                        for s in series
+                    ),
+                ),
+                resolution=resolution,
+                count__gt=0,
+                **dates,
+            )
+            .annotate(bucket=TimeBucket("date", seconds))
+            .values("series_id", "bucket")
+            .annotate(
+                first=Min("date"),
+                n=Sum("count"),
+                total=Sum("sum"),
+                low=Min("min"),
+                high=Max("max"),
+            )
+            .order_by()
+        )
+
+        for row in list(rows):
+            series_id = row["series_id"]
+            bounds[series_id] = min(bounds.get(series_id, row["first"]), row["first"])
+            aggregate = result[series_id].setdefault(
+                row["bucket"], [0, 0.0, row["low"], row["high"]]
+            )
+            aggregate[0] += row["n"]
+            aggregate[1] += row["total"]
+            aggregate[2] = min(aggregate[2], row["low"])
+            aggregate[3] = max(aggregate[3], row["high"])
+
+    return result
+
+
+def _merge_rollups(buckets, rollups, functions):
+    """Adds aggregated rollups (see `_rollup_buckets`) to the buckets of the
+    points of a series, which have their `count`, `sum`, `min` and `max`
+
+    Percentiles can't be computed from rollups, they are None in buckets with
+    rollups.
+    """
+    by_date = {b["date"]: b for b in buckets}
+
+    for start, (count, total, minimum, maximum) in rollups.items():
+        date = EPOCH + timedelta(seconds=start)
+        bucket = by_date.setdefault(
+            date, {"date": date, "count": 0, "sum": 0.0, "min": minimum, "max": maximum}
+        )
+        bucket["count"] += count
+        bucket["sum"] += total
+        bucket["min"] = min(bucket["min"], minimum)
+        bucket["max"] = max(bucket["max"], maximum)
+        bucket["mean"] = bucket["sum"] / bucket["count"]
+        bucket.update((name, None) for name in PERCENTILES)
+
+    return [
+        dict({name: b[name] for name in functions}, date=b["date"])
+        for _, b in sorted(by_date.items())
+    ]
+
+
+def aggregate_series(series, dates, filters, seconds, functions):
+    """Aggregates the points of several series into time buckets
+
+    The points in the metric table are aggregated by a single query, unless
+    percentiles are requested from a database without them (SQLite). For
+    pods, the rollups of their older resource usage are aggregated by a query
+    per retention tier, unless `filters` are given.
+
+    Args:
+        series (list[:obj:`MetricSeries`]): The series, annotated with `chunked`
+        dates (dict): Lookups on the dates of the points
+        filters (dict): Additional lookups on the points
+        seconds (int): The duration of the buckets
+        functions (list[str]): The aggregates to compute, see `FUNCTIONS`
+
+    Returns:
+        (dict): The buckets of each series, see `aggregate_points`, by series id
+    """
+    lookups = {**dates, **filters}
+    pods = [s for s in series if s.pod_id is not None and not filters]
+
+    # merging rollups needs them
+    computed = functions
+
+    if pods:
+        computed = list(dict.fromkeys(functions + ["count", "sum", "min", "max"]))
+
+    in_database = connection.vendor == "postgresql" or not any(
+        name in PERCENTILES for name in functions
+    )
+    rows = [
+        s
+        for s in series
+        if in_database and get_archive(s) is None and not getattr(s, "chunked", True)
+    ]
+    result = {s.id: [] for s in series}
+    bounds = {}
+
+    if rows:
+        buckets = (
+            KubeMetric.objects.filter(series__in=rows, value__isnull=False, **lookups)
+            .annotate(bucket=TimeBucket("date", seconds))
+            .values("series_id", "bucket")
+            .annotate(first=Min("date"), **_aggregates(computed))
+            .order_by("series_id", "bucket")
+        )
+
+        for bucket in buckets:
+            series_id = bucket.pop("series_id")
+            first = bucket.pop("first")
+            bounds[series_id] = min(bounds.get(series_id, first), first)
+            bucket["date"] = EPOCH + timedelta(seconds=bucket.pop("bucket"))
+            result[series_id].append(bucket)
+
+    points = read_points(
+        [s for s in series if s not in rows], lookups, ["date", "value"]
+    )
+
+    for series_id, series_points in points.items():
+        result[series_id] = aggregate_points(series_points, seconds, computed)
+
+        if series_points:
+            bounds[series_id] = series_points[0]["date"]
+
+    if pods:
+        rollups = _rollup_buckets(pods, dates, seconds, bounds)
+
+        for s in series:
+            if s in pods:
+                result[s.id] = _merge_rollups(result[s.id], rollups[s.id], functions)
+            elif computed != functions:
+                result[s.id] = [
+                    dict({name: b[name] for name in functions}, date=b["date"])
+                    for b in result[s.id]
+                ]
+
+    return result
+
+
+def _with_rate(stats, first_value, cumulative):
+    """Adds the mean rate of increase per second of cumulative series"""
+    seconds = (stats["last_date"] - stats["first_date"]).total_seconds()
+    stats["rate"] = None
+
+    if cumulative and seconds > 0:
+        stats["rate"] = (stats["last_value"] - first_value) / seconds
+
+    return stats
+
+
+def points_stats(points, cumulative):
+    """Statistics of the numeric values of points
+
+    Args:
+        points (list[dict]): The points, with `date` and `value`, ordered by date
+        cumulative (bool): If the values are cumulative
+
+    Returns:
+        (dict | None): The `count`, `first_date`, `last_date`, `min`, `max`,
+            `mean` and `last_value` of the values, and their mean `rate` of
+            increase per second if cumulative. None without numeric values
+    """
+    points = [p for p in points if p["value"] is not None]
+
+    if not points:
+        return None
+
+    values = np.fromiter((p["value"] for p in points), float, len(points))
+    stats = {
+        "count": len(points),
+        "first_date": points[0]["date"],
+        "last_date": points[-1]["date"],
+        "min": values.min().item(),
+        "max": values.max().item(),
+        "mean": values.mean().item(),
+        "last_value": points[-1]["value"],
+    }
+
+    return _with_rate(stats, points[0]["value"], cumulative)
+
+
+def _merge_rollup_stats(stats, rollups, first_date, cumulative):
+    """Adds aggregated rollups older than the points of a series (see
+    `_rollup_buckets`) to the statistics of its points, if any
+
+    Without points, the last value is taken from the last rollup: its
+    maximum for cumulative series, its mean otherwise.
+    """
+    buckets = [rollups[start] for start in sorted(rollups)]
+    count = sum(b[0] for b in buckets)
+    total = sum(b[1] for b in buckets)
+    merged = {
+        "count": count,
+        "first_date": first_date,
+        "last_date": EPOCH + timedelta(seconds=max(rollups)),
+        "min": min(b[2] for b in buckets),
+        "max": max(b[3] for b in buckets),
+        "mean": total / count,
+        "last_value": buckets[-1][3] if cumulative else buckets[-1][1] / buckets[-1][0],
+    }
+
+    if stats is not None:
+        merged.update(
+            count=count + stats["count"],
+            last_date=stats["last_date"],
+            min=min(merged["min"], stats["min"]),
+            max=max(merged["max"], stats["max"]),
+            mean=(total + stats["mean"] * stats["count"]) / (count + stats["count"]),
+            last_value=stats["last_value"],
+        )
+
+    # the values of cumulative series only grow, the first is the minimum
+    return _with_rate(merged, buckets[0][2], cumulative)
+
+
+def series_stats(series, dates, filters):
+    """Statistics of the values of several series, see `points_stats`
+
+    Series with all their points in the metric table are aggregated by a
+    single grouped query. SQLite has no ordered aggregate, so there their
+    first and last values are fetched by a second query on their dates. For
+    pods, the rollups of their older resource usage are added like in
+    `aggregate_series`, unless `filters` are given.
+
+    Args:
+        series (list[:obj:`MetricSeries`]): The series, annotated with `chunked`
+        dates (dict): Lookups on the dates of the points
+        filters (dict): Additional lookups on the points
+
+    Returns:
+        (dict): The statistics of each series with numeric values, by series id
+    """
+    lookups = {**dates, **filters}
+    by_id = {
+        s.id: s
+        for s in series
+        if get_archive(s) is None and not getattr(s, "chunked", True)
+    }
+    ordered = connection.vendor == "postgresql"
+    ends = {}
+
+    if ordered:
+        ends = {
+            "first_value": EndValue("value"),
+            "last_value": EndValue("value", last=True),
+        }
+
+    aggregates = {}
+    result = {}
+
+    if by_id:
+        aggregates = (
+            KubeMetric.objects.filter(
+                series_id__in=by_id, value__isnull=False, **lookups
+            )
+            .values("series_id")
+            .annotate(
+                count=Count("value"),
+                first_date=Min("date"),
+                last_date=Max("date"),
+                min=Min("value"),
+                max=Max("value"),
+                mean=Avg("value"),
+                **ends,
+            )
+            .order_by()
+        )
+        aggregates = {a.pop("series_id"): a for a in aggregates}
+
+    if aggregates and not ordered:
+        rows = KubeMetric.objects.filter(
+            reduce(
+                operator.or_,
+                (
+                    Q(series_id=i, date__in=[a["first_date"], a["last_date"]])
+                    for i, a in aggregates.items()
+                ),
+            ),
+            value__isnull=False,
+            **lookups,
+        ).order_by("series_id", "date", "id")
+        values = {}
+
+        for series_id, date, value in rows.values_list("series_id", "date", "value"):
+            values[series_id, date] = value
+
+        for series_id, stats in aggregates.items():
+            stats["first_value"] = values[series_id, stats["first_date"]]
+            stats["last_value"] = values[series_id, stats["last_date"]]
+
+    for series_id, stats in aggregates.items():
+        first_value = stats.pop("first_value")
+        result[series_id] = _with_rate(stats, first_value, by_id[series_id].cumulative)
+
+    points = read_points(
+        [s for s in series if s.id not in by_id], lookups, ["date", "value"]
+    )
+
+    for s in series:
+        if s.id in points:
+            stats = points_stats(points[s.id], s.cumulative)
+
+            if stats is not None:
+                result[s.id] = stats
+
+    pods = [s for s in series if s.pod_id is not None and not filters]
+
+    if pods:
+        bounds = {s.id: result[s.id]["first_date"] for s in pods if s.id in result}
+        # the start of every rollup is the start of a bucket
+        seconds = min(r for r, _ in settings.POD_METRICS_RETENTION if r > 0)
+        rollups = _rollup_buckets(pods, dates, seconds, bounds)
+
+        for s in pods:
+            if rollups[s.id]:
+                result[s.id] = _merge_rollup_stats(
+                    result.get(s.id), rollups[s.id], bounds[s.id], s.cumulative
+                )
+
+    return result
@@ -0,0 +1,415 @@
+"""Columnar archive of the metrics of ended runs.
+
+The metrics of a run don't change once it has finished or failed, but they'd
+stay in the metric table as one row per point. `archive_ended_runs` packs
+every series of such runs into a :obj:`MetricArchive` and deletes its points.
+
+An archive is a zlib compressed blob holding a JSON header followed by the
+numeric columns as little endian arrays:
+
+- `date`: microseconds since the epoch, delta encoded (int64)
+- `value`: the numeric values, NaN for none (float64)
+- `epoch`, `rank`, `seq`: `NULL_INT` for none (int64)
+- `cumulative`: 0 or 1 (int8)
+
+`text_value` and `metadata` are stored in the header, as lists.
+
+Points stored after a series was archived stay in the metric table (or in
+chunks, see :mod:`api.utils.metric_chunks`) until the next archival,
+:func:`series_points` reads all of them.
+"""
+import json
+import math
+import struct
+import sys
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+import pytz
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.db.models import F, Q, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+from django_rq import job
+
+from api.models import KubeMetric, MetricArchive, MetricChunk, MetricSeries, ModelRun
+from api.utils.metric_chunks import decode_chunk, read_series_chunks
+from api.utils.utils import lookup_test, matches_lookups
+
+FORMAT_VERSION = 1
+
+NULL_INT = -(2 ** 63)
+
+EPOCH = datetime(1970, 1, 1, tzinfo=pytz.utc)
+
+POINT_FIELDS = [
+    "date",
+    "value",
+    "text_value",
+    "cumulative",
+    "metadata",
+    "epoch",
+    "rank",
+    "seq",
+]
+
+# typecode of each numeric column
+COLUMNS = [
+    ("date", "q"),
+    ("value", "d"),
+    ("epoch", "q"),
+    ("rank", "q"),
+    ("seq", "q"),
+    ("cumulative", "b"),
+]
+
+
+def _to_bytes(typecode, values):
+    column = array(typecode, values)
+
+    if sys.byteorder == "big":
+        column.byteswap()
+
+    return column.tobytes()
+
+
+def _from_bytes(typecode, data):
+    column = array(typecode)
+    column.frombytes(data)
+
+    if sys.byteorder == "big":
+        column.byteswap()
+
+    return column.tolist()
+
+
+def encode_points(points):
+    """Packs points into an archive blob
+
+    Args:
+        points (list[dict]): The points, as returned by `.values(*POINT_FIELDS)`,
+            ordered by date
+
+    Returns:
+        (bytes): The compressed blob
+    """
+    stamps = [(p["date"] - EPOCH) // timedelta(microseconds=1) for p in points]
+    columns = {
+        "date": [b - a for a, b in zip([0] + stamps, stamps)],
+        "value": [math.nan if p["value"] is None else p["value"] for p in points],
+        "cumulative": [int(p["cumulative"]) for p in points],
+    }
+
+    for name in ("epoch", "rank", "seq"):
+        columns[name] = [NULL_INT if p[name] is None else p[name] for p in points]
+
+    data = [_to_bytes(typecode, columns[name]) for name, typecode in COLUMNS]
+    header = json.dumps(
+        {
+            "version": FORMAT_VERSION,
+            "count": len(points),
+            "columns": [
+                [name, typecode, len(d)] for (name, typecode), d in zip(COLUMNS, data)
+            ],
+            "text_value": [p["text_value"] for p in points],
+            "metadata": [p["metadata"] for p in points],
+        },
+        cls=DjangoJSONEncoder,
+    ).encode()
+
+    return zlib.compress(struct.pack("<I", len(header)) + header + b"".join(data))
+
+
+def decode_points(blob, lookups=None, fields=None, last_n=None):
+    """Unpacks the points of an archive blob
+
+    The columns are unpacked as a whole, points are only built for the
+    selected ones. Dates are ordered, so lookups on them select a range.
+
+    Args:
+        blob (bytes): The blob, see `encode_points`
+        lookups (dict): Only return the points matching these lookups, see
+            :func:`api.utils.utils.matches_lookups`
+        fields (list[str]): The fields of the points to return, all
+            `POINT_FIELDS` by default
+        last_n (int): Only return the last `last_n` (matching) points
+
+    Returns:
+        (list[dict]): The points, ordered by date
+    """
+    raw = zlib.decompress(bytes(blob))
+    (length,) = struct.unpack_from("<I", raw)
+    header = json.loads(raw[4 : 4 + length].decode())
+
+    if header["version"] != FORMAT_VERSION:
+        raise ValueError("Unknown archive version {}".format(header["version"]))
+
+    columns = {}
+    offset = 4 + length
+
+    for name, typecode, size in header["columns"]:
+        columns[name] = _from_bytes(typecode, raw[offset : offset + size])
+        offset += size
+
+    stamps = list(accumulate(columns["date"]))
+    values = columns["value"]
+    getters = {
+        "date": lambda i: EPOCH + timedelta(microseconds=stamps[i]),
+        "value": lambda i: None if math.isnan(values[i]) else values[i],
+        "text_value": header["text_value"].__getitem__,
+        "cumulative": lambda i: bool(columns["cumulative"][i]),
+        "metadata": header["metadata"].__getitem__,
+    }
+
+    for name in ("epoch", "rank", "seq"):
+        getters[name] = lambda i, column=columns[name]: (
+            None if column[i] == NULL_INT else column[i]
+        )
+
+    first, last = 0, header["count"]
+    tests = []
+
+    for lookup, expected in (lookups or {}).items():
+        field, test = lookup_test(lookup, expected)
+
+        if field != "date" or lookup == "date":
+            tests.append((getters[field], test))
+            continue
+
+        stamp = (expected - EPOCH) // timedelta(microseconds=1)
+
+        if lookup == "date__gte":
+            first = max(first, bisect_left(stamps, stamp))
+        elif lookup == "date__gt":
+            first = max(first, bisect_right(stamps, stamp))
+        elif lookup == "date__lte":
+            last = min(last, bisect_right(stamps, stamp))
+        else:
+            last = min(last, bisect_left(stamps, stamp))
+
+    selected = range(first, last)
+
+    for get, test in tests:
+        selected = [i for i in selected if test(get(i))]
+
+    if last_n:
+        selected = selected[-last_n:]
+
+    fields = [(name, getters[name]) for name in fields or POINT_FIELDS]
+
+    return [{name: get(i) for name, get in fields} for i in selected]
+
+
+def get_archive(series):
+    """The archive of a series, or None if it has none"""
+    try:
+        return series.archive
+    except MetricArchive.DoesNotExist:
+        return None
+
+
+def _last_rows(rows, fields, last_n):
+    """Limits a `.values()` queryset of points to the last `last_n` of each
+    series, numbering them by descending date with a window function
+
+    Returns:
+        (iterable[dict]): The rows with `series_id` and `fields`, ordered by
+            series and date
+    """
+    if not connection.features.supports_over_clause:
+        series_ids = rows.values_list("series_id", flat=True).distinct().order_by()
+
+        return [
+            row
+            for series_id in sorted(series_ids)
+            for row in reversed(
+                rows.filter(series_id=series_id).order_by("-date")[:last_n]
+            )
+        ]
+
+    ranked = rows.annotate(
+        position=Window(
+            RowNumber(), partition_by=[F("series_id")], order_by=F("date").desc()
+        )
+    ).values("id", "series_id", *fields, "position")
+    sql, params = ranked.query.sql_with_params()
+
+    # a raw queryset converts the values, e.g. dates which SQLite returns as text
+    last = KubeMetric.objects.raw(
+        "SELECT * FROM (" + sql + ') AS "points" WHERE "position" <= %s '
+        'ORDER BY "series_id", "date"',
+        params + (last_n,),
+    )
+
+    return (
+        dict(series_id=m.series_id, **{f: getattr(m, f) for f in fields}) for m in last
+    )
+
+
+def series_points(series, lookups, fields, last_n=None):
+    """Reads the points of a series, from its archive, its chunks and the
+    metric table
+
+    Args:
+        series (:obj:`MetricSeries`): The series
+        lookups (dict): Filters on the points, e.g. `{"date__gte": since}`, see
+            :func:`api.utils.utils.matches_lookups`
+        fields (list[str]): The fields of the points to return
+        last_n (int): Only return the last `last_n` points
+
+    Returns:
+        (list[dict]): The points, ordered by date
+    """
+    return read_points([series], lookups, fields, last_n)[series.id]
+
+
+def read_points(series, lookups, fields, last_n=None):
+    """Like `series_points`, for several series with a constant number of
+    queries
+
+    Args:
+        series (list[:obj:`MetricSeries`]): The series
+        lookups (dict): Filters on the points
+        fields (list[str]): The fields of the points to return
+        last_n (int): Only return the last `last_n` points of each series
+
+    Returns:
+        (dict): The points of each series ordered by date, by series id
+    """
+    points = {s.id: [] for s in series}
+
+    if not points:
+        return points
+
+    rows = (
+        KubeMetric.objects.filter(series_id__in=points, **lookups)
+        .order_by("series_id", "date")
+        .values("series_id", *fields)
+    )
+
+    rows = _last_rows(rows, fields, last_n) if last_n else rows.iterator()
+
+    for row in rows:
+        points[row.pop("series_id")].append(row)
+
+    stored = read_series_chunks(series, lookups, last_n)
+
+    for series_id, chunk_points in stored.items():
+        stored[series_id] = [
+            {f: p[f] for f in fields}
+            for p in chunk_points
+            if matches_lookups(p, lookups)
+        ]
+
+    archives = MetricArchive.objects.filter(series_id__in=points).values_list(
+        "series_id", "data"
+    )
+
+    for series_id, data in archives:
+        stored[series_id] = stored.get(series_id, []) + decode_points(
+            data, lookups, fields, last_n
+        )
+
+    for series_id, stored_points in stored.items():
+        points[series_id] = sorted(
+            stored_points + points[series_id], key=lambda p: p["date"]
+        )
+
+        if last_n:
+            points[series_id] = points[series_id][-last_n:]
+
+    return points
+
+
+def archived_metrics(series):
+    """The archived points of some series, as unsaved :obj:`KubeMetric`
+
+    Args:
+        series (:obj:`QuerySet`): The series
+
+    Returns:
+        (list[:obj:`KubeMetric`]): The points
+    """
+    return [
+        KubeMetric(name=s.name, series=s, model_run_id=s.model_run_id, **point)
+        for s in series.filter(archive__isnull=False).select_related("archive")
+        for point in decode_points(s.archive.data)
+    ]
+
+
+def archive_series(series):
+    """Moves the points of a series into its archive
+
+    Points stored after an earlier archival are merged into the archive, and
+    chunks are archived like points.
+
+    Args:
+        series (:obj:`MetricSeries`): The series
+    """
+    with transaction.atomic():
+        series = MetricSeries.objects.select_for_update().get(id=series.id)
+        points = list(series.points.order_by("date").values("id", *POINT_FIELDS))
+        chunks = list(series.chunks.all())
+        points += [p for chunk in chunks for p in decode_chunk(chunk, series)]
+
+        archive = MetricArchive.objects.filter(series=series).first()
+
+        if not points:
+            # only the count was off, e.g. after concurrent retries of inserts
+            MetricSeries.objects.filter(id=series.id).update(
+                count=archive.count if archive else 0
+            )
+            return
+
+        if archive is None:
+            archive = MetricArchive(series=series)
+            archived = []
+        else:
+            archived = decode_points(archive.data)
+
+        archived = sorted(archived + points, key=lambda p: p["date"])
+        archive.data = encode_points(archived)
+        archive.count = len(archived)
+        archive.save()
+
+        KubeMetric.objects.filter(
+            id__in=[p["id"] for p in points if "id" in p]
+        ).delete()
+        MetricChunk.objects.filter(id__in=[c.id for c in chunks]).delete()
+        MetricSeries.objects.filter(id=series.id).update(count=archive.count)
+
+
+def series_to_archive(now, delay):
+    """Series of ended runs with points left in the metric table
+
+    Args:
+        now (:obj:`datetime`): Current time
+        delay (int): Seconds since the last point of a series before it's
+            archived, in case workers still send metrics
+
+    Returns:
+        (:obj:`QuerySet`): The series
+    """
+    return MetricSeries.objects.filter(
+        Q(archive__isnull=True) | ~Q(archive__count=F("count")),
+        model_run__state__in=[ModelRun.FINISHED, ModelRun.FAILED],
+        last_date__lt=now - timedelta(seconds=delay),
+        count__gt=0,
+    )
+
+
+@job
+def archive_ended_runs():
+    """Background task archiving the metrics of finished and failed runs"""
+    delay = settings.METRICS_ARCHIVE_DELAY
+
+    if delay is None:
+        return
+
+    for series in list(series_to_archive(timezone.now(), delay)):
+        archive_series(series)
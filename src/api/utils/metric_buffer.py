@@ -0,0 +1,284 @@
+"""Write-behind buffering of posted metrics through a Redis stream.
+
+When `settings.METRICS_WRITE_BEHIND` is enabled, posted metrics are only
+validated and appended to a Redis stream, and the request returns right
+away. Drainers (the `drain_metric_buffer` job or the `drain_metrics`
+management command) read the stream through a consumer group and
+bulk-insert the metrics into the database.
+
+Entries are only acknowledged (and deleted) after they were inserted. Entries
+of a drainer that crashed stay pending and are re-read by the same consumer or
+claimed by another one once they've been idle for `CLAIM_MIN_IDLE_MS`, so no
+metric is lost (delivery is at-least-once).
+
+The stream is capped at about `settings.METRICS_BUFFER_MAXLEN` entries so it
+can't fill up Redis while no drainer is running. Once the cap is reached the
+oldest entries are trimmed, and counted in `DROPPED_KEY`.
+
+The redis client we use predates streams, hence the raw `execute_command` calls.
+"""
+import json
+import logging
+import os
+import socket
+import time
+
+import django_rq
+from django.conf import settings
+from django_rq import job
+from redis.exceptions import ResponseError
+
+from api.utils.metric_utils import build_metric, create_metrics, resolve_runs
+
+STREAM_KEY = "mlbench:metrics"
+CONSUMER_GROUP = "metric-drainers"
+
+# Number of metrics trimmed from the stream because it reached its maximum length
+DROPPED_KEY = "mlbench:metrics:dropped"
+
+# Number of entries read from the stream and inserted at once
+DRAIN_BATCH_SIZE = 1000
+
+# Pending entries idle for longer than this belong to a crashed drainer
+CLAIM_MIN_IDLE_MS = 60 * 1000
+
+# Maximum time a single `drain_metric_buffer` job keeps draining
+DRAIN_TIME_BUDGET = 30
+
+logger = logging.getLogger("dashboard")
+
+
+def _decode(value):
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
+def consumer_name():
+    """Unique name of this process in the consumer group"""
+    return "{}-{}".format(socket.gethostname(), os.getpid())
+
+
+def _ensure_group(conn):
+    try:
+        conn.execute_command(
+            "XGROUP", "CREATE", STREAM_KEY, CONSUMER_GROUP, "0", "MKSTREAM"
+        )
+    except ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+def _parse_entries(entries):
+    """Parses stream entries into (id, metric) tuples
+
+    Args:
+        entries (list): Entries as returned by XRANGE/XCLAIM, `[id, [field, value, ...]]`
+
+    Returns:
+        (list[tuple]): The entry ids and metrics. The metric is `None` for
+            entries that were deleted in the meantime
+    """
+    result = []
+
+    for entry_id, fields in entries:
+        metric = None
+
+        if fields:
+            fields = dict(zip(fields[::2], fields[1::2]))
+            metric = json.loads(_decode(fields[b"metric"]))
+
+        result.append((_decode(entry_id), metric))
+
+    return result
+
+
+def _read_group(conn, consumer, last_id, count, block=None):
+    args = ["XREADGROUP", "GROUP", CONSUMER_GROUP, consumer, "COUNT", count]
+
+    if block is not None:
+        args += ["BLOCK", block]
+
+    response = conn.execute_command(*args, "STREAMS", STREAM_KEY, last_id)
+
+    if not response:
+        return []
+
+    return _parse_entries(response[0][1])
+
+
+def _claim_stale(conn, consumer, count):
+    pending = conn.execute_command(
+        "XPENDING", STREAM_KEY, CONSUMER_GROUP, "-", "+", count
+    )
+
+    stale = [
+        entry_id
+        for entry_id, owner, idle, _ in pending
+        if idle >= CLAIM_MIN_IDLE_MS and _decode(owner) != consumer
+    ]
+
+    if not stale:
+        return []
+
+    return _parse_entries(
+        conn.execute_command(
+            "XCLAIM", STREAM_KEY, CONSUMER_GROUP, consumer, CLAIM_MIN_IDLE_MS, *stale
+        )
+    )
+
+
+def buffer_metrics(items, runs=None, offset=0):
+    """Validates a batch of metrics and appends the valid ones to the stream
+
+    Same interface as :func:`api.utils.metric_utils.create_metrics`, the
+    metrics are inserted later by a drainer.
+
+    Args:
+        items (list[dict]): The posted metrics
+        runs (dict | None): Already resolved runs, updated with the runs of
+            this batch. Default `None`
+        offset (int): Index of the first item, used in error reports. Default 0
+
+    Returns:
+        (tuple[list, list]): The buffered (unsaved) metrics and a list of errors
+    """
+    if runs is None:
+        runs = {}
+    runs.update(resolve_runs(items, known=runs))
+
+    metrics = []
+    errors = []
+
+    conn = django_rq.get_connection()
+
+    # In a transaction, so the stream length difference is only due to trimming
+    pipe = conn.pipeline(transaction=True)
+    pipe.execute_command("XLEN", STREAM_KEY)
+
+    for i, d in enumerate(items, offset):
+        try:
+            metrics.append(build_metric(d, runs))
+        except ValueError as e:
+            errors.append({"index": i, "message": str(e)})
+            continue
+
+        pipe.execute_command(
+            "XADD",
+            STREAM_KEY,
+            "MAXLEN",
+            "~",
+            settings.METRICS_BUFFER_MAXLEN,
+            "*",
+            "metric",
+            json.dumps({k: d[k] for k in d}),
+        )
+
+    if metrics:
+        pipe.execute_command("XLEN", STREAM_KEY)
+        result = pipe.execute()
+        dropped = result[0] + len(metrics) - result[-1]
+
+        if dropped > 0:
+            logger.warning(
+                "Metric buffer is full, dropped {} buffered metrics".format(dropped)
+            )
+            conn.incrby(DROPPED_KEY, dropped)
+
+    return metrics, errors
+
+
+def drain_metrics(consumer, count=None, block=None):
+    """Moves one batch of buffered metrics from the stream to the database
+
+    Entries this consumer read before but never acknowledged are handled
+    first, then stale entries of other (crashed) consumers, then new ones.
+
+    Args:
+        consumer (str): Name of the consumer in the group
+        count (int | None): Maximum number of entries to handle. Default `DRAIN_BATCH_SIZE`
+        block (int | None): Milliseconds to wait for new entries. Default `None` (don't wait)
+
+    Returns:
+        (int): Number of stream entries handled
+    """
+    conn = django_rq.get_connection()
+    count = count or DRAIN_BATCH_SIZE
+
+    _ensure_group(conn)
+
+    entries = (
+        _read_group(conn, consumer, "0", count)
+        or _claim_stale(conn, consumer, count)
+        or _read_group(conn, consumer, ">", count, block=block)
+    )
+
+    if not entries:
+        return 0
+
+    metrics, errors = create_metrics([m for _, m in entries if m is not None])
+
+    for error in errors:
+        # The run was deleted since the metric was buffered, nothing to retry
+        logger.warning("Dropping buffered metric: {}".format(error["message"]))
+
+    ids = [entry_id for entry_id, _ in entries]
+
+    pipe = conn.pipeline(transaction=False)
+    pipe.execute_command("XACK", STREAM_KEY, CONSUMER_GROUP, *ids)
+    pipe.execute_command("XDEL", STREAM_KEY, *ids)
+    pipe.execute()
+
+    return len(ids)
+
+
+def buffer_status():
+    """Reports the state of the metric buffer
+
+    Returns:
+        (dict): `depth` (buffered metrics not yet inserted), `pending` (metrics
+            currently being inserted by a drainer), `lag` (age of the oldest
+            buffered metric in seconds), `max_depth` (maximum length of the
+            stream) and `dropped` (metrics trimmed because the stream was full)
+    """
+    conn = django_rq.get_connection()
+
+    depth = conn.execute_command("XLEN", STREAM_KEY)
+
+    try:
+        pending = conn.execute_command("XPENDING", STREAM_KEY, CONSUMER_GROUP)[0]
+    except ResponseError:
+        # stream or group don't exist (yet)
+        pending = 0
+
+    lag = 0.0
+    oldest = conn.execute_command("XRANGE", STREAM_KEY, "-", "+", "COUNT", 1)
+
+    if oldest:
+        oldest_ms = int(_decode(oldest[0][0]).split("-")[0])
+        lag = max(0.0, time.time() - oldest_ms / 1000)
+
+    return {
+        "enabled": settings.METRICS_WRITE_BEHIND,
+        "depth": depth,
+        "pending": pending,
+        "lag": lag,
+        "max_depth": settings.METRICS_BUFFER_MAXLEN,
+        "dropped": int(conn.get(DROPPED_KEY) or 0),
+    }
+
+
+@job
+def drain_metric_buffer():
+    """Background task moving buffered metrics into the database"""
+    if not settings.METRICS_WRITE_BEHIND:
+        return
+
+    consumer = consumer_name()
+    deadline = time.monotonic() + DRAIN_TIME_BUDGET
+
+    while drain_metrics(consumer) and time.monotonic() < deadline:
+        pass
+
+    # Everything this consumer read was acknowledged, it can be forgotten
+    django_rq.get_connection().execute_command(
+        "XGROUP", "DELCONSUMER", STREAM_KEY, CONSUMER_GROUP, consumer
+    )
@@ -0,0 +1,199 @@
+"""Cache of the responses of metric queries about ended runs, in Redis.
+
+The metrics of a finished or failed run don't change anymore, yet each visit
+of its page used to read and summarize all of them again. With
+`settings.METRICS_CACHE_SIZE` set, :class:`api.views.KubeMetricsView` stores
+the rendered response of such queries, keyed by the run, the query parameters
+and the statistics of the series, so late metrics or removed ones (see
+:mod:`api.utils.metric_partitions`) make the entries of a run unused. Those
+of deleted runs are removed.
+
+Entries are evicted least recently used first once they take more than
+`settings.METRICS_CACHE_SIZE` bytes. Redis' own LRU eviction isn't used, it
+would also evict the jobs of the queues sharing the instance.
+"""
+import hashlib
+import time
+
+import django_rq
+from django.conf import settings
+
+PREFIX = "mlbench:metric-cache"
+
+# sorted set of the entries by time of last use
+LRU_KEY = PREFIX + ":lru"
+
+# hash of the size of each entry, in bytes
+SIZES_KEY = PREFIX + ":sizes"
+
+# total size of the entries, in bytes
+TOTAL_KEY = PREFIX + ":total"
+
+
+def _entry_key(run_id, params):
+    digest = hashlib.sha1(repr(sorted(params.items())).encode()).hexdigest()
+
+    return "{}:entry:{}:{}".format(PREFIX, run_id, digest)
+
+
+def _run_key(run_id):
+    """Set of the entries of a run"""
+    return "{}:run:{}".format(PREFIX, run_id)
+
+
+def _decode(value):
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
+def _touch(conn, key):
+    # the argument order of `zadd` differs between redis client classes
+    conn.execute_command("ZADD", LRU_KEY, time.time(), key)
+
+
+def _delete(conn, keys):
+    if not keys:
+        return
+
+    sizes = conn.hmget(SIZES_KEY, keys)
+    pipe = conn.pipeline()
+    pipe.delete(*keys)
+    pipe.hdel(SIZES_KEY, *keys)
+    pipe.zrem(LRU_KEY, *keys)
+    pipe.decrby(TOTAL_KEY, sum(int(s or 0) for s in sizes))
+
+    for key in keys:
+        run_id = _decode(key).split(":")[-2]
+        pipe.srem(_run_key(run_id), key)
+
+    pipe.execute()
+
+
+def _evict(conn):
+    while int(conn.get(TOTAL_KEY) or 0) > settings.METRICS_CACHE_SIZE:
+        oldest = conn.zrange(LRU_KEY, 0, 0)
+
+        if not oldest:
+            break
+
+        _delete(conn, oldest)
+
+
+def get_cached(run_id, params):
+    """Gets a cached response
+
+    Args:
+        run_id (int): The run
+        params (dict): What the response depends on, e.g. the query parameters
+
+    Returns:
+        (dict | None): The fields of the response as stored by `set_cached`
+            (bytes), or None if it isn't cached
+    """
+    return get_cached_many([(run_id, params)])[0]
+
+
+def get_cached_many(entries):
+    """Gets several cached responses in a constant number of round trips
+
+    Args:
+        entries (list[tuple]): The run and params of each response, see `get_cached`
+
+    Returns:
+        (list[dict | None]): The fields of each response, or None if it isn't cached
+    """
+    if not settings.METRICS_CACHE_SIZE:
+        return [None] * len(entries)
+
+    conn = django_rq.get_connection()
+    keys = [_entry_key(run_id, params) for run_id, params in entries]
+
+    pipe = conn.pipeline()
+
+    for key in keys:
+        pipe.hgetall(key)
+
+    result = pipe.execute()
+    pipe = conn.pipeline()
+
+    for key, entry in zip(keys, result):
+        if entry:
+            _touch(pipe, key)
+
+    pipe.execute()
+
+    return [
+        {_decode(k): v for k, v in entry.items()} if entry else None for entry in result
+    ]
+
+
+def set_cached(run_id, params, fields):
+    """Caches a response, evicting the least recently used ones if the cache
+    gets too large
+
+    Args:
+        run_id (int): The run
+        params (dict): What the response depends on, e.g. the query parameters
+        fields (dict): The parts of the response, as bytes or str
+    """
+    set_cached_many([(run_id, params, fields)])
+
+
+def set_cached_many(entries):
+    """Caches several responses in a constant number of round trips, see
+    `set_cached`
+
+    Args:
+        entries (list[tuple]): The run, params and fields of each response
+    """
+    if not settings.METRICS_CACHE_SIZE:
+        return
+
+    entries = [
+        (
+            _entry_key(run_id, params),
+            run_id,
+            fields,
+            sum(len(v) for v in fields.values()),
+        )
+        for run_id, params, fields in entries
+    ]
+    entries = [e for e in entries if e[3] <= settings.METRICS_CACHE_SIZE]
+
+    if not entries:
+        return
+
+    conn = django_rq.get_connection()
+    previous = conn.hmget(SIZES_KEY, [key for key, _, _, _ in entries])
+
+    pipe = conn.pipeline()
+
+    for (key, run_id, fields, size), previous_size in zip(entries, previous):
+        pipe.delete(key)
+        pipe.hmset(key, fields)
+        pipe.hset(SIZES_KEY, key, size)
+        pipe.incrby(TOTAL_KEY, size - int(previous_size or 0))
+        pipe.sadd(_run_key(run_id), key)
+        _touch(pipe, key)
+
+    pipe.execute()
+
+    _evict(conn)
+
+
+def invalidate_runs(run_ids):
+    """Deletes the cached responses of some runs
+
+    Args:
+        run_ids (iterable[int]): The runs
+    """
+    if not settings.METRICS_CACHE_SIZE:
+        return
+
+    conn = django_rq.get_connection()
+    pipe = conn.pipeline()
+
+    for run_id in run_ids:
+        pipe.smembers(_run_key(run_id))
+
+    keys = [key for members in pipe.execute() for key in members]
+    _delete(conn, keys)
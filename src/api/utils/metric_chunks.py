@@ -0,0 +1,252 @@
+"""Chunked storage of numeric metrics, as in Gorilla.
+
+If `settings.METRICS_CHUNK_STORAGE` is enabled, :func:`insert_metrics`
+appends plain numeric points (no text value, metadata, epoch, rank or
+idempotency key) to the latest :obj:`MetricChunk` of their series instead of
+storing a row per point. A chunk holds up to `MetricChunk.SIZE` points
+encoded with :mod:`api.utils.gorilla`, a new one is started once it's full.
+
+Chunks only grow at their end, so readers can keep track of the points they
+read (see :mod:`api.utils.metric_cursor`). Points older than the last point
+of their series' latest chunk are still stored as rows, as are all other
+points. Readers of a series (see
+:func:`api.utils.metric_archive.series_points`) merge both, so chunk storage
+can be enabled and disabled at any time.
+"""
+from datetime import datetime, timedelta
+
+import pytz
+from django.db.models import F, Sum
+
+from api.models import KubeMetric, MetricChunk, MetricSeries
+from api.utils import gorilla
+from api.utils.utils import matches_lookups
+
+EPOCH = datetime(1970, 1, 1, tzinfo=pytz.utc)
+
+
+def _timestamp(date):
+    return (date - EPOCH) // timedelta(microseconds=1)
+
+
+def is_chunkable(metric):
+    """Checks if a metric can be stored in a chunk, which only holds dates
+    and numeric values
+
+    Args:
+        metric (:obj:`KubeMetric`): The metric, with its series set
+
+    Returns:
+        (bool): If the metric can be stored in a chunk
+    """
+    return (
+        metric.value is not None
+        and not metric.text_value
+        and metric.metadata is None
+        and metric.epoch is None
+        and metric.rank is None
+        and metric.seq is None
+        and metric.cumulative == metric.series.cumulative
+    )
+
+
+def _save_chunk(chunk, points):
+    timestamps, values = zip(*points)
+    chunk.data = gorilla.encode(timestamps, values)
+    chunk.start = EPOCH + timedelta(microseconds=timestamps[0])
+    chunk.end = EPOCH + timedelta(microseconds=timestamps[-1])
+    chunk.count = len(points)
+    chunk.save()
+
+
+def append_points(metrics):
+    """Appends metrics to the latest chunks of their series
+
+    Has to run in a transaction, the latest chunks are locked until the end
+    of it.
+
+    Args:
+        metrics (list[:obj:`KubeMetric`]): Chunkable metrics, see `is_chunkable`
+
+    Returns:
+        (list[:obj:`KubeMetric`]): The metrics that are older than the last
+            point of the latest chunk of their series, to be stored as rows
+    """
+    by_series = {}
+    rejected = []
+
+    for metric in metrics:
+        by_series.setdefault(metric.series_id, []).append(metric)
+
+    for series_id, series_metrics in by_series.items():
+        chunk = (
+            MetricChunk.objects.select_for_update()
+            .filter(series_id=series_id)
+            .order_by("-start", "-id")
+            .first()
+        )
+        points = []
+
+        if chunk is not None:
+            points = list(zip(*gorilla.decode(chunk.data)))
+
+        for metric in sorted(series_metrics, key=lambda m: m.date):
+            timestamp = _timestamp(metric.date)
+
+            if points and timestamp < points[-1][0]:
+                rejected.append(metric)
+                continue
+
+            if chunk is None or len(points) >= MetricChunk.SIZE:
+                if chunk is not None:
+                    _save_chunk(chunk, points)
+
+                chunk = MetricChunk(series_id=series_id, start=metric.date)
+                points = []
+
+            points.append((timestamp, metric.value))
+
+        _save_chunk(chunk, points)
+
+    return rejected
+
+
+def decode_chunk(chunk, series):
+    """Decodes the points of a chunk
+
+    Args:
+        chunk (:obj:`MetricChunk`): The chunk
+        series (:obj:`MetricSeries`): Its series
+
+    Returns:
+        (list[dict]): The points with the same fields as archived points,
+            see :func:`api.utils.metric_archive.decode_points`
+    """
+    return [
+        {
+            "date": EPOCH + timedelta(microseconds=timestamp),
+            "value": value,
+            "text_value": "",
+            "cumulative": series.cumulative,
+            "metadata": None,
+            "epoch": None,
+            "rank": None,
+            "seq": None,
+        }
+        for timestamp, value in zip(*gorilla.decode(chunk.data))
+    ]
+
+
+def read_chunks(series, lookups):
+    """Decodes the chunks of a series that can contain points matching the
+    date lookups
+
+    Args:
+        series (:obj:`MetricSeries`): The series
+        lookups (dict): Filters on the points, only those on `date` are used
+
+    Returns:
+        (list[dict]): The points of the chunks, see `decode_chunk`
+    """
+    return read_series_chunks([series], lookups).get(series.id, [])
+
+
+def _latest_chunks(chunks, dates, last_n):
+    """Ids of the newest chunks of each series that hold at least `last_n`
+    points matching the date lookups
+
+    Only chunks entirely within the dates count towards `last_n`, the points
+    of others might not match.
+    """
+    ids = []
+    counts = {}
+
+    for chunk_id, series_id, start, end, count in chunks.order_by(
+        "series_id", "-start"
+    ).values_list("id", "series_id", "start", "end", "count"):
+        if counts.get(series_id, 0) >= last_n:
+            continue
+
+        ids.append(chunk_id)
+
+        if matches_lookups({"date": start}, dates) and matches_lookups(
+            {"date": end}, dates
+        ):
+            counts[series_id] = counts.get(series_id, 0) + count
+
+    return ids
+
+
+def read_series_chunks(series, lookups, last_n=None):
+    """Like `read_chunks`, for several series
+
+    Args:
+        series (list[:obj:`MetricSeries`]): The series
+        lookups (dict): Filters on the points, only those on `date` are used
+        last_n (int): Only decode the newest chunks holding the last `last_n`
+            points of each series
+
+    Returns:
+        (dict): The points of the chunks of each series with chunks, by series id
+    """
+    by_id = {s.id: s for s in series}
+    chunks = MetricChunk.objects.filter(series_id__in=by_id)
+    dates = {}
+
+    for lookup, date in lookups.items():
+        if lookup in ("date__gt", "date__gte"):
+            chunks = chunks.filter(end__gte=date)
+        elif lookup in ("date__lt", "date__lte"):
+            chunks = chunks.filter(start__lte=date)
+        else:
+            continue
+
+        dates[lookup] = date
+
+    if last_n:
+        chunks = MetricChunk.objects.filter(
+            id__in=_latest_chunks(chunks, dates, last_n)
+        )
+
+    points = {}
+
+    for chunk in chunks.order_by("series_id", "start"):
+        points.setdefault(chunk.series_id, []).extend(
+            decode_chunk(chunk, by_id[chunk.series_id])
+        )
+
+    return points
+
+
+def chunked_metrics(series):
+    """The chunked points of some series, as unsaved :obj:`KubeMetric`
+
+    Args:
+        series (:obj:`QuerySet`): The series
+
+    Returns:
+        (list[:obj:`KubeMetric`]): The points
+    """
+    return [
+        KubeMetric(
+            name=s.name, series=s, model_run_id=s.model_run_id, pod_id=s.pod_id, **point
+        )
+        for s in series.filter(chunks__isnull=False).distinct()
+        for point in read_chunks(s, {})
+    ]
+
+
+def drop_chunks(before):
+    """Deletes the chunks whose points are all older than `before`
+
+    Args:
+        before (:obj:`datetime`): The date
+    """
+    chunks = MetricChunk.objects.filter(end__lt=before)
+
+    for series_id, count in (
+        chunks.values_list("series_id").annotate(count=Sum("count")).order_by()
+    ):
+        MetricSeries.objects.filter(id=series_id).update(count=F("count") - count)
+
+    chunks.delete()
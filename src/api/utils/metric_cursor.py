@@ -0,0 +1,173 @@
+"""Cursors for incremental reads of metrics.
+
+Clients polling for new metrics used to send the time of their last poll as
+`since`, which loses or repeats points when clocks differ or points arrive
+late. A cursor instead records, for each series, what was read:
+
+- the id of its last row in the metric table. Inserts lock their series
+  before allocating row ids (see :func:`api.utils.metric_utils.insert_metrics`),
+  so rows with a greater id are exactly those committed since.
+- the id of its latest chunk and the number of points read from it. Chunks
+  only grow at their end, and a new chunk has a greater id.
+
+Archives only hold points that were read before, from rows or chunks.
+
+Cursors are passed to clients as opaque strings.
+"""
+import base64
+import binascii
+import json
+import operator
+from contextlib import contextmanager
+from functools import reduce
+
+from django.db import connection, transaction
+from django.db.models import Max, Q
+
+from api.models import KubeMetric, MetricChunk
+from api.utils.metric_chunks import decode_chunk
+
+
+def encode_cursor(state):
+    """Encodes the state of a cursor for clients
+
+    Args:
+        state (dict): `[row id, chunk id, chunk position]` by series id
+
+    Returns:
+        (str): The cursor
+    """
+    data = json.dumps({str(k): v for k, v in state.items()}, separators=(",", ":"))
+
+    return base64.urlsafe_b64encode(data.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Decodes a cursor from `encode_cursor`
+
+    Args:
+        cursor (str): The cursor
+
+    Returns:
+        (dict): `[row id, chunk id, chunk position]` by series id
+
+    Raises:
+        ValueError: If the cursor is invalid
+    """
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        state = {int(k): [int(i) for i in v] for k, v in data.items()}
+    except (binascii.Error, UnicodeDecodeError, AttributeError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+    if any(len(v) != 3 for v in state.values()):
+        raise ValueError("Invalid cursor")
+
+    return state
+
+
+@contextmanager
+def snapshot():
+    """A transaction whose reads all see the same state of the database, so
+    a cursor matches the points read with it
+
+    Inside an outer transaction, its isolation level is kept.
+    """
+    # a new transaction, postgres only allows this as its first statement
+    outermost = not connection.in_atomic_block
+
+    with transaction.atomic():
+        if connection.vendor == "postgresql" and outermost:
+            with connection.cursor() as cursor:
+                cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+
+        yield
+
+
+def series_cursor(series):
+    """The current state of the cursor of some series
+
+    Args:
+        series (list[:obj:`MetricSeries`]): The series
+
+    Returns:
+        (dict): `[row id, chunk id, chunk position]` by series id
+    """
+    state = {s.id: [0, 0, 0] for s in series}
+    rows = (
+        KubeMetric.objects.filter(series_id__in=state)
+        .values_list("series_id")
+        .annotate(last=Max("id"))
+        .order_by()
+    )
+
+    for series_id, row_id in rows:
+        state[series_id][0] = row_id
+
+    latest = (
+        MetricChunk.objects.filter(series_id__in=state)
+        .values("series_id")
+        .annotate(latest=Max("id"))
+        .values("latest")
+    )
+
+    for series_id, chunk_id, count in MetricChunk.objects.filter(
+        id__in=latest
+    ).values_list("series_id", "id", "count"):
+        state[series_id][1:] = [chunk_id, count]
+
+    return state
+
+
+def read_since(series, state, fields):
+    """Reads the points added to some series since the state of a cursor
+
+    Args:
+        series (list[:obj:`MetricSeries`]): The series
+        state (dict): The state of the cursor, see `series_cursor`. Series
+            missing from it are read entirely
+        fields (list[str]): The fields of the points to return
+
+    Returns:
+        (tuple[dict, dict]): The new points of each series ordered by date,
+            by series id, and the new state of the cursor
+    """
+    by_id = {s.id: s for s in series}
+    state = {i: list(state.get(i, [0, 0, 0])) for i in by_id}
+    points = {i: [] for i in by_id}
+
+    if not points:
+        return points, state
+
+    rows = (
+        KubeMetric.objects.filter(
+            reduce(
+                operator.or_, (Q(series_id=i, id__gt=s[0]) for i, s in state.items())
+            )
+        )
+        .order_by("series_id", "id")
+        .values("series_id", "id", *fields)
+    )
+
+    for row in rows.iterator():
+        series_id = row.pop("series_id")
+        state[series_id][0] = row.pop("id")
+        points[series_id].append(row)
+
+    # the chunk read last may have grown since
+    chunks = MetricChunk.objects.filter(
+        reduce(operator.or_, (Q(series_id=i, id__gte=s[1]) for i, s in state.items()))
+    ).order_by("series_id", "id")
+
+    for chunk in chunks:
+        chunk_points = decode_chunk(chunk, by_id[chunk.series_id])
+        _, chunk_id, position = state[chunk.series_id]
+        new_points = chunk_points[position:] if chunk.id == chunk_id else chunk_points
+
+        points[chunk.series_id] += [{f: p[f] for f in fields} for p in new_points]
+        state[chunk.series_id][1:] = [chunk.id, len(chunk_points)]
+
+    for series_id in points:
+        points[series_id].sort(key=lambda p: p["date"])
+
+    return points, state
@@ -0,0 +1,295 @@
+"""Monthly partitioning of the metric table on postgres.
+
+Our postgres (9.6) predates declarative partitioning, so partitions are
+child tables inheriting from `api_kubemetric`, one per calendar month (UTC),
+named e.g. `api_kubemetric_y2020m01`. Each has a CHECK constraint on its
+date range, so the planner skips partitions that can't match a date filter
+(`constraint_exclusion`), and its own copy of the indexes of the parent.
+
+Once enabled, the insert trigger installed by migration 0022 routes new
+metrics into the partition of their month. Metrics of months without a
+partition, and all metrics stored before partitioning was enabled, stay in
+the parent table. Queries on `KubeMetric` see the rows of all partitions.
+
+Retention detaches or drops whole partitions, which is instant compared to
+deleting their rows.
+
+Inserts into a partition return no rows, so with `settings.METRICS_PARTITIONING`
+:func:`api.utils.metric_utils.insert_metrics` inserts without `RETURNING`, and
+`KubeMetric.save()` takes the id from the sequence beforehand. Partitioning
+must only be enabled along with that setting.
+"""
+import logging
+from datetime import datetime
+
+import pytz
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import UniqueConstraint
+from django_rq import job
+
+from api.models import KubeMetric, MetricRollup
+from api.utils.metric_chunks import drop_chunks
+
+PARTITION_PREFIX = "api_kubemetric_y"
+
+# Number of future months that always have a partition
+MONTHS_AHEAD = 3
+
+logger = logging.getLogger("dashboard")
+
+
+def _parent_table():
+    return KubeMetric._meta.db_table
+
+
+def month_start(date, months=0):
+    """Start of the month (UTC) of `date`, shifted by `months`
+
+    Args:
+        date (:obj:`datetime`): Any date in the month
+        months (int): Number of months to shift by, can be negative. Default 0
+
+    Returns:
+        (:obj:`datetime`): Midnight of the first day of the month, in UTC
+    """
+    if date.tzinfo is not None:
+        date = date.astimezone(pytz.utc)
+
+    month = date.year * 12 + date.month - 1 + months
+    return datetime(month // 12, month % 12 + 1, 1, tzinfo=pytz.utc)
+
+
+def partition_name(date):
+    """Name of the partition holding the metrics of the month of `date`"""
+    start = month_start(date)
+    return "{}{:04d}m{:02d}".format(PARTITION_PREFIX, start.year, start.month)
+
+
+def _check_postgres():
+    if connection.vendor != "postgresql":
+        raise NotImplementedError("Metric partitioning requires postgres")
+
+
+def list_partitions():
+    """Lists the partitions of the metric table
+
+    Returns:
+        (list[tuple[str, datetime]]): Name and start of month of each
+            partition, ordered by date
+    """
+    _check_postgres()
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = %s",
+            [_parent_table()],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+
+    partitions = []
+
+    for name in names:
+        try:
+            start = datetime.strptime(name[len(PARTITION_PREFIX) :], "%Ym%m")
+        except ValueError:
+            continue
+
+        partitions.append((name, start.replace(tzinfo=pytz.utc)))
+
+    return sorted(partitions, key=lambda p: p[1])
+
+
+def _index_statements(table):
+    """The indexes of `KubeMetric`, for a partition"""
+    meta = KubeMetric._meta
+
+    def columns(fields):
+        return ", ".join(
+            connection.ops.quote_name(meta.get_field(f).column) for f in fields
+        )
+
+    statements = [
+        "CREATE INDEX {0}_{1} ON {0} ({2})".format(table, i, columns(index.fields))
+        for i, index in enumerate(meta.indexes)
+    ]
+    statements += [
+        "CREATE UNIQUE INDEX {0}_u{1} ON {0} ({2})".format(
+            table, i, columns(constraint.fields)
+        )
+        for i, constraint in enumerate(meta.constraints)
+        if isinstance(constraint, UniqueConstraint)
+    ]
+    statements.append(
+        "CREATE INDEX {0}_date_brin ON {0} USING brin (date)".format(table)
+    )
+
+    return statements
+
+
+def create_partition(date):
+    """Creates the partition for the month of `date`, if it doesn't exist
+
+    Args:
+        date (:obj:`datetime`): Any date in the month
+
+    Returns:
+        (bool): Whether the partition was created
+    """
+    _check_postgres()
+
+    name = partition_name(date)
+
+    if name in dict(list_partitions()):
+        return False
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            "CREATE TABLE {name} ("
+            "PRIMARY KEY (id), "
+            "CHECK (date >= %s AND date < %s)"
+            ") INHERITS ({parent})".format(name=name, parent=_parent_table()),
+            [month_start(date), month_start(date, 1)],
+        )
+
+        for statement in _index_statements(name):
+            cursor.execute(statement)
+
+    return True
+
+
+def enable_partitioning(months_ahead=MONTHS_AHEAD):
+    """Creates the partitions up to `months_ahead` and starts routing inserts
+
+    Args:
+        months_ahead (int): Number of future months to create partitions for
+
+    Returns:
+        (list[str]): Names of the created partitions
+    """
+    _check_postgres()
+
+    now = datetime.now(pytz.utc)
+    created = [
+        partition_name(month_start(now, i))
+        for i in range(months_ahead + 1)
+        if create_partition(month_start(now, i))
+    ]
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_trigger WHERE tgname = 'kubemetric_partition_insert'"
+        )
+
+        if cursor.fetchone() is None:
+            cursor.execute(
+                "CREATE TRIGGER kubemetric_partition_insert "
+                "BEFORE INSERT ON {} FOR EACH ROW "
+                "EXECUTE PROCEDURE kubemetric_partition_insert()".format(
+                    _parent_table()
+                )
+            )
+
+    return created
+
+
+def disable_partitioning():
+    """Stops routing inserts into partitions, existing partitions are kept"""
+    _check_postgres()
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "DROP TRIGGER IF EXISTS kubemetric_partition_insert ON {}".format(
+                _parent_table()
+            )
+        )
+
+
+def _forget_points(cursor, table, until):
+    """Updates the statistics of the series whose points in `table` are
+    about to be removed"""
+    cursor.execute(
+        "UPDATE api_metricseries s SET count = GREATEST(s.count - d.n, 0), "
+        "first_date = (SELECT min(m.date) FROM {parent} m "
+        "WHERE m.series_id = s.id AND m.date >= %s) "
+        "FROM (SELECT series_id, count(*) AS n FROM {table} GROUP BY series_id) d "
+        "WHERE s.id = d.series_id".format(parent=_parent_table(), table=table),
+        [until],
+    )
+
+
+def drop_partitions(before, detach_only=False):
+    """Removes the metrics of all months before `before`
+
+    Whole partitions are detached (and dropped). Rows of these months left
+    in the parent table and the rollups and chunks of these months are
+    deleted.
+
+    Args:
+        before (:obj:`datetime`): Partitions ending before or at this date
+            are removed
+        detach_only (bool): Only detach the partitions from the metric table,
+            keeping their data in a standalone table. Default `False`
+
+    Returns:
+        (list[str]): Names of the removed partitions
+    """
+    _check_postgres()
+
+    removed = []
+
+    for name, start in list_partitions():
+        end = month_start(start, 1)
+
+        if end > before:
+            break
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            _forget_points(cursor, name, end)
+            cursor.execute("ALTER TABLE {} NO INHERIT {}".format(name, _parent_table()))
+
+            if not detach_only:
+                cursor.execute("DROP TABLE {}".format(name))
+
+        removed.append(name)
+
+    cutoff = month_start(before)
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            "CREATE TEMPORARY TABLE kubemetric_expired ON COMMIT DROP AS "
+            "SELECT id, series_id FROM ONLY {} WHERE date < %s".format(_parent_table()),
+            [cutoff],
+        )
+        _forget_points(cursor, "kubemetric_expired", cutoff)
+        cursor.execute(
+            "DELETE FROM ONLY {} WHERE id IN (SELECT id FROM kubemetric_expired)".format(
+                _parent_table()
+            )
+        )
+
+    # the rollups and chunks of the removed months are removed too
+    MetricRollup.objects.filter(date__lt=cutoff).delete()
+    drop_chunks(cutoff)
+
+    return removed
+
+
+@job
+def maintain_metric_partitions():
+    """Background task creating future partitions and applying the retention
+    period, if partitioning is enabled"""
+    if not settings.METRICS_PARTITIONING:
+        return
+
+    for name in enable_partitioning():
+        logger.info("Created metric partition {}".format(name))
+
+    if settings.METRICS_RETENTION_MONTHS:
+        before = month_start(datetime.now(pytz.utc), -settings.METRICS_RETENTION_MONTHS)
+
+        for name in drop_partitions(before):
+            logger.info("Dropped metric partition {}".format(name))
@@ -0,0 +1,219 @@
+"""Rollups of metric series into fixed time buckets.
+
+The pod monitor records the cpu, memory and network usage of every worker
+every few seconds, forever. `settings.POD_METRICS_RETENTION` defines tiers of
+decreasing resolution, e.g. raw points for a day, then 1 minute rollups for
+30 days, then hourly rollups. The `downsample_pod_metrics` job moves data
+that is older than its tier allows into the next tier, in chunks, and
+deletes it from the finer one.
+
+Every point is thus stored in exactly one tier, and :func:`series_values`
+reads a series across all of them, using the finest data available for
+every part of the requested range.
+"""
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django_rq import job
+
+from api.models import KubeMetric, MetricChunk, MetricRollup, MetricSeries
+from api.utils.metric_archive import series_points
+from api.utils.metric_chunks import decode_chunk
+
+# Number of points or rollups moved to the next tier at once
+ROLLUP_CHUNK_SIZE = 5000
+
+# Maximum time a single `downsample_pod_metrics` job keeps downsampling
+DOWNSAMPLE_TIME_BUDGET = 120
+
+
+def _roll_points(series, resolution, cutoff):
+    """Moves the raw points (and chunks) older than `cutoff` into rollups"""
+    points = series.points.filter(date__lt=cutoff).order_by("date")
+
+    while True:
+        chunk = list(points.values_list("id", "date", "value")[:ROLLUP_CHUNK_SIZE])
+
+        if not chunk:
+            break
+
+        buckets = MetricRollup.aggregate(
+            (
+                (date, 1, value, value, value)
+                for _, date, value in chunk
+                if value is not None
+            ),
+            resolution,
+        )
+
+        with transaction.atomic():
+            MetricRollup.merge(series.id, resolution, buckets)
+            KubeMetric.objects.filter(id__in=[c[0] for c in chunk]).delete()
+            MetricSeries.objects.filter(id=series.id).update(
+                count=F("count") - len(chunk)
+            )
+
+    chunks = series.chunks.filter(end__lt=cutoff).order_by("start")
+
+    while True:
+        batch = list(chunks[: ROLLUP_CHUNK_SIZE // MetricChunk.SIZE])
+
+        if not batch:
+            break
+
+        points = [p for c in batch for p in decode_chunk(c, series)]
+        buckets = MetricRollup.aggregate(
+            ((p["date"], 1, p["value"], p["value"], p["value"]) for p in points),
+            resolution,
+        )
+
+        with transaction.atomic():
+            MetricRollup.merge(series.id, resolution, buckets)
+            MetricChunk.objects.filter(id__in=[c.id for c in batch]).delete()
+            MetricSeries.objects.filter(id=series.id).update(
+                count=F("count") - len(points)
+            )
+
+
+def _roll_rollups(series, resolution, target, cutoff):
+    """Moves the rollups of `resolution` older than `cutoff` into coarser
+    rollups of `target` resolution"""
+    rollups = series.rollups.filter(resolution=resolution, date__lt=cutoff).order_by(
+        "date"
+    )
+
+    while True:
+        chunk = list(
+            rollups.values_list("id", "date", "count", "sum", "min", "max")[
+                :ROLLUP_CHUNK_SIZE
+            ]
+        )
+
+        if not chunk:
+            break
+
+        buckets = MetricRollup.aggregate((c[1:] for c in chunk if c[2]), target)
+
+        with transaction.atomic():
+            MetricRollup.merge(series.id, target, buckets)
+            MetricRollup.objects.filter(id__in=[c[0] for c in chunk]).delete()
+
+
+def downsample_series(series, tiers, now):
+    """Enforces a retention policy on a series
+
+    Args:
+        series (:obj:`MetricSeries`): The series
+        tiers (list[tuple]): `(resolution, keep)` of each tier, from finest to
+            coarsest. `resolution` is in seconds (0 for raw points), `keep` is
+            the age in seconds up to which data stays in the tier (`None`
+            for forever)
+        now (:obj:`datetime`): Current time
+    """
+    for (resolution, keep), (target, _) in zip(tiers, tiers[1:]):
+        if keep is None:
+            return
+
+        cutoff = now - timedelta(seconds=keep)
+
+        if resolution == 0:
+            _roll_points(series, target, cutoff)
+        else:
+            _roll_rollups(series, resolution, target, cutoff)
+
+    resolution, keep = tiers[-1]
+
+    if keep is not None:
+        cutoff = now - timedelta(seconds=keep)
+
+        if resolution == 0:
+            deleted, _ = series.points.filter(date__lt=cutoff).delete()
+            MetricSeries.objects.filter(id=series.id).update(count=F("count") - deleted)
+        else:
+            series.rollups.filter(resolution=resolution, date__lt=cutoff).delete()
+
+
+def series_values(series, dates, filters, tiers, last_n=None):
+    """Reads the values of a series from all tiers
+
+    Rollups are only used for the part of the range older than the data of
+    all finer tiers. Rollups are returned like points dated at the start of
+    their bucket, with their mean (or maximum, for cumulative metrics) as value.
+
+    Args:
+        series (:obj:`MetricSeries`): The series
+        dates (dict): Lookups on the date of the values
+        filters (dict): Additional lookups on the raw points
+        tiers (list[tuple]): The retention tiers, see `downsample_series`
+        last_n (int): Only return the last `last_n` values
+
+    Returns:
+        (list[dict]): `date`, `value`, `text_value` and `cumulative` of each
+            value, ordered by date
+    """
+    values = series_points(
+        series,
+        {**dates, **filters},
+        ["date", "value", "text_value", "cumulative"],
+        last_n,
+    )
+    bound = values[0]["date"] if values else None
+
+    for resolution, _ in tiers:
+        if resolution == 0:
+            continue
+
+        if last_n and len(values) >= last_n:
+            break
+
+        rollups = series.rollups.filter(resolution=resolution, **dates)
+
+        if bound is not None:
+            rollups = rollups.filter(date__lt=bound)
+
+        if last_n:
+            rollups = reversed(rollups.order_by("-date")[: last_n - len(values)])
+        else:
+            rollups = rollups.order_by("date")
+
+        rollups = list(rollups)
+
+        if not rollups:
+            continue
+
+        values = [
+            {
+                "date": r.date,
+                "value": r.max if series.cumulative else r.mean,
+                "text_value": "",
+                "cumulative": series.cumulative,
+            }
+            for r in rollups
+        ] + values
+        bound = rollups[0].date
+
+    return values
+
+
+@job
+def downsample_pod_metrics():
+    """Background task enforcing `settings.POD_METRICS_RETENTION` on the
+    resource usage metrics of pods"""
+    tiers = settings.POD_METRICS_RETENTION
+
+    if not tiers:
+        return
+
+    now = timezone.now()
+    deadline = time.monotonic() + DOWNSAMPLE_TIME_BUDGET
+
+    for series in list(MetricSeries.objects.filter(pod__isnull=False)):
+        if time.monotonic() > deadline:
+            # the next run continues where this one stopped
+            break
+
+        downsample_series(series, tiers, now)
@@ -0,0 +1,183 @@
+"""Incrementally maintained summaries of run series.
+
+Summarizing a series averages its points in groups of equal size. Done from
+scratch, every poll of a live chart reads the whole series again although
+only its end changed. With the metric cache enabled (see
+:mod:`api.utils.metric_cache`), the groups of a series are kept in Redis
+along with a cursor (see :mod:`api.utils.metric_cursor`): the closed groups,
+and the sum and size of the last one still filling up. Later requests only
+read the points added since the cursor and add them to the groups.
+
+The size of the groups is a power of two, the smallest that gives at most
+`summarize` closed groups. Once there are more, neighbouring groups are
+merged, which only takes the groups. Like the other ways to summarize, this
+gives at most `summarize` values.
+
+Summaries are built again from all points if points older than the last
+summarized one are added, or if the oldest points of a series were removed.
+"""
+import json
+from datetime import timedelta
+
+from django.conf import settings
+
+from api.models import ModelRun
+from api.utils.metric_archive import read_points
+from api.utils.metric_cache import get_cached_many, set_cached_many
+from api.utils.metric_chunks import EPOCH
+from api.utils.metric_cursor import read_since, series_cursor, snapshot
+
+
+def _timestamp(date):
+    return None if date is None else (date - EPOCH) // timedelta(microseconds=1)
+
+
+def _params(series, summarize):
+    return {"summary": series.id, "summarize": summarize}
+
+
+def _new_summary(series):
+    return {
+        "first_date": _timestamp(series.first_date),
+        "factor": 1,
+        "last": None,
+        # [timestamp of the first point, sum, number of points]
+        "groups": [],
+    }
+
+
+def extend_summary(summary, points, summarize):
+    """Adds points to a summary, merging its groups once there are enough
+
+    Args:
+        summary (dict): The summary
+        points (list[dict]): The new points, with `date` and `value`, ordered
+            by date and not older than the points of the summary
+        summarize (int): Maximum number of values of the summary
+    """
+    groups = summary["groups"]
+    factor = summary["factor"]
+
+    for point in points:
+        if point["value"] is None:
+            continue
+
+        timestamp = _timestamp(point["date"])
+
+        if groups and groups[-1][2] < factor:
+            groups[-1][1] += point["value"]
+            groups[-1][2] += 1
+        else:
+            groups.append([timestamp, point["value"], 1])
+
+        summary["last"] = timestamp
+
+    count = sum(g[2] for g in groups)
+
+    # the closed groups are the values
+    while count // factor > summarize:
+        groups = [
+            [a[0], a[1] + b[1], a[2] + b[2]] if b else a
+            for a, b in zip(groups[::2], groups[1::2] + [None])
+        ]
+        factor *= 2
+
+    summary["groups"] = groups
+    summary["factor"] = factor
+
+
+def summary_values(summary, cumulative):
+    """The values of a summary, the means of its closed groups
+
+    Args:
+        summary (dict): The summary
+        cumulative (bool): If the series is cumulative
+
+    Returns:
+        (list[dict]): The values, as returned by the API
+    """
+    return [
+        {
+            "date": EPOCH + timedelta(microseconds=start),
+            "value": str(total / n),
+            "cumulative": cumulative,
+        }
+        for start, total, n in summary["groups"]
+        if n == summary["factor"]
+    ]
+
+
+def _is_stale(summary, series, points):
+    if _timestamp(series.first_date) != summary["first_date"]:
+        return True
+
+    return summary["last"] is not None and any(
+        _timestamp(p["date"]) < summary["last"] for p in points
+    )
+
+
+def cached_summaries(series, summarize):
+    """Summarizes the series of live runs from their cached summaries,
+    extended with the points added since
+
+    The summaries of all series are read and stored in one go, so the number
+    of Redis round trips doesn't depend on the number of series.
+
+    Args:
+        series (list[:obj:`MetricSeries`]): The series
+        summarize (int): Maximum number of values per series
+
+    Returns:
+        (dict): The values of each series of a live run (see
+            `summary_values`), by series id. Empty if the metric cache is
+            disabled
+    """
+    if not settings.METRICS_CACHE_SIZE:
+        return {}
+
+    # responses about ended runs are cached as a whole
+    live = set(
+        ModelRun.objects.filter(id__in={s.model_run_id for s in series})
+        .exclude(state__in=[ModelRun.FINISHED, ModelRun.FAILED])
+        .values_list("id", flat=True)
+    )
+    series = [s for s in series if s.model_run_id in live]
+    entries = get_cached_many([(s.model_run_id, _params(s, summarize)) for s in series])
+    cached = {
+        s.id: json.loads(entry["summary"].decode())
+        for s, entry in zip(series, entries)
+        if entry is not None
+    }
+
+    with snapshot():
+        points, cursors = read_since(
+            [s for s in series if s.id in cached],
+            {i: c["cursor"] for i, c in cached.items()},
+            ["date", "value"],
+        )
+        rebuilt = [
+            s
+            for s in series
+            if s.id not in cached or _is_stale(cached[s.id], s, points[s.id])
+        ]
+
+        if rebuilt:
+            cursors.update(series_cursor(rebuilt))
+            points.update(read_points(rebuilt, {}, ["date", "value"]))
+
+    result = {}
+    entries = []
+
+    for s in series:
+        summary = _new_summary(s) if s in rebuilt else cached[s.id]
+        extend_summary(summary, points[s.id], summarize)
+        summary["cursor"] = cursors[s.id]
+
+        entries.append(
+            (s.model_run_id, _params(s, summarize), {"summary": json.dumps(summary)})
+        )
+        result[s.id] = summary_values(summary, s.cumulative)
+
+    set_cached_many(entries)
+
+    return result
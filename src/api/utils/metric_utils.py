@@ -0,0 +1,371 @@
+from itertools import islice
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ParseError
+
+from api.models import KubeMetric, MetricArchive, MetricRollup, MetricSeries, ModelRun
+from api.utils.metric_archive import decode_points
+from api.utils.metric_chunks import append_points, is_chunkable
+
+REQUIRED_METRIC_FIELDS = ("run_id", "name", "date", "value")
+
+# Number of metrics inserted at once when ingesting a stream
+STREAM_CHUNK_SIZE = 1000
+
+# Maximum number of per-item errors reported back for a stream
+MAX_REPORTED_ERRORS = 100
+
+# Ranges of the integer columns on postgres, which sqlite doesn't enforce
+INTEGER_FIELD_RANGES = {
+    "IntegerField": (-(2 ** 31), 2 ** 31 - 1),
+    "BigIntegerField": (-(2 ** 63), 2 ** 63 - 1),
+}
+
+
+def _parse_run_id(run_id):
+    try:
+        return int(run_id)
+    except (TypeError, ValueError):
+        return None
+
+
+def _clean_field(name, value):
+    """Converts a posted value of a metric field and checks that it fits the
+    column, e.g. that an integer isn't out of range
+
+    Args:
+        name (str): The name of the `KubeMetric` field
+        value: The posted value
+
+    Returns:
+        The value converted for the field
+
+    Raises:
+        ValueError: If the value is invalid for the field
+    """
+    field = KubeMetric._meta.get_field(name)
+
+    error = ValueError("Invalid {} {}".format(name, value))
+
+    try:
+        cleaned = field.to_python(value)
+    except ValidationError:
+        raise error
+
+    low, high = INTEGER_FIELD_RANGES.get(field.get_internal_type(), (None, None))
+
+    if cleaned is not None and low is not None and not low <= cleaned <= high:
+        raise error
+
+    return cleaned
+
+
+def resolve_runs(items, known=()):
+    """Fetches all runs referenced by a batch of metrics with a single query
+
+    Args:
+        items (list[dict]): The posted metrics
+        known (iterable[int]): Run ids that were already resolved and can be skipped
+
+    Returns:
+        (dict): Mapping of run id to :obj:`ModelRun`
+    """
+    run_ids = {_parse_run_id(d.get("run_id")) for d in items if isinstance(d, dict)}
+    run_ids.discard(None)
+    run_ids.difference_update(known)
+
+    if not run_ids:
+        return {}
+
+    return ModelRun.objects.in_bulk(list(run_ids))
+
+
+def build_metric(d, runs):
+    """Validates a single posted metric and builds the corresponding (unsaved)
+    `KubeMetric`
+
+    Args:
+        d (dict): The posted metric
+        runs (dict): Mapping of run id to :obj:`ModelRun`, see `resolve_runs`
+
+    Returns:
+        (:obj:`KubeMetric`): The metric, ready to be inserted
+
+    Raises:
+        ValueError: If the metric is invalid or its run doesn't exist
+    """
+    if isinstance(d, ParseError):
+        # Lines of a stream that couldn't be parsed are passed on as is
+        raise ValueError(d.detail)
+
+    if not isinstance(d, dict):
+        raise ValueError("Metric has to be a JSON object")
+
+    missing = [f for f in REQUIRED_METRIC_FIELDS if f not in d]
+    if missing:
+        raise ValueError("Missing field(s): {}".format(", ".join(missing)))
+
+    run = runs.get(_parse_run_id(d["run_id"]))
+    if run is None:
+        raise ValueError("Run not found")
+
+    name = str(d["name"])
+    if len(name) > KubeMetric._meta.get_field("name").max_length:
+        raise ValueError("Metric name too long")
+
+    try:
+        date = parse_datetime(str(d["date"]))
+    except ValueError:
+        date = None
+
+    if date is None:
+        raise ValueError("Invalid date {}".format(d["date"]))
+
+    metadata = d.get("metadata") or None
+
+    rank = _clean_field("rank", d.get("rank"))
+    seq = _clean_field("seq", d.get("seq"))
+
+    if rank is None:
+        rank = _clean_field("rank", KubeMetric.metadata_int(metadata, "rank"))
+
+    if seq is not None and rank is None:
+        rank = 0
+
+    value, text_value = KubeMetric.split_value(d["value"])
+
+    return KubeMetric(
+        name=name,
+        date=date,
+        value=value,
+        text_value=text_value,
+        metadata=metadata,
+        cumulative=_clean_field("cumulative", d.get("cumulative", False)),
+        model_run=run,
+        epoch=_clean_field("epoch", KubeMetric.metadata_int(metadata, "epoch")),
+        rank=rank,
+        seq=seq,
+    )
+
+
+def _idempotency_key(metric):
+    if metric.seq is None:
+        return None
+
+    return metric.model_run_id, metric.rank, metric.seq
+
+
+def _fetch_series(keys):
+    run_ids = {k[0] for k in keys if k[0] is not None}
+    pod_ids = {k[1] for k in keys if k[1] is not None}
+
+    series = MetricSeries.objects.filter(
+        Q(model_run_id__in=run_ids) | Q(pod_id__in=pod_ids),
+        name__in={k[2] for k in keys},
+    )
+
+    return {s.key: s for s in series if s.key in keys}
+
+
+def assign_series(metrics):
+    """Sets the series of metrics, creating the missing series
+
+    Args:
+        metrics (list[:obj:`KubeMetric`]): Unsaved metrics
+    """
+    keys = {(m.model_run_id, m.pod_id, m.name): m for m in metrics}
+    series = _fetch_series(keys)
+
+    missing = [
+        MetricSeries(
+            model_run_id=run_id, pod_id=pod_id, name=name, cumulative=m.cumulative
+        )
+        for (run_id, pod_id, name), m in keys.items()
+        if (run_id, pod_id, name) not in series
+    ]
+
+    if missing:
+        # bulk_create doesn't return ids with ignore_conflicts, fetch them
+        MetricSeries.objects.bulk_create(missing, ignore_conflicts=True)
+        series.update(_fetch_series({s.key for s in missing}))
+
+    for metric in metrics:
+        metric.series = series[(metric.model_run_id, metric.pod_id, metric.name)]
+
+
+def _existing_keys(keys):
+    """The idempotency keys already stored, in the metric table or in the
+    archives of their runs. Chunks only hold metrics without keys"""
+    run_ids = {k[0] for k in keys}
+    seqs = {k[2] for k in keys}
+    existing = set(
+        KubeMetric.objects.filter(model_run_id__in=run_ids, seq__in=seqs).values_list(
+            "model_run_id", "rank", "seq"
+        )
+    )
+
+    for run_id, data in MetricArchive.objects.filter(
+        series__model_run_id__in=run_ids
+    ).values_list("series__model_run_id", "data"):
+        points = decode_points(
+            data, {"seq__gte": min(seqs), "seq__lte": max(seqs)}, ["rank", "seq"]
+        )
+        existing.update((run_id, p["rank"], p["seq"]) for p in points)
+
+    return existing & set(keys)
+
+
+def insert_metrics(metrics):
+    """Inserts metrics, skipping those whose idempotency key is already stored
+
+    Duplicates within the batch are dropped. The runs of metrics with a key
+    are locked before looking for their keys in the metric table and the
+    archives, so concurrent retries of a request don't both insert them. The
+    series of the metrics are created if needed and their statistics and
+    rollups updated with the inserted metrics. With
+    `settings.METRICS_CHUNK_STORAGE`, numeric metrics are appended to the
+    chunks of their series instead, see :mod:`api.utils.metric_chunks`.
+
+    The series are locked first, so the ids of the rows of a series are
+    committed in increasing order, see :mod:`api.utils.metric_cursor`.
+
+    Args:
+        metrics (list[:obj:`KubeMetric`]): Unsaved metrics
+
+    Returns:
+        (list[:obj:`KubeMetric`]): The metrics that were actually inserted
+    """
+    keyed = {}
+    new_metrics = []
+
+    for metric in metrics:
+        key = _idempotency_key(metric)
+
+        if key is None:
+            new_metrics.append(metric)
+        elif key not in keyed:
+            keyed[key] = metric
+
+    assign_series(new_metrics + list(keyed.values()))
+
+    with transaction.atomic():
+        # in id order, runs before series, so concurrent inserts don't deadlock
+        list(
+            ModelRun.objects.select_for_update()
+            .filter(id__in={k[0] for k in keyed})
+            .order_by("id")
+            .values_list("id", flat=True)
+        )
+
+        for key in _existing_keys(keyed) if keyed else ():
+            del keyed[key]
+
+        new_metrics += keyed.values()
+        list(
+            MetricSeries.objects.select_for_update()
+            .filter(id__in={m.series_id for m in new_metrics})
+            .order_by("id")
+            .values_list("id", flat=True)
+        )
+        rows = new_metrics
+
+        if settings.METRICS_CHUNK_STORAGE:
+            rows = [m for m in new_metrics if not is_chunkable(m)]
+            rows += append_points([m for m in new_metrics if is_chunkable(m)])
+
+        # the partition trigger inserts rows itself and returns none to
+        # RETURNING, which `ignore_conflicts` doesn't use. Keys were checked
+        # under the lock of their run, so no row is ignored
+        KubeMetric.objects.bulk_create(
+            rows, ignore_conflicts=settings.METRICS_PARTITIONING
+        )
+        MetricSeries.record_points(new_metrics)
+        MetricRollup.record_points(new_metrics)
+
+    return new_metrics
+
+
+def create_metrics(items, runs=None, offset=0):
+    """Validates a batch of metrics and inserts all valid ones at once
+
+    Runs are resolved once per distinct `run_id` and all metrics are
+    inserted with a single `bulk_create` inside a transaction. Invalid
+    metrics are skipped and reported, they don't fail the whole batch.
+
+    Metrics can carry an idempotency key (`rank` and `seq`, unique per run).
+    Metrics whose key is already stored, e.g. because a worker retried a
+    request that timed out, are accepted without inserting them again.
+
+    Args:
+        items (list[dict]): The posted metrics
+        runs (dict | None): Already resolved runs, updated with the runs of
+            this batch. Default `None`
+        offset (int): Index of the first item, used in error reports. Default 0
+
+    Returns:
+        (tuple[list, list]): The accepted metrics and a list of errors, each
+            containing the `index` of the faulty item and a `message`
+    """
+    if runs is None:
+        runs = {}
+    runs.update(resolve_runs(items, known=runs))
+
+    metrics = []
+    errors = []
+
+    for i, d in enumerate(items, offset):
+        try:
+            metrics.append(build_metric(d, runs))
+        except ValueError as e:
+            errors.append({"index": i, "message": str(e)})
+
+    if metrics:
+        insert_metrics(metrics)
+
+    return metrics, errors
+
+
+def stream_metrics(items, chunk_size=None, ingest=create_metrics):
+    """Inserts metrics from a (lazy) iterable in fixed-size chunks
+
+    Only one chunk is held in memory at a time, so arbitrarily large uploads
+    can be ingested. Each chunk is inserted in its own transaction.
+
+    Args:
+        items (iterable[dict]): The metrics, e.g. as parsed by `NDJSONParser`
+        chunk_size (int | None): Number of metrics per chunk. Default
+            `STREAM_CHUNK_SIZE`
+        ingest (callable): Function handling each chunk, with the interface
+            of `create_metrics`. Default `create_metrics`
+
+    Returns:
+        (tuple[int, int, list]): Number of ingested metrics, number of invalid
+            metrics and the first `MAX_REPORTED_ERRORS` errors
+    """
+    chunk_size = chunk_size or STREAM_CHUNK_SIZE
+    items = iter(items)
+    runs = {}
+
+    created = 0
+    failed = 0
+    errors = []
+    offset = 0
+
+    while True:
+        chunk = list(islice(items, chunk_size))
+
+        if not chunk:
+            break
+
+        metrics, chunk_errors = ingest(chunk, runs=runs, offset=offset)
+
+        created += len(metrics)
+        failed += len(chunk_errors)
+        errors += chunk_errors[: MAX_REPORTED_ERRORS - len(errors)]
+        offset += len(chunk)
+
+    return created, failed, errors
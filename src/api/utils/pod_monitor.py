@@ -6,7 +6,6 @@ from datetime import datetime
 
 import pytz
 from django.db import transaction
-from django.db.models import Max
 from django_rq import job
 from kubernetes import client, config
 from kubernetes.client.rest import ApiException
@@ -14,6 +13,7 @@ from pid import PidFile, PidFileError
 
 from api.models.kubemetric import KubeMetric
 from api.models.kubepod import KubePod
+from api.utils.metric_utils import insert_metrics
 
 
 def _check_and_create_new_pods():
@@ -109,9 +109,10 @@ def check_pod_status():
 
 
 def _update_pod_metric(pod, cont_data, metric_name, value_name, value_denom):
-    newest_time = pod.metrics.filter(name=metric_name).aggregate(Max("date"))[
-        "date__max"
-    ]
+    # the series knows its last date, wherever its points are stored
+    newest_time = (
+        pod.series.filter(name=metric_name).values_list("last_date", flat=True).first()
+    )
 
     new_time = datetime.strptime(cont_data[metric_name]["time"], "%Y-%m-%dT%H:%M:%SZ")
     new_time = pytz.utc.localize(new_time)
@@ -123,13 +124,12 @@ def _update_pod_metric(pod, cont_data, metric_name, value_name, value_denom):
     ):
         metric = KubeMetric(
             name=metric_name,
-            date=cont_data[metric_name]["time"],
+            date=new_time,
             value=cont_data[metric_name][value_name] / value_denom,
-            metadata="",
             cumulative=False,
             pod=pod,
         )
-        metric.save()
+        insert_metrics([metric])
 
 
 @job
@@ -188,9 +188,11 @@ def check_pod_metrics():
                     value_denom=1024 * 1024,
                 )
 
-                newest_network_time = current_pod.metrics.filter(
-                    name="network_in"
-                ).aggregate(Max("date"))["date__max"]
+                newest_network_time = (
+                    current_pod.series.filter(name="network_in")
+                    .values_list("last_date", flat=True)
+                    .first()
+                )
 
                 new_time = datetime.strptime(
                     pod["network"]["time"], "%Y-%m-%dT%H:%M:%SZ"
@@ -202,24 +204,23 @@ def check_pod_metrics():
                     and "network" in pod
                     and "rxBytes" in pod["network"]
                 ):
-                    metric = KubeMetric(
-                        name="network_in",
-                        date=pod["network"]["time"],
-                        value=pod["network"]["rxBytes"] / (1024 * 1024),
-                        metadata="",
-                        cumulative=True,
-                        pod=current_pod,
-                    )
-                    metric.save()
-
-                    metric = KubeMetric(
-                        name="network_out",
-                        date=pod["network"]["time"],
-                        value=pod["network"]["txBytes"] / (1024 * 1024),
-                        metadata="",
-                        cumulative=True,
-                        pod=current_pod,
+                    insert_metrics(
+                        [
+                            KubeMetric(
+                                name="network_in",
+                                date=new_time,
+                                value=pod["network"]["rxBytes"] / (1024 * 1024),
+                                cumulative=True,
+                                pod=current_pod,
+                            ),
+                            KubeMetric(
+                                name="network_out",
+                                date=new_time,
+                                value=pod["network"]["txBytes"] / (1024 * 1024),
+                                cumulative=True,
+                                pod=current_pod,
+                            ),
+                        ]
                     )
-                    metric.save()
     except PidFileError:
         return
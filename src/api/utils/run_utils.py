@@ -6,6 +6,7 @@ from time import sleep
 import django_rq
 import kubernetes.stream as stream
 import websocket
+from django.conf import settings
 from django.utils import timezone
 from kubernetes import client, config
 from rq import get_current_job
@@ -528,3 +529,7 @@ def run_model_job(model_run):
         if set_name:
             delete_statefulset(set_name, ns)
             delete_service(set_name, ns)
+
+    if settings.METRICS_CACHE_SIZE:
+        # by path, the views import this module
+        django_rq.enqueue("api.views.warm_metric_cache", model_run.id)
@@ -1,8 +1,16 @@
+import operator
 import os
 import re
 
 _filename_ascii_strip_re = re.compile(r"[^A-Za-z0-9_.-]")
 _kubernetes_run_name_re = re.compile("[a-z0-9]([-a-z0-9]*[a-z0-9])?")
+_lookup_operators = {
+    "": operator.eq,
+    "gt": operator.gt,
+    "gte": operator.ge,
+    "lt": operator.lt,
+    "lte": operator.le,
+}
 _windows_device_files = (
     "CON",
     "AUX",
@@ -77,3 +85,41 @@ def is_valid_run_name(name):
     match_length = match.end() - match.start()
 
     return match_length == len(name)
+
+
+def lookup_test(lookup, expected):
+    """Parses a single lookup of `matches_lookups`
+
+    Args:
+        lookup (str): The lookup, e.g. `date__gte`
+        expected: The value it compares to
+
+    Returns:
+        (tuple): The field and a function checking a value of it
+    """
+    field, _, lookup_type = lookup.partition("__")
+    compare = _lookup_operators[lookup_type]
+
+    return field, lambda value: value is not None and compare(value, expected)
+
+
+def matches_lookups(values, lookups):
+    """Checks if a dict matches Django-style field lookups, for data that
+    isn't stored as rows (e.g. archived metrics)
+
+    Args:
+        values (dict): Field values
+        lookups (dict): Lookups like `{"date__gte": since, "rank": 0}`. Only
+            exact, `gt(e)` and `lt(e)` lookups are supported. A field value of
+            `None` never matches
+
+    Returns:
+        (bool): If all lookups match
+    """
+    for lookup, expected in lookups.items():
+        field, test = lookup_test(lookup, expected)
+
+        if not test(values[field]):
+            return False
+
+    return True
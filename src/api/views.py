@@ -1,28 +1,596 @@
+import hashlib
 import io
 import json
 import logging
+import operator
 import os
 import zipfile
 from datetime import datetime
+from functools import reduce
 from itertools import groupby
 from math import ceil
 
 import django_rq
+import numpy as np
 import pytz
 from django.conf import settings
-from django.core.exceptions import ObjectDoesNotExist
 from django.core.serializers.json import DjangoJSONEncoder
-from django.db.models import Q
-from django.utils.dateparse import parse_datetime
+from django.db import connection
+from django.db.models import Count, Exists, F, OuterRef, Q, Window
+from django.db.models.functions import RowNumber
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
 from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.viewsets import ViewSet
 from rq.job import Job
 
-from api.models import KubeMetric, KubePod, ModelRun
+from api.models import (
+    KubeMetric,
+    KubePod,
+    MetricChunk,
+    MetricRollup,
+    MetricSeries,
+    ModelRun,
+)
+from api.parsers import NDJSONParser
 from api.serializers import KubeMetricsSerializer, KubePodSerializer, ModelRunSerializer
+from api.utils.downsampling import lttb, m4, resample
+from api.utils.metric_aggregates import (
+    FUNCTIONS,
+    aggregate_series,
+    parse_bucket,
+    series_stats,
+)
+from api.utils.metric_archive import (
+    archived_metrics,
+    get_archive,
+    read_points,
+    series_points,
+)
+from api.utils.metric_buffer import buffer_metrics, buffer_status
+from api.utils.metric_cache import get_cached, set_cached
+from api.utils.metric_chunks import chunked_metrics
+from api.utils.metric_cursor import (
+    decode_cursor,
+    encode_cursor,
+    read_since,
+    series_cursor,
+    snapshot,
+)
+from api.utils.metric_rollups import series_values
+from api.utils.metric_summaries import cached_summaries
+from api.utils.metric_utils import create_metrics, resolve_runs, stream_metrics
 from api.utils.run_utils import delete_service, delete_statefulset, run_model_job
-from api.utils.utils import is_valid_run_name, secure_filename
+from api.utils.utils import is_valid_run_name, matches_lookups, secure_filename
+
+VALUE_FIELDS = ["date", "value", "text_value", "cumulative"]
+
+# response header holding the cursor of polled metrics
+CURSOR_HEADER = "X-Metrics-Cursor"
+
+# the queries of the page of a run (main/templates/main/run_detail.html),
+# cached once it has ended
+WARM_METRIC_QUERIES = [
+    {"cursor": "", "metric_type": "run", "summarize": "1000", "downsample": "lttb"}
+]
+
+# maximum number of grid positions of a comparison of runs
+MAX_COMPARE_POINTS = 10000
+
+
+def _format_metric(metric):
+    """Formats a metric row from `.values()` for the API, which always returned
+    values as strings"""
+    text_value = metric.pop("text_value")
+    metric["value"] = text_value if metric["value"] is None else str(metric["value"])
+
+    return metric
+
+
+def _etag(*validators):
+    """A strong ETag of some cheap validators of a response, e.g. the state of
+    a run, instead of a hash of the response itself"""
+    return quote_etag(hashlib.md5(repr(validators).encode()).hexdigest())
+
+
+def _not_modified(request, etag, last_modified=None):
+    """Answers a conditional GET without building the response
+
+    Arguments:
+        request {[Django request]} -- The request object
+        etag {str} -- The current ETag of the response
+        last_modified {datetime} -- When the response last changed, or None
+
+    Returns:
+        Response -- A 304 response if the client's copy is current, or None
+    """
+    response = get_conditional_response(
+        request,
+        etag=etag,
+        last_modified=last_modified and int(last_modified.timestamp()),
+    )
+
+    if response is not None:
+        _cache_headers(response, etag, last_modified)
+
+    return response
+
+
+def _cache_headers(response, etag, last_modified=None):
+    """Sets the validators and caching policy of a response, see `_not_modified`
+
+    Even responses about ended runs are revalidated, as late metrics, the
+    retention period and archival still change them.
+
+    Returns:
+        Response -- The response
+    """
+    response["ETag"] = etag
+
+    if last_modified is not None:
+        response["Last-Modified"] = http_date(last_modified.timestamp())
+
+    # cached, but revalidated every time
+    response["Cache-Control"] = "no-cache"
+
+    return response
+
+
+def _read_series(series, dates, filters, summarize, last_n, downsample="mean"):
+    """Gets the values of several series ordered by date, summarized if requested
+
+    Run series are read with a constant number of queries however many there
+    are: their points in a single query ordered by series and date, and their
+    summaries from the cached summaries (see `api.utils.metric_summaries`), the
+    rollups or a window function query.
+
+    Arguments:
+        series {iterable} -- The series, annotated with `chunked`
+        dates {dict} -- Lookups on the dates of the values
+        filters {dict} -- Additional lookups on the points
+        summarize {int} -- Maximum number of values per series, or None
+        last_n {int} -- Only return the last `last_n` values of each series, or
+            None. Unless summarizing, only those are read
+        downsample {str} -- How to summarize, one of `DOWNSAMPLE_MODES`
+
+    Returns:
+        dict -- The values (as dicts) of each series, by series id
+    """
+    result = {}
+    runs_series = []
+
+    for s in series:
+        if s.pod_id is None:
+            runs_series.append(s)
+            continue
+
+        # resource usage of pods is downsampled as it ages
+        values = series_values(
+            s,
+            dates,
+            filters,
+            settings.POD_METRICS_RETENTION,
+            None if summarize else last_n,
+        )
+
+        if summarize and len(values) > summarize:
+            result[s.id] = DOWNSAMPLE_MODES[downsample](values, len(values), summarize)
+        else:
+            result[s.id] = [_format_metric(v) for v in values]
+
+    lookups = {**dates, **filters}
+    # points outside of the metric table are merged in python
+    stored = [
+        s
+        for s in runs_series
+        if get_archive(s) is not None or getattr(s, "chunked", True)
+    ]
+    points = {}
+
+    if summarize and lookups:
+        # the series only know their total size
+        counts = dict(
+            KubeMetric.objects.filter(
+                series__in=[s for s in runs_series if s not in stored], **lookups
+            )
+            .values_list("series_id")
+            .annotate(n=Count("id"))
+            .order_by()
+        )
+        points = read_points(stored, lookups, VALUE_FIELDS)
+        counts.update({i: len(p) for i, p in points.items()})
+    else:
+        counts = {s.id: s.count for s in runs_series}
+
+    summarized = [
+        s for s in runs_series if summarize and counts.get(s.id, 0) > summarize
+    ]
+    points.update(
+        read_points(
+            [s for s in runs_series if s not in summarized and s.id not in points],
+            lookups,
+            VALUE_FIELDS,
+            last_n,
+        )
+    )
+
+    for s in runs_series:
+        if s not in summarized:
+            result[s.id] = [_format_metric(v) for v in points[s.id]]
+
+    summaries = {}
+
+    if downsample == "mean" and not lookups:
+        # live charts, only the points added since the last request are read
+        summaries = cached_summaries(summarized, summarize)
+        summarized = [s for s in summarized if s.id not in summaries]
+
+    if downsample == "mean" and not filters:
+        summaries.update(_rollup_summaries(summarized, dates, summarize))
+        summarized = [s for s in summarized if s.id not in summaries]
+
+    if downsample == "mean" and connection.features.supports_over_clause:
+        summaries.update(
+            _summarize_query(
+                [s for s in summarized if s not in stored], lookups, summarize
+            )
+        )
+
+    points.update(
+        read_points(
+            [s for s in summarized if s.id not in summaries and s.id not in points],
+            lookups,
+            VALUE_FIELDS,
+        )
+    )
+
+    for s in summarized:
+        if s.id not in summaries:
+            summaries[s.id] = DOWNSAMPLE_MODES[downsample](
+                points[s.id], counts[s.id], summarize
+            )
+
+    result.update(summaries)
+
+    if last_n:
+        result = {i: values[-last_n:] for i, values in result.items()}
+
+    return result
+
+
+def _read_new_series(series, state, lookups, summarize, last_n, downsample="mean"):
+    """Gets the values of several series added since a cursor, like `_read_series`
+
+    Arguments:
+        series {list} -- The series
+        state {dict} -- The state of the cursor, see `api.utils.metric_cursor`
+        lookups {dict} -- Lookups on the points
+        summarize {int} -- Maximum number of values per series, or None
+        last_n {int} -- Only return the last `last_n` values of each series, or
+            None
+        downsample {str} -- How to summarize, one of `DOWNSAMPLE_MODES`
+
+    Returns:
+        tuple -- The values (as dicts) of each series by series id, and the
+            new state of the cursor
+    """
+    fields = VALUE_FIELDS + [f.partition("__")[0] for f in lookups]
+    points, state = read_since(series, state, list(dict.fromkeys(fields)))
+    result = {}
+
+    for series_id, values in points.items():
+        values = [
+            {f: v[f] for f in VALUE_FIELDS}
+            for v in values
+            if matches_lookups(v, lookups)
+        ]
+
+        if summarize and len(values) > summarize:
+            values = DOWNSAMPLE_MODES[downsample](values, len(values), summarize)
+        else:
+            values = [_format_metric(v) for v in values]
+
+        result[series_id] = values[-last_n:] if last_n else values
+
+    return result, state
+
+
+def _summarize_points(metrics, metric_count, summarize):
+    """Averages the values of a series in groups of equal size
+
+    Arguments:
+        metrics {iterable} -- The values (as dicts) ordered by date
+        metric_count {int} -- Their number
+        summarize {int} -- Maximum number of values to return
+
+    Returns:
+        list -- The averaged values
+    """
+    factor = ceil(metric_count / summarize)
+
+    new_metrics = []
+    temp_metric = None
+
+    count = 0
+
+    for metric in metrics:
+        if not temp_metric:
+            temp_metric = {
+                "date": metric["date"],
+                "value": 0.0,
+                "cumulative": metric["cumulative"],
+            }
+        temp_metric["value"] += metric["value"]
+        count += 1
+
+        if count % factor == 0:
+            temp_metric["value"] = str(temp_metric["value"] / factor)
+            new_metrics.append(temp_metric)
+            temp_metric = None
+
+    return new_metrics
+
+
+def _select_points(metrics, select, summarize):
+    """Summarizes a series by keeping some of its points
+
+    Arguments:
+        metrics {iterable} -- The values (as dicts) ordered by date
+        select {function} -- Selects the indices of points from their dates
+            and values, see `api.utils.downsampling`
+        summarize {int} -- Number of values (or buckets) to select
+
+    Returns:
+        list -- The selected values
+    """
+    metrics = [m for m in metrics if m["value"] is not None]
+    x = np.fromiter((m["date"].timestamp() for m in metrics), float, len(metrics))
+    y = np.fromiter((m["value"] for m in metrics), float, len(metrics))
+
+    return [_format_metric(metrics[i]) for i in select(x, y, summarize)]
+
+
+def _lttb_points(metrics, metric_count, summarize):
+    """Selects `summarize` points of a series with Largest-Triangle-Three-Buckets,
+    which keeps its spikes and jumps"""
+    return _select_points(metrics, lttb, summarize)
+
+
+def _m4_points(metrics, metric_count, summarize):
+    """Selects the first, last, minimum and maximum points of a series in
+    `summarize` buckets of equal duration, the envelope of its chart"""
+    return _select_points(metrics, m4, summarize)
+
+
+# how `summarize` reduces the points of a series
+DOWNSAMPLE_MODES = {
+    "mean": _summarize_points,
+    "lttb": _lttb_points,
+    "m4": _m4_points,
+}
+
+
+def _summarize_query(series, lookups, summarize):
+    """Averages the values of run series in groups of equal size in the database
+
+    Numbers the points of each series by date with a window function and
+    groups them by position, so only the averaged values are transferred.
+    Like `_summarize_points`, a last incomplete group is dropped.
+
+    Arguments:
+        series {list} -- The series, with all their points in the metric table
+        lookups {dict} -- Filters on the points
+        summarize {int} -- Maximum number of values per series
+
+    Returns:
+        dict -- The averaged values of each series, by series id
+    """
+    if not series:
+        return {}
+
+    by_id = {s.id: s for s in series}
+    points = (
+        KubeMetric.objects.filter(series_id__in=by_id, **lookups)
+        .annotate(
+            position=Window(
+                RowNumber(), partition_by=[F("series_id")], order_by=F("date").asc()
+            ),
+            total=Window(Count("id"), partition_by=[F("series_id")]),
+        )
+        .values("id", "series_id", "date", "value", "position", "total")
+    )
+    sql, params = points.query.sql_with_params()
+    # same as ceil(total / summarize)
+    factor = '(("total" + %s - 1) / %s)'
+
+    # a raw queryset converts the dates, which SQLite returns as text
+    groups = KubeMetric.objects.raw(
+        'SELECT MIN("id") AS "id", "series_id", MIN("date") AS "date", '
+        'AVG("value") AS "value" FROM (' + sql + ') AS "points" '
+        'GROUP BY "series_id", "total", ("position" - 1) / ' + factor + " "
+        "HAVING COUNT(*) = " + factor + ' ORDER BY "series_id", MIN("date")',
+        params + (summarize,) * 4,
+    )
+    summaries = {}
+
+    for g in groups:
+        summaries.setdefault(g.series_id, []).append(
+            {
+                "date": g.date,
+                "value": str(g.value),
+                "cumulative": by_id[g.series_id].cumulative,
+            }
+        )
+
+    return summaries
+
+
+def _rollup_summaries(series, dates, summarize):
+    """Summarizes run series from their rollups instead of their points
+
+    Averages neighbouring rollups in groups of equal size so no more than
+    `summarize` values are returned, and drops a last incomplete group, like
+    `_summarize_points`. Of the resolutions with at least `summarize`
+    rollups, the coarsest one giving the most values is read.
+
+    Arguments:
+        series {list} -- The series
+        dates {dict} -- Lookups on the dates of the values
+        summarize {int} -- Maximum number of values per series
+
+    Returns:
+        dict -- The averaged values by series id, for the series with
+            enough rollups
+    """
+    by_id = {s.id: s for s in series}
+    rollups = MetricRollup.objects.filter(series_id__in=by_id, **dates)
+    counts = {
+        (series_id, resolution): n
+        for series_id, resolution, n in rollups.values_list("series_id", "resolution")
+        .annotate(n=Count("id"))
+        .order_by()
+    }
+    resolutions = {}
+
+    def values(count):
+        return count // ceil(count / summarize)
+
+    for series_id in by_id:
+        usable = [
+            r
+            for r in MetricRollup.INGEST_RESOLUTIONS
+            if counts.get((series_id, r), 0) >= summarize
+        ]
+
+        if usable:
+            resolutions[series_id] = max(
+                usable, key=lambda r: (values(counts[series_id, r]), r)
+            )
+
+    if not resolutions:
+        return {}
+
+    buckets = (
+        rollups.filter(
+            reduce(
+                operator.or_,
+                (Q(series_id=i, resolution=r) for i, r in resolutions.items()),
+            )
+        )
+        .order_by("series_id", "date")
+        .values_list("series_id", "date", "count", "sum")
+    )
+    summaries = {}
+
+    for series_id, series_buckets in groupby(buckets, key=lambda b: b[0]):
+        series_buckets = list(series_buckets)
+        factor = ceil(counts[series_id, resolutions[series_id]] / summarize)
+        summary = []
+
+        for i in range(0, len(series_buckets) - factor + 1, factor):
+            group = series_buckets[i : i + factor]
+            count = sum(b[2] for b in group)
+
+            if count:
+                summary.append(
+                    {
+                        "date": group[0][1],
+                        "value": str(sum(b[3] for b in group) / count),
+                        "cumulative": by_id[series_id].cumulative,
+                    }
+                )
+
+        summaries[series_id] = summary
+
+    return summaries
+
+
+def _annotate_series(series):
+    """Annotates series with `chunked` as `_read_series` expects"""
+    # archives are only loaded when read
+    return (
+        series.select_related("archive")
+        .defer("archive__data")
+        .annotate(chunked=Exists(MetricChunk.objects.filter(series=OuterRef("pk"))))
+    )
+
+
+def _run_series(run):
+    """The series of a run, see `_annotate_series`"""
+    return _annotate_series(run.series.all())
+
+
+def _series_versions(series):
+    """The size and last point of some series, which change with every stored
+    or deleted point"""
+    return list(
+        series.order_by("id").values_list("id", "count", "last_date", "last_value")
+    )
+
+
+def _cache_params(params, versions):
+    """What the cached response to a query about a run depends on, see
+    `api.utils.metric_cache`"""
+    return {"query": sorted(params.items()), "series": versions}
+
+
+def _read_polled(series, state, dates, filters, summarize, last_n, downsample):
+    """Gets the values of several series for a client polling with a cursor
+
+    Arguments:
+        series {list} -- The series
+        state {dict} -- The state of the client's cursor, or None to get all
+            values and a first cursor. See `api.utils.metric_cursor`
+        dates {dict} -- Lookups on the dates of the values
+        filters {dict} -- Additional lookups on the points
+        summarize {int} -- Maximum number of values per series, or None
+        last_n {int} -- Only return the last `last_n` values of each series, or
+            None
+        downsample {str} -- How to summarize, one of `DOWNSAMPLE_MODES`
+
+    Returns:
+        tuple -- The values (as dicts) of the series with values by name, and
+            the new state of the cursor
+    """
+    with snapshot():
+        if state is None:
+            state = series_cursor(series)
+            values = _read_series(series, dates, filters, summarize, last_n, downsample)
+        else:
+            values, state = _read_new_series(
+                series, state, {**dates, **filters}, summarize, last_n, downsample
+            )
+
+    return {s.name: values[s.id] for s in series if values[s.id]}, state
+
+
+def warm_metric_cache(run_id):
+    """Caches the responses to the queries of the page of an ended run, see
+    `api.utils.metric_cache`
+
+    Enqueued by `api.utils.run_utils.run_model_job` once the run has ended.
+
+    Arguments:
+        run_id {int} -- The run
+    """
+    series = _run_series(ModelRun.objects.get(pk=run_id))
+    versions = _series_versions(series)
+    series = list(series)
+
+    for params in WARM_METRIC_QUERIES:
+        result, state = _read_polled(
+            series, None, {}, {}, int(params["summarize"]), None, params["downsample"]
+        )
+        set_cached(
+            run_id,
+            _cache_params(params, versions),
+            {"body": JSONRenderer().render(result), "cursor": encode_cursor(state)},
+        )
 
 
 class KubePodView(ViewSet):
@@ -40,112 +608,114 @@ class KubePodView(ViewSet):
 class KubeMetricsView(ViewSet):
     """Handles the /api/metrics endpoint"""
 
-    def __format_result(self, metrics, q, summarize, last_n):
-        # get available kind of metrics
-        names = metrics.values("name").distinct()
+    parser_classes = list(api_settings.DEFAULT_PARSER_CLASSES) + [NDJSONParser]
 
-        result = {}
+    def __lookups(self):
+        """Parses the `since`, `epoch` and `rank` query parameters
 
-        for name in names:
-            name = name["name"]
-            temp_filter = q & Q(name=name)
-            filtered_metrics = (
-                metrics.filter(temp_filter)
-                .order_by("date")
-                .values("date", "value", "cumulative")
-            )
-
-            metric_count = filtered_metrics.count()
+        Returns:
+            tuple -- Lookups on the dates of the points, and on other fields
+        """
+        dates = {}
+        filters = {}
+        since = self.request.query_params.get("since", None)
 
-            if summarize and metric_count > summarize:
-                factor = ceil(metric_count / summarize)
+        if since is not None:
+            since = datetime.strptime(since, "%Y-%m-%dT%H:%M:%S.%fZ")
+            since = pytz.utc.localize(since)
+            dates["date__gte"] = since
 
-                new_metrics = []
-                temp_metric = None
+        for field in ("epoch", "rank"):
+            value = self.request.query_params.get(field, None)
 
-                count = 0
+            if value is not None:
+                filters[field] = int(value)
 
-                for metric in filtered_metrics:
-                    if not temp_metric:
-                        temp_metric = {
-                            "date": metric["date"],
-                            "value": 0.0,
-                            "cumulative": metric["cumulative"],
-                        }
-                    temp_metric["value"] += float(metric["value"])
-                    count += 1
+        return dates, filters
 
-                    if count % factor == 0:
-                        temp_metric["value"] = str(temp_metric["value"] / factor)
-                        new_metrics.append(temp_metric)
-                        temp_metric = None
+    def __series(self, pk, metric_type, metric_filter):
+        """Gets the series of a pod or run
 
-                filtered_metrics = new_metrics
-            result_metrics = list(filtered_metrics)
+        Arguments:
+            pk {string} -- Name of the pod or id of the run
+            metric_type {string} -- `pod` or `run`
+            metric_filter {string} -- Only get the series with this name, or None
 
-            if last_n:
-                result_metrics = result_metrics[-last_n:]
+        Returns:
+            QuerySet -- The series
+        """
+        if metric_type == "pod":
+            pod = KubePod.objects.filter(name=pk).first()
+            series = _annotate_series(pod.series.all())
+        else:
+            series = _run_series(ModelRun.objects.get(pk=pk))
 
-            if len(result_metrics) > 0:
-                result[name] = result_metrics
+        if metric_filter:
+            series = series.filter(name=metric_filter)
 
-        return result
+        return series
 
-    def __format_zip_result(self, metrics, q, summarize, last_n, prefix, zf):
-        names = metrics.values("name").distinct()
+    def __validators(self, pk, metric_type, series):
+        """Gets the ETag of the metrics of a pod or run from the versions of
+        their series, see `_series_versions`
 
-        for name in names:
-            name = name["name"]
-            if "TaskResult" in name:
-                continue
-
-            temp_filter = q & Q(name=name)
-            filtered_metrics = (
-                metrics.filter(temp_filter)
-                .order_by("date")
-                .values("date", "value", "cumulative")
-            )
+        Arguments:
+            pk {string} -- Name of the pod or id of the run
+            metric_type {string} -- `pod` or `run`
+            series {QuerySet} -- The series, see `__series`
 
-            metric_count = filtered_metrics.count()
+        Returns:
+            tuple -- The ETag, if the run has ended, and the versions of the
+                series
+        """
+        finished = metric_type == "run" and (
+            ModelRun.objects.filter(
+                pk=pk, state__in=[ModelRun.FINISHED, ModelRun.FAILED]
+            ).exists()
+        )
+        versions = _series_versions(series)
+        etag = _etag(
+            self.request.get_full_path(),
+            self.request.accepted_renderer.format,
+            finished,
+            versions,
+        )
 
-            if summarize and metric_count > summarize:
-                factor = ceil(metric_count / summarize)
+        return etag, finished, versions
 
-                new_metrics = []
-                temp_metric = None
+    def __format_result(self, series, dates, filters, summarize, last_n, downsample):
+        result = {}
+        series = list(series)
+        values = _read_series(series, dates, filters, summarize, last_n, downsample)
 
-                count = 0
+        for s in series:
+            result_metrics = values[s.id]
 
-                for metric in filtered_metrics:
-                    if not temp_metric:
-                        temp_metric = {
-                            "date": metric["date"],
-                            "value": 0.0,
-                            "cumulative": metric["cumulative"],
-                        }
-                    temp_metric["value"] += float(metric["value"])
-                    count += 1
+            if len(result_metrics) > 0:
+                result[s.name] = result_metrics
 
-                    if count % factor == 0:
-                        temp_metric["value"] = str(temp_metric["value"] / factor)
-                        new_metrics.append(temp_metric)
-                        temp_metric = None
+        return result
 
-                filtered_metrics = new_metrics
-            result_metrics = list(filtered_metrics)
+    def __format_zip_result(
+        self, series, dates, filters, summarize, last_n, downsample, prefix, zf
+    ):
+        series = [s for s in series if "TaskResult" not in s.name]
+        values = _read_series(series, dates, filters, summarize, last_n, downsample)
 
-            if last_n:
-                result_metrics = result_metrics[-last_n:]
+        for s in series:
+            result_metrics = values[s.id]
 
             if len(result_metrics) == 0:
                 continue
 
-            data = json.dumps(list(filtered_metrics), indent=4, cls=DjangoJSONEncoder)
+            data = json.dumps(result_metrics, indent=4, cls=DjangoJSONEncoder)
 
             with io.StringIO() as metrics_file:
                 metrics_file.write(data)
 
-                zf.writestr("{}_{}.json".format(prefix, name), metrics_file.getvalue())
+                zf.writestr(
+                    "{}_{}.json".format(prefix, s.name), metrics_file.getvalue()
+                )
 
         return zf
 
@@ -169,7 +739,11 @@ class KubeMetricsView(ViewSet):
                     for e in sorted(g[1], key=lambda x: x.date)
                 ]
                 for g in groupby(
-                    sorted(pod.metrics.all(), key=lambda m: m.name),
+                    sorted(
+                        list(KubeMetric.objects.filter(series__in=pod.series.all()))
+                        + chunked_metrics(pod.series.all()),
+                        key=lambda m: m.name,
+                    ),
                     key=lambda m: m.name,
                 )
             }
@@ -183,7 +757,12 @@ class KubeMetricsView(ViewSet):
                     for e in sorted(g[1], key=lambda x: x.date)
                 ]
                 for g in groupby(
-                    sorted(run.metrics.all(), key=lambda m: m.name),
+                    sorted(
+                        list(run.metrics.all())
+                        + archived_metrics(run.series.all())
+                        + chunked_metrics(run.series.all()),
+                        key=lambda m: m.name,
+                    ),
                     key=lambda m: m.name,
                 )
             }
@@ -208,43 +787,106 @@ class KubeMetricsView(ViewSet):
         Returns:
             Json -- Object containing all metrics for the pod
         """
-        q = Q()
-        since = self.request.query_params.get("since", None)
-
-        if since is not None:
-            since = datetime.strptime(since, "%Y-%m-%dT%H:%M:%S.%fZ")
-            since = pytz.utc.localize(since)
-            q &= Q(date__gte=since)
-
+        dates, filters = self.__lookups()
         summarize = self.request.query_params.get("summarize", None)
 
         if summarize is not None:
-            summarize = int(summarize)
+            try:
+                summarize = int(summarize)
+            except ValueError:
+                summarize = 0
 
-        metric_filter = self.request.query_params.get("metric_filter", None)
+            if summarize < 1:
+                return Response(
+                    {
+                        "status": "ERROR",
+                        "message": "summarize has to be a positive number",
+                    },
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
 
-        if metric_filter:
-            q &= Q(name=metric_filter)
+        downsample = self.request.query_params.get("downsample", "mean")
+
+        if downsample not in DOWNSAMPLE_MODES:
+            return Response(
+                {
+                    "status": "ERROR",
+                    "message": "Unknown downsample mode {}".format(downsample),
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
 
+        metric_filter = self.request.query_params.get("metric_filter", None)
         last_n = self.request.query_params.get("last_n", None)
 
         if last_n:
             last_n = int(last_n)
 
         metric_type = self.request.query_params.get("metric_type", "pod")
+        series = self.__series(pk, metric_type, metric_filter)
 
-        if metric_type == "pod":
-            pod = KubePod.objects.filter(name=pk).first()
-            metrics = pod.metrics
-        else:
-            run = ModelRun.objects.get(pk=pk)
-            metrics = run.metrics
+        cursor = self.request.query_params.get("cursor", None)
+
+        if request.accepted_renderer.format != "zip":
+            # before reading, so the metrics are at least as new as the ETag
+            etag, ended, versions = self.__validators(pk, metric_type, series)
+            not_modified = _not_modified(request, etag)
+
+            if not_modified is not None:
+                return not_modified
+
+            # responses about ended runs are cached, see `api.utils.metric_cache`
+            params = _cache_params(self.request.query_params.dict(), versions)
+            cacheable = ended and request.accepted_renderer.format == "json"
+            cached = get_cached(pk, params) if cacheable and not cursor else None
+
+            if cached is not None:
+                response = HttpResponse(
+                    cached["body"], content_type=request.accepted_renderer.media_type
+                )
+
+                if "cursor" in cached:
+                    response[CURSOR_HEADER] = cached["cursor"].decode()
+
+                return _cache_headers(response, etag)
+
+        if request.accepted_renderer.format != "zip" and cursor is not None:
+            # polling, see `api.utils.metric_cursor`
+            try:
+                state = decode_cursor(cursor) if cursor else None
+            except ValueError:
+                return Response(
+                    {"status": "ERROR", "message": "Invalid cursor"},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+
+            result, state = _read_polled(
+                list(series), state, dates, filters, summarize, last_n, downsample
+            )
+            response = Response(result, status=status.HTTP_200_OK)
+            response[CURSOR_HEADER] = encode_cursor(state)
+
+            if cacheable and not cursor:
+                body = request.accepted_renderer.render(result)
+                set_cached(
+                    pk, params, {"body": body, "cursor": response[CURSOR_HEADER]}
+                )
+
+            return _cache_headers(response, etag)
 
         if request.accepted_renderer.format != "zip":
             # generate json
-            result = self.__format_result(metrics, q, summarize, last_n)
+            result = self.__format_result(
+                series, dates, filters, summarize, last_n, downsample
+            )
+            response = Response(result, status=status.HTTP_200_OK)
+
+            if cacheable:
+                set_cached(
+                    pk, params, {"body": request.accepted_renderer.render(result)}
+                )
 
-            return Response(result, status=status.HTTP_200_OK)
+            return _cache_headers(response, etag)
 
         result_file = io.BytesIO()
 
@@ -261,33 +903,47 @@ class KubeMetricsView(ViewSet):
                 since = run.created_at
                 until = run.finished_at
 
-                q &= Q(date__gte=since)
+                dates["date__gte"] = max(since, dates.get("date__gte", since))
 
                 if until:
-                    q &= Q(date__lte=until)
+                    dates["date__lte"] = until
 
                 zf = self.__format_zip_result(
-                    metrics, q, summarize, last_n, "result", zf
+                    series, dates, filters, summarize, last_n, downsample, "result", zf
                 )
-                try:
-                    task_result = metrics.get(name="TaskResult @ 0")
+                task_result = run.series.filter(name="TaskResult @ 0").first()
+
+                values = []
+
+                if task_result is not None:
+                    values = series_points(task_result, {}, VALUE_FIELDS)
 
+                if values:
                     with io.StringIO() as task_result_file:
-                        task_result_file.write(task_result.value)
+                        task_result_file.write(_format_metric(values[0])["value"])
 
                         zf.writestr("official_result.txt", task_result_file.getvalue())
-                except ObjectDoesNotExist:
-                    pass
 
                 for pod in pods:
-                    pod_metrics = pod.metrics
+                    pod_series = pod.series.all()
+
+                    if metric_filter:
+                        pod_series = pod_series.filter(name=metric_filter)
+
                     zf = self.__format_zip_result(
-                        pod_metrics, q, summarize, last_n, pod.name, zf
+                        pod_series,
+                        dates,
+                        filters,
+                        summarize,
+                        last_n,
+                        downsample,
+                        pod.name,
+                        zf,
                     )
 
             else:
                 zf = self.__format_zip_result(
-                    metrics, q, summarize, last_n, "result", zf
+                    series, dates, filters, summarize, last_n, downsample, "result", zf
                 )
                 pod = KubePod.objects.filter(name=pk).first()
                 filename = secure_filename(pod.name)
@@ -302,38 +958,80 @@ class KubeMetricsView(ViewSet):
             return response
 
     def create(self, request):
-        """Create a new metric
+        """Create a new metric, or a batch of metrics
+
+        A JSON array of metrics is inserted as a batch. Metrics in a batch
+        may belong to different runs, invalid items are reported per item
+        and don't prevent the valid ones from being saved.
+
+        An `application/x-ndjson` body (one metric per line) is parsed while
+        it is read and inserted in fixed-size chunks, for uploads too large
+        to be held in memory.
+
+        If `settings.METRICS_WRITE_BEHIND` is set, metrics are appended to a
+        redis stream instead and inserted by a background drainer (202).
 
         Arguments:
             request {[Django request]} -- The request object
 
         Returns:
-            Json -- Returns posted values
+            Json -- Returns posted values, or a summary for batches
         """
 
         d = request.data
+
+        # With write-behind enabled, metrics are only validated and buffered
+        if settings.METRICS_WRITE_BEHIND:
+            ingest = buffer_metrics
+            success_status = status.HTTP_202_ACCEPTED
+        else:
+            ingest = create_metrics
+            success_status = status.HTTP_201_CREATED
+
+        if request.content_type.startswith(NDJSONParser.media_type):
+            created, failed, errors = stream_metrics(d, ingest=ingest)
+
+            return Response(
+                {"created": created, "failed": failed, "errors": errors},
+                status=success_status
+                if created or not failed
+                else status.HTTP_400_BAD_REQUEST,
+            )
+
+        if isinstance(d, list):
+            metrics, errors = ingest(d)
+
+            return Response(
+                {"created": len(metrics), "errors": errors},
+                status=success_status
+                if metrics or not errors
+                else status.HTTP_400_BAD_REQUEST,
+            )
+
         if "run_id" in d:
-            run = ModelRun.objects.get(pk=d["run_id"])
+            runs = resolve_runs([d])
 
-            if run is None:
+            if not runs:
                 return Response(
                     {"status": "Not Found", "message": "Run not found"},
                     status=status.HTTP_404_NOT_FOUND,
                 )
 
-            metric = KubeMetric(
-                name=d["name"],
-                date=parse_datetime(d["date"]),
-                value=d["value"],
-                metadata=d["metadata"],
-                cumulative=d["cumulative"],
-                model_run=run,
-            )
-            metric.save()
+            metrics, errors = ingest([d], runs=runs)
+
+            if errors:
+                return Response(
+                    {
+                        "status": "Bad Request",
+                        "message": errors[0]["message"],
+                        "data": d,
+                    },
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
 
-            serializer = KubeMetricsSerializer(metric, many=False)
+            serializer = KubeMetricsSerializer(metrics[0], many=False)
 
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+            return Response(serializer.data, status=success_status)
 
         else:
             return Response(
@@ -345,6 +1043,219 @@ class KubeMetricsView(ViewSet):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
+    @action(detail=False, methods=["get"])
+    def buffer(self, request, format=None):
+        """Get the state of the write-behind metric buffer
+
+        Arguments:
+            request {[Django request]} -- The request object
+
+        Keyword Arguments:
+            format {string} -- Output format to use (default: {None})
+
+        Returns:
+            Json -- Number of buffered and pending metrics and the drain lag
+        """
+        return Response(buffer_status(), status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=["get"])
+    def compare(self, request, format=None):
+        """Compare the metrics of several runs on a common grid
+
+        The points of each run are positioned by the seconds since the run was
+        created, or by their epoch, and resampled to the same grid positions.
+
+        Arguments:
+            request {[Django request]} -- The request object
+
+        Keyword Arguments:
+            format {string} -- Output format to use (default: {None})
+
+        Returns:
+            Json -- Object containing the grid and the resampled metrics of
+                each run
+        """
+        params = self.request.query_params
+        names = [name for name in params.get("metrics", "").split(",") if name]
+        align = params.get("align", "time")
+
+        try:
+            run_ids = [int(r) for r in params.get("runs", "").split(",") if r]
+            points = min(max(int(params.get("points", 200)), 2), MAX_COMPARE_POINTS)
+        except ValueError:
+            run_ids = []
+
+        if not run_ids or not names or align not in ("time", "epoch"):
+            return Response(
+                {
+                    "status": "ERROR",
+                    "message": "runs and metrics have to be comma separated lists, "
+                    "align one of time or epoch",
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        runs = {run.id: run for run in ModelRun.objects.filter(id__in=run_ids)}
+        series = list(
+            _annotate_series(
+                MetricSeries.objects.filter(
+                    model_run_id__in=runs, name__in=names, pod__isnull=True
+                )
+            )
+        )
+        values = read_points(series, {}, ["date", "value", "epoch"])
+        coordinates = {}
+
+        for s in series:
+            if align == "time":
+                start = runs[s.model_run_id].created_at
+                xy = [
+                    ((p["date"] - start).total_seconds(), p["value"])
+                    for p in values[s.id]
+                    if p["value"] is not None
+                ]
+            else:
+                xy = [
+                    (p["epoch"], p["value"])
+                    for p in values[s.id]
+                    if p["value"] is not None and p["epoch"] is not None
+                ]
+
+            if xy:
+                coordinates[s] = np.array(xy, dtype=float).T
+
+        end = max((x.max() for x, _ in coordinates.values()), default=0)
+
+        if align == "time":
+            step = end / (points - 1) if end > 0 else 1
+            size = points
+        else:
+            # a position per epoch, or per group of epochs for long runs
+            step = max(ceil((end + 1) / points), 1)
+            size = int(end // step) + 1
+
+        result = {run.id: {"name": run.name, "metrics": {}} for run in runs.values()}
+
+        for s, (x, y) in coordinates.items():
+            result[s.model_run_id]["metrics"][s.name] = [
+                None if np.isnan(v) else v for v in resample(x, y, step, size).tolist()
+            ]
+
+        return Response(
+            {
+                "align": align,
+                "grid": (np.arange(size) * step).tolist(),
+                "runs": result,
+            },
+            status=status.HTTP_200_OK,
+        )
+
+    @action(detail=True, methods=["get"])
+    def aggregate(self, request, pk=None, format=None):
+        """Aggregate the metrics of a pod or run into time buckets
+
+        Arguments:
+            request {[Django request]} -- The request object
+
+        Keyword Arguments:
+            pk {string} -- Name of the pod or id of the run
+            format {string} -- Output format to use (default: {None})
+
+        Returns:
+            Json -- Object containing the buckets of each metric
+        """
+        try:
+            seconds = parse_bucket(self.request.query_params.get("bucket", ""))
+        except ValueError:
+            return Response(
+                {
+                    "status": "ERROR",
+                    "message": "bucket has to be a duration like 10s, 1m, 1h or 1d",
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        functions = [
+            function
+            for param in self.request.query_params.getlist("fn", ["mean"])
+            for function in param.split(",")
+        ]
+        unknown = [f for f in functions if f not in FUNCTIONS]
+
+        if unknown:
+            return Response(
+                {
+                    "status": "ERROR",
+                    "message": "Unknown functions {}".format(", ".join(unknown)),
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        dates, filters = self.__lookups()
+        series = list(
+            self.__series(
+                pk,
+                self.request.query_params.get("metric_type", "pod"),
+                self.request.query_params.get("metric_filter", None),
+            )
+        )
+        buckets = aggregate_series(series, dates, filters, seconds, functions)
+
+        return Response(
+            {s.name: buckets[s.id] for s in series if buckets[s.id]},
+            status=status.HTTP_200_OK,
+        )
+
+    @action(detail=True, methods=["get"])
+    def stats(self, request, pk=None, format=None):
+        """Get statistics of the metrics of a pod or run, e.g. the final
+        accuracy or peak memory, without their values
+
+        Arguments:
+            request {[Django request]} -- The request object
+
+        Keyword Arguments:
+            pk {string} -- Name of the pod or id of the run
+            format {string} -- Output format to use (default: {None})
+
+        Returns:
+            Json -- Object containing the statistics of each metric
+        """
+        dates, filters = self.__lookups()
+        metric_type = self.request.query_params.get("metric_type", "pod")
+        series = self.__series(
+            pk, metric_type, self.request.query_params.get("metric_filter", None)
+        )
+        etag, ended, versions = self.__validators(pk, metric_type, series)
+        not_modified = _not_modified(request, etag)
+
+        if not_modified is not None:
+            return not_modified
+
+        # responses about ended runs are cached, see `api.utils.metric_cache`
+        params = dict(
+            _cache_params(self.request.query_params.dict(), versions), action="stats"
+        )
+        cacheable = ended and request.accepted_renderer.format == "json"
+        cached = get_cached(pk, params) if cacheable else None
+
+        if cached is not None:
+            response = HttpResponse(
+                cached["body"], content_type=request.accepted_renderer.media_type
+            )
+
+            return _cache_headers(response, etag)
+
+        series = list(series)
+        values = series_stats(series, dates, filters)
+        result = {s.name: values[s.id] for s in series if s.id in values}
+        response = Response(result, status=status.HTTP_200_OK)
+
+        if cacheable:
+            set_cached(pk, params, {"body": request.accepted_renderer.render(result)})
+
+        return _cache_headers(response, etag)
+
 
 class ModelRunView(ViewSet):
     """Handles Model Runs"""
@@ -384,13 +1295,35 @@ class ModelRunView(ViewSet):
             Json -- Object containing all metrics for the pod
         """
         run = ModelRun.objects.get(pk=pk)
+        finished = run.state in (ModelRun.FINISHED, ModelRun.FAILED)
+        job = None
+        validators = [run.id, run.name, run.state, run.finished_at, run.job_id]
+
+        if not finished:
+            # the job only changes its metadata while the run is going on
+            redis_conn = django_rq.get_connection()
+            job = Job.fetch(run.job_id, redis_conn)
+            validators += [
+                (k, len(v) if isinstance(v, (list, dict, str)) else v)
+                for k, v in sorted(job.meta.items())
+            ]
+
+        etag = _etag(request.accepted_renderer.format, *validators)
+        not_modified = _not_modified(request, etag, run.finished_at)
+
+        if not_modified is not None:
+            return not_modified
+
+        if job is None:
+            redis_conn = django_rq.get_connection()
+            job = Job.fetch(run.job_id, redis_conn)
 
-        redis_conn = django_rq.get_connection()
-        job = Job.fetch(run.job_id, redis_conn)
         run.job_metadata = job.meta
 
         serializer = ModelRunSerializer(run, many=False)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        response = Response(serializer.data, status=status.HTTP_200_OK)
+
+        return _cache_headers(response, etag, run.finished_at)
 
     def create(self, request):
         """Create and start a new Model run
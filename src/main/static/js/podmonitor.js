@@ -1,5 +1,5 @@
-var PodMonitor = function(parent_id, metric_selector, target_element, metric_type, api_url, max_points){
-    this.node_data = {'last_metrics_update': new Date(0)};
+var PodMonitor = function(parent_id, metric_selector, target_element, metric_type, api_url, max_points, downsample){
+    this.node_data = {'metrics_cursor': ''};
     this.nodeRefreshInterval = 5 * 1000;
     this.metricsRefreshInterval = 10 * 1000;
     this.renderInterval = 5 * 1000;
@@ -10,6 +10,7 @@ var PodMonitor = function(parent_id, metric_selector, target_element, metric_typ
     this.api_url = api_url;
     this.metrics = [];
     this.max_points = max_points;
+    this.downsample = downsample || 'mean';
     this.fetching = false;
 
     this.updateMetrics = function(){
@@ -19,6 +20,7 @@ var PodMonitor = function(parent_id, metric_selector, target_element, metric_typ
         var api_url = this.api_url;
         var metrics_names = this.metrics;
         var max_points = this.max_points;
+        var downsample = this.downsample;
         var parent = this;
 
         if(parent.fetching){
@@ -28,10 +30,11 @@ var PodMonitor = function(parent_id, metric_selector, target_element, metric_typ
         parent.fetching = true;
 
         $.getJSON(api_url + parent_id + "/",
-            {since: value['last_metrics_update'].toJSON(),
+            {cursor: value['metrics_cursor'],
             metric_type: metric_type,
-            summarize: max_points},
-            function(data){
+            summarize: max_points,
+            downsample: downsample},
+            function(data, status, xhr){
                 if(!('node_metrics' in value)){
                     value['node_metrics'] = [];
                 }
@@ -44,9 +47,11 @@ var PodMonitor = function(parent_id, metric_selector, target_element, metric_typ
                         metrics_names.push(key);
                     }
                     value['node_metrics'][key] = value['node_metrics'][key].concat(values);
-                    value['last_metrics_update'] = new Date();
                 });
 
+                // only the metrics added since are returned next time
+                value['metrics_cursor'] = xhr.getResponseHeader('X-Metrics-Cursor');
+
                 parent.fetching = false;
             });
     }
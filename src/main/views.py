@@ -16,7 +16,7 @@ def index(request):
 
 def worker(request, pod_name):
     worker = KubePod.objects.get(name=pod_name)
-    metrics = worker.metrics.order_by("name").values("name").distinct()
+    metrics = worker.series.order_by("name").values("name")
     return render(
         request, "main/worker_detail.html", {"worker": worker, "metrics": metrics}
     )
@@ -63,6 +63,6 @@ def run(request, run_id):
 
     run.job_metadata = job.meta
 
-    metrics = run.metrics.order_by("name").values("name").distinct()
+    metrics = run.series.order_by("name").values("name")
 
     return render(request, "main/run_detail.html", {"run": run, "metrics": metrics})
@@ -168,6 +168,44 @@ else:
 
     # RQ_REDIS_ENABLED = True
 
+# Buffer posted metrics in a redis stream and insert them in the background
+# (see api/utils/metric_buffer.py)
+METRICS_WRITE_BEHIND = os.environ.get("MLBENCH_METRICS_WRITE_BEHIND", "") == "true"
+
+# Approximate maximum number of metrics in the buffer, the oldest ones are
+# dropped beyond that so a stopped drainer can't fill up redis
+METRICS_BUFFER_MAXLEN = int(os.environ.get("MLBENCH_METRICS_BUFFER_MAXLEN", 1000000))
+
+# Partition the metric table by month on postgres and drop the partitions
+# older than the retention period (see api/utils/metric_partitions.py)
+METRICS_PARTITIONING = os.environ.get("MLBENCH_METRICS_PARTITIONING", "") == "true"
+METRICS_RETENTION_MONTHS = int(os.environ.get("MLBENCH_METRICS_RETENTION_MONTHS", 0))
+
+# Tiers of (resolution, keep) in seconds for the resource usage metrics of
+# pods: raw points for a day, 1 minute means for 30 days, then hourly means
+# (see api/utils/metric_rollups.py)
+POD_METRICS_RETENTION = [
+    (0, 24 * 60 * 60),
+    (60, 30 * 24 * 60 * 60),
+    (60 * 60, None),
+]
+
+# Seconds after the last metric of a finished or failed run until its metrics
+# are archived (see api/utils/metric_archive.py), None to keep them as rows
+METRICS_ARCHIVE_DELAY = (
+    int(os.environ["MLBENCH_METRICS_ARCHIVE_DELAY"])
+    if os.environ.get("MLBENCH_METRICS_ARCHIVE_DELAY")
+    else None
+)
+
+# Store plain numeric metrics in Gorilla encoded chunks instead of a row per
+# point (see api/utils/metric_chunks.py)
+METRICS_CHUNK_STORAGE = os.environ.get("MLBENCH_METRICS_CHUNK_STORAGE", "") == "true"
+
+# Maximum size in bytes of the redis cache of metric queries about ended runs,
+# 0 to disable it (see api/utils/metric_cache.py)
+METRICS_CACHE_SIZE = int(os.environ.get("MLBENCH_METRICS_CACHE_SIZE", 0))
+
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
@@ -2,25 +2,31 @@ import asyncio
 import datetime
 import json
 import random
+import tempfile
 
 import requests
 
 url = "http://10.192.0.2:30260/api/metrics/"
 
-for i in range(25000):
-    data = {
-        "run_id": 1,
-        "name": "test_metric @ {}".format(0),  # random.randint(0, 7)),
-        "cumulative": False,
-        "date": str(datetime.datetime.now()),
-        "value": str(random.random() * 100),
-        "metadata": {"epoch": i, "rank": 0},
-    }
+# Send all metrics in a single NDJSON upload instead of one POST per metric
+with tempfile.TemporaryFile() as body:
+    for i in range(25000):
+        data = {
+            "run_id": 1,
+            "name": "test_metric @ {}".format(0),  # random.randint(0, 7)),
+            "cumulative": False,
+            "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "value": str(random.random() * 100),
+            "metadata": {"epoch": i, "rank": 0},
+        }
 
-    requests.post(url, data=data)
+        body.write(json.dumps(data).encode("utf-8") + b"\n")
 
-    if i % 1000 == 0:
-        print(i)
+    body.seek(0)
+    response = requests.post(
+        url, data=body, headers={"Content-Type": "application/x-ndjson"}
+    )
+    print(response.json())
 
 
 # async def main():